@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+# Candles of intervals not served by Binance (2w, 3w, custom sessions...) built from the klines of a
+# native interval, updated with every kline instead of merging all of them on every check.
+from candles import Candle
+
+class Timeframe:
+    """Candles of `multiple` klines of a native `base` interval lasting `base_duration` ms, opening
+    at `anchor` (ms) and every `multiple * base_duration` ms from it."""
+
+    __slots__ = ('name', 'base', 'base_duration', 'multiple', 'duration', 'anchor')
+
+    def __init__(self, name, base, base_duration, multiple, anchor=0):
+        self.name = name
+        self.base = base
+        self.base_duration = base_duration
+        self.multiple = multiple
+        self.duration = base_duration * multiple
+        self.anchor = anchor
+
+    def open_time(self, timestamp):
+        """Open time (ms) of the candle containing `timestamp` (ms)."""
+        return timestamp - (timestamp - self.anchor) % self.duration
+
+    def next_open_time(self, timestamp):
+        return self.open_time(timestamp) + self.duration
+
+    def klines_limit(self, timestamp, candles=2):
+        """Base klines covering the current candle and the `candles - 1` previous ones."""
+        first_open_time = self.open_time(timestamp) - (candles - 1) * self.duration
+        return (timestamp - first_open_time) // self.base_duration + 1
+
+class CandleAggregator:
+    """Last closed and current candles of a timeframe, updated kline by kline. Updates of the same
+    kline are merged too: its high and low only grow, its close replaces the previous one and only
+    its volume growth is added."""
+
+    __slots__ = ('timeframe', 'last', 'current', 'kline_open_time', 'kline_volume')
+
+    def __init__(self, timeframe, klines=()):
+        self.timeframe = timeframe
+        self.last = None
+        self.current = None
+        self.kline_open_time = None
+        self.kline_volume = 0.0
+        for kline in klines:
+            self.update(kline)
+
+    def update(self, kline):
+        """Merge a base kline (Candle), older klines are ignored."""
+        if (self.kline_open_time is not None and kline.open_time < self.kline_open_time):
+            return False
+        open_time = self.timeframe.open_time(kline.open_time)
+        if (self.current is None or self.current.open_time < open_time):
+            # Only the previous candle is kept when there is a gap between both
+            if (self.current is not None):
+                self.last = self.current if self.current.open_time == open_time - self.timeframe.duration else None
+            self.current = Candle(open_time, kline.open, kline.high, kline.low, kline.close, kline.volume, open_time + self.timeframe.duration - 1)
+        else:
+            self.current.high = max(self.current.high, kline.high)
+            self.current.low = min(self.current.low, kline.low)
+            self.current.close = kline.close
+            self.current.volume += kline.volume - (self.kline_volume if kline.open_time == self.kline_open_time else 0.0)
+        self.kline_open_time = kline.open_time
+        self.kline_volume = kline.volume
+        return True
+
+    def candles(self):
+        """[last candle, current candle] as get_last_binance_candles returns them."""
+        return [self.last.copy() if self.last else None, self.current.copy() if self.current else None]
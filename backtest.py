@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+
+# Offline replay of the open candle strategy (trade_the_open) over the klines store: candle turns,
+# retries on new lows, fibonacci targets ladder and stop loss moves. Every trade candle is replayed
+# kline by kline of a finer base interval, all the candles of all the pairs in the same NumPy
+# operations, so a year of every perpetual takes seconds.
+# Usage: python3 klinestore.py --all --intervals HOUR --start 2023-01-01
+#        python3 backtest.py --all --interval DAY --base HOUR --target 2 --side long
+import argparse
+import time
+import numpy as np
+
+import liquidity
+from liquidity import Intervals, Markets, MarketSide, INTERVAL_MILLISECONDS, DAY_MILLISECONDS, MINUTE_MILLISECONDS
+from klinestore import KlineStore, KLINES_STORE_ROOT
+from simple_chalk import white, green, red, yellow
+
+# Fee of every fill (entry, take profits and stops) as a fraction of its notional
+TAKER_FEE = 0.0004
+
+OUTCOMES = ('none', 'aborted', 'stop', 'partial', 'target', 'closed')
+RESULT_DTYPE = np.dtype([('symbol', 'U20'), ('open_time', 'i8'), ('entries', 'i1'), ('outcome', 'U8'), ('return', 'f8')])
+
+def candle_rows(klines, interval, base):
+    """Complete `interval` candles of the base klines as (open times, { 'open', 'high', 'low',
+    'close' }), every row is a candle and every column one of its base klines."""
+    duration = INTERVAL_MILLISECONDS[interval]
+    base_duration = INTERVAL_MILLISECONDS[base]
+    open_times = np.asarray(klines['open_time'])
+    candle_open_times = liquidity.candle_open_time(interval, open_times)
+    candles, index = np.unique(candle_open_times, return_inverse=True)
+    column = (open_times - candle_open_times) // base_duration
+    rows = {}
+    for name in ('open', 'high', 'low', 'close'):
+        rows[name] = np.full((len(candles), duration // base_duration), np.nan)
+        rows[name][index, column] = klines[name]
+    complete = ~np.isnan(rows['close']).any(axis=1)
+    return candles[complete], { name: row[complete] for name, row in rows.items() }
+
+def replay(rows, last, side=MarketSide.LONG, target=1, window=None, max_risk=None, max_entries=liquidity.MAX_ORDER_RETRIES, fee=TAKER_FEE):
+    """Replay the candles `rows` (see candle_rows) following their `last` candles ({ 'open', 'high',
+    'low', 'close' } arrays). Entries are checked on the close of every base kline within the first
+    `window` ones, take profits and stops until the candle closes, when what is left is closed at
+    market. A kline reaching both the stop and a target is taken as stopped.
+    Returns (entries, outcome index of OUTCOMES, return on the notional of every entry)."""
+    max_risk = liquidity.MAX_STOP_LOSS_RISK if max_risk is None else max_risk
+    # Shorts are replayed as longs of the negated prices
+    if (side == MarketSide.SHORT):
+        o, h, l, c = -rows['open'], -rows['low'], -rows['high'], -rows['close']
+        lo, lh, lc = -last['open'], -last['low'], -last['close']
+    else:
+        o, h, l, c = rows['open'], rows['high'], rows['low'], rows['close']
+        lo, lh, lc = last['open'], last['high'], last['close']
+    size, steps = o.shape
+    window = steps if window is None else min(window, steps)
+
+    # Fibonacci targets of the last candle and the take profits ladder
+    targets = liquidity.fib_retracement(np.where(lo < lc, lc, lo), lh)
+    levels = np.stack([targets[key] for key in sorted(targets)], axis=1)
+    ladder = [(key, weight) for item in liquidity.WEIGHTED_TARGETS[target] for key, weight in item.items()]
+    take_profits = np.stack([targets[key] for key, weight in ladder], axis=1)
+    weights = [weight for key, weight in ladder]
+
+    rows_index = np.arange(size)
+    cc_open = o[:, 0]
+    cc_low = np.full(size, np.inf)
+    entries = np.zeros(size, dtype=np.int8)
+    last_red = np.ones(size, dtype=bool)
+    last_low = np.full(size, np.inf)
+    in_position = np.zeros(size, dtype=bool)
+    entry = np.ones(size)
+    stop = np.zeros(size)
+    remaining = np.zeros(size)
+    filled = np.zeros(size, dtype=np.int8)
+    partial = np.zeros(size, dtype=bool)
+    stopped = np.zeros(size, dtype=bool)
+    aborted = np.zeros(size, dtype=bool)
+    reached = np.zeros(size, dtype=bool)
+    returns = np.zeros(size)
+
+    def take_profits_filled(mask, price):
+        """Fill the next take profits of the `mask` positions reaching `price`, in ladder order."""
+        nonlocal returns, remaining
+        for index, weight in enumerate(weights):
+            fill = mask & in_position & (filled == index) & (price >= take_profits[:, index])
+            returns += np.where(fill, weight * ((np.maximum(take_profits[:, index], entry) - entry) / np.abs(entry) - fee), 0)
+            remaining = np.where(fill, remaining - weight, remaining)
+            filled[fill] += 1
+            partial[fill] = True
+        # Stop loss moves to breakeven, then to the target before the last one filled
+        moved = in_position & (filled > 0)
+        stop[moved] = np.where(filled[moved] == 1, entry[moved], levels[rows_index[moved], np.maximum(filled[moved] - 2, 0)])
+        done = in_position & (filled == len(weights))
+        reached[done] = True
+        in_position[done] = False
+
+    for step in range(steps):
+        cc_low = np.minimum(cc_low, l[:, step])
+        cc_close = c[:, step]
+
+        # Stop losses first, then take profits
+        hit = in_position & (l[:, step] <= stop)
+        returns += np.where(hit, remaining * ((stop - entry) / np.abs(entry) - fee), 0)
+        remaining = np.where(hit, 0, remaining)
+        stopped |= hit & ~partial
+        in_position &= ~hit
+        take_profits_filled(in_position, h[:, step])
+
+        if (step >= window):
+            continue
+        # Candle turning green (red for shorts) with a lower low than the last entry
+        can_enter = ~in_position & ~aborted & ~reached & ~partial & (entries < max_entries)
+        turned = (cc_open < cc_close) & (cc_open >= cc_low)
+        enter = can_enter & turned & last_red & (cc_low < last_low)
+        last_red = np.where(can_enter & ~turned, True, np.where(enter, False, last_red))
+        last_low = np.where(enter, cc_low, last_low)
+
+        risk = (cc_open - cc_low) / np.abs(cc_open if side == MarketSide.SHORT else cc_low) * 100
+        risky = enter & (risk >= max_risk)
+        aborted |= risky
+        enter &= ~risky
+        entries += enter
+        entry = np.where(enter, cc_close, entry)
+        stop = np.where(enter, cc_low, stop)
+        remaining = np.where(enter, 1.0, remaining)
+        filled = np.where(enter, 0, filled).astype(np.int8)
+        returns -= np.where(enter, fee, 0)
+        in_position |= enter
+        # Take profits already passed are sold at market on the entry
+        take_profits_filled(enter, cc_close)
+
+    # What is left is closed with the candle
+    returns += np.where(in_position, remaining * ((c[:, -1] - entry) / np.abs(entry) - fee), 0)
+    outcome = np.zeros(size, dtype=np.int8)
+    outcome[entries > 0] = OUTCOMES.index('closed')
+    outcome[stopped & ~in_position] = OUTCOMES.index('stop')
+    outcome[partial] = OUTCOMES.index('partial')
+    outcome[reached] = OUTCOMES.index('target')
+    outcome[aborted & (entries == 0)] = OUTCOMES.index('aborted')
+    return entries, outcome, returns
+
+def statistics(results):
+    """Aggregate statistics of the candles traded, returns are fractions of the notional."""
+    traded = np.sort(results[results['entries'] > 0], order='open_time')
+    returns = traded['return']
+    wins = returns[returns > 0]
+    losses = returns[returns < 0]
+    equity = np.cumsum(returns)
+    return {
+        'candles': len(results),
+        'trades': len(traded),
+        'entries': int(traded['entries'].sum()),
+        'win_rate': round(len(wins) / len(traded) * 100, 2) if len(traded) else 0,
+        'mean': round(float(returns.mean()) * 100, 3) if len(traded) else 0,
+        'total': round(float(returns.sum()) * 100, 2),
+        'profit_factor': round(float(wins.sum() / -losses.sum()), 2) if len(losses) else float('inf'),
+        'max_drawdown': round(float((np.maximum.accumulate(np.maximum(equity, 0)) - equity).max()) * 100, 2) if len(traded) else 0,
+        'outcomes': { name: int((results['outcome'] == name).sum()) for name in OUTCOMES[1:] },
+    }
+
+def backtest(store, symbols, interval=Intervals.DAY, base=None, side=MarketSide.LONG, target=1, market=Markets.FUTURES, fee=TAKER_FEE, window_hours=None):
+    """Replay every stored candle of the symbols, returns a RESULT_DTYPE array with one row per candle."""
+    interval = Intervals(interval)
+    base = Intervals(base) if base is not None else default_base(interval)
+    if (interval == Intervals.MONTH or INTERVAL_MILLISECONDS[interval] % INTERVAL_MILLISECONDS[base] != 0):
+        raise ValueError('{} candles can not be replayed from {} klines.'.format(interval.value, base.value))
+    window_hours = window_hours or liquidity.TRADE_WINDOW_HOURS.get(interval.value, liquidity.DEFAULT_TRADE_WINDOW_HOURS)
+    window = window_hours * 60 * MINUTE_MILLISECONDS // INTERVAL_MILLISECONDS[base]
+
+    lanes_symbols, lanes_open_times, lanes_rows, lanes_last = [], [], [], []
+    for symbol in symbols:
+        open_times, rows = candle_rows(store.read(symbol, base, market), interval, base)
+        # Only candles following a complete one are traded
+        following = np.flatnonzero(open_times[1:] - open_times[:-1] == INTERVAL_MILLISECONDS[interval]) + 1
+        lanes_symbols.append(np.full(len(following), symbol, dtype='U20'))
+        lanes_open_times.append(open_times[following])
+        lanes_rows.append({ name: row[following] for name, row in rows.items() })
+        lanes_last.append({ 'open': rows['open'][following - 1, 0], 'high': rows['high'][following - 1].max(axis=1), 'low': rows['low'][following - 1].min(axis=1), 'close': rows['close'][following - 1, -1] })
+
+    results = np.zeros(sum(len(open_times) for open_times in lanes_open_times), dtype=RESULT_DTYPE)
+    if (not len(results)):
+        return results
+    rows = { name: np.concatenate([lane[name] for lane in lanes_rows]) for name in ('open', 'high', 'low', 'close') }
+    last = { name: np.concatenate([lane[name] for lane in lanes_last]) for name in ('open', 'high', 'low', 'close') }
+    entries, outcome, returns = replay(rows, last, side, target, window, fee=fee)
+    results['symbol'] = np.concatenate(lanes_symbols)
+    results['open_time'] = np.concatenate(lanes_open_times)
+    results['entries'] = entries
+    results['outcome'] = np.array(OUTCOMES)[outcome]
+    results['return'] = returns
+    return results
+
+def default_base(interval):
+    return Intervals.HOUR if INTERVAL_MILLISECONDS[interval] >= DAY_MILLISECONDS else Intervals.FIVETEEN_MINUTES
+
+def print_results(results, stats, quantity=None, leverage=1, trades=20):
+    traded = results[results['entries'] > 0]
+    print(white.bold(f'\nLast {min(trades, len(traded))} trades:'))
+    for result in np.sort(traded, order='open_time')[-trades:]:
+        color = green.bold if result['return'] > 0 else red.bold
+        pnl = ' ({} USDT)'.format(round(result['return'] * quantity * leverage, 2)) if quantity else ''
+        print(color('\t{} {} {} entries, {}: {}%{}'.format(liquidity.format_time(int(result['open_time'])), result['symbol'], result['entries'], result['outcome'], round(result['return'] * 100, 2), pnl)))
+    print(white.bold(f'\n{stats["trades"]} candles traded of {stats["candles"]} ({stats["entries"]} entries): {stats["outcomes"]}'))
+    print(white.bold(f'Win rate {stats["win_rate"]}%, mean {stats["mean"]}%, total {stats["total"]}%, profit factor {stats["profit_factor"]}, max drawdown {stats["max_drawdown"]}% of the notional.'))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backtest the open candle strategy over the stored klines.')
+    parser.add_argument('--pair', type=str, nargs='+', help='Symbols to backtest (BTCUSDT...).')
+    parser.add_argument('--all', action='store_true', help='Backtest every symbol stored.')
+    parser.add_argument('--interval', type=Intervals.from_string, choices=list(Intervals), help='Candle timeframe to trade.', default=Intervals.DAY)
+    parser.add_argument('--base', type=Intervals.from_string, choices=list(Intervals), help='Stored klines the candles are replayed with, HOUR (FIVETEEN_MINUTES under a day) by default.')
+    parser.add_argument('--market', type=Markets.from_string, help='Market of the symbols.', default=Markets.FUTURES)
+    parser.add_argument('--side', type=MarketSide.from_string, help='Type of order to be executed.', default=MarketSide.LONG)
+    parser.add_argument('--target', type=int, help='Fibonnacci target to reach.', default=4)
+    parser.add_argument('--risk', type=int, help='Risk to take with the trade.', default=liquidity.MAX_STOP_LOSS_RISK)
+    parser.add_argument('--fee', type=float, help='Fee of every fill.', default=TAKER_FEE)
+    parser.add_argument('--window', type=int, help='Hours from the candle open new entries are allowed.')
+    parser.add_argument('--quantity', type=float, help='Quantity in USD of every entry, to show the PnL in USDT.')
+    parser.add_argument('--leverage', type=int, help='Leverage of every entry.', default=1)
+    parser.add_argument('--root', type=str, help='Directory of the klines store.', default=KLINES_STORE_ROOT)
+    args = parser.parse_args()
+
+    liquidity.MAX_STOP_LOSS_RISK = args.risk
+    store = KlineStore(args.root)
+    base = args.base or default_base(args.interval)
+    symbols = store.symbols(base, args.market) if args.all else (args.pair or [])
+    if (not len(symbols)):
+        print(yellow.bold(f'No {base.value} klines stored, download them first with klinestore.py.'))
+    backtest_start = time.perf_counter()
+    results = backtest(store, symbols, args.interval, base, args.side, args.target, args.market, args.fee, args.window)
+    print(white.bold(f'Backtest of {len(symbols)} pairs took {round(time.perf_counter() - backtest_start, 2)} seconds.'))
+    print_results(results, statistics(results), args.quantity, args.leverage)
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+
+# Candles parsed once from the klines responses: Candle records for single candles and NumPy
+# structured arrays for batches, so every consumer reads named float fields instead of strings.
+# DOC: https://binance-docs.github.io/apidocs/futures/en/#continuous-contract-kline-candlestick-data
+import json
+import numpy as np
+
+# orjson decodes klines responses several times faster when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CANDLE_DTYPE = np.dtype([('open_time', 'i8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8'), ('volume', 'f8'), ('close_time', 'i8')])
+
+class Candle:
+    """Open time and close time in milliseconds, prices and volume as floats."""
+
+    __slots__ = ('open_time', 'open', 'high', 'low', 'close', 'volume', 'close_time')
+
+    def __init__(self, open_time, open, high, low, close, volume=0.0, close_time=0):
+        self.open_time = open_time
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.close_time = close_time
+
+    @classmethod
+    def from_kline(cls, kline):
+        """Candle of a raw [open time, open, high, low, close, volume, close time, ...] kline."""
+        return cls(int(kline[0]), float(kline[1]), float(kline[2]), float(kline[3]), float(kline[4]), float(kline[5]) if len(kline) > 5 else 0.0, int(kline[6]) if len(kline) > 6 else 0)
+
+    def copy(self):
+        return Candle(self.open_time, self.open, self.high, self.low, self.close, self.volume, self.close_time)
+
+    def as_tuple(self):
+        return (self.open_time, self.open, self.high, self.low, self.close, self.volume, self.close_time)
+
+    def __eq__(self, other):
+        return isinstance(other, Candle) and self.as_tuple() == other.as_tuple()
+
+    def __repr__(self):
+        return 'Candle({}, {}, {}, {}, {})'.format(self.open_time, self.open, self.high, self.low, self.close)
+
+def loads(content):
+    """Decode a JSON response body (bytes or str)."""
+    if (orjson is not None):
+        return orjson.loads(content)
+    return json.loads(content)
+
+def parse_klines(content):
+    """Candles of a klines response body."""
+    return [Candle.from_kline(kline) for kline in loads(content)]
+
+def candles_array(candles):
+    """Structured array (CANDLE_DTYPE) of candles, columns are read as array['close']..."""
+    return np.array([candle.as_tuple() for candle in candles], dtype=CANDLE_DTYPE)
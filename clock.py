@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+# DOC: https://binance-docs.github.io/apidocs/futures/en/#check-server-time
+# Exchange server time, so candle opens are waited for on the exchange clock and not on the local one.
+import threading
+import time
+
+from simple_chalk import red, white
+from transport import TRANSPORT
+
+# Server time requests per sync, the one with the shortest round trip gives the offset
+CLOCK_SAMPLES = 5
+# The offset is synced again in background once older than this (seconds)
+CLOCK_SYNC_INTERVAL = 30 * 60
+
+class ServerClock:
+    """Local clock corrected with its offset to the exchange server time. The offset is taken from
+    the middle of the fastest of `samples` round trips, its error is at most half of that round trip."""
+
+    def __init__(self, url, samples=CLOCK_SAMPLES, sync_interval=CLOCK_SYNC_INTERVAL):
+        self.url = url
+        self.samples = samples
+        self.sync_interval = sync_interval
+        self.offset = 0
+        self.round_trip = None
+        self.synced = None
+        self.syncing = False
+        self.lock = threading.Lock()
+
+    def sync(self):
+        best = None
+        for sample in range(self.samples):
+            start = time.time()
+            server_time = TRANSPORT.get(self.url).json()['serverTime']
+            end = time.time()
+            if (best is None or end - start < best[0]):
+                best = (end - start, server_time - (start + end) / 2 * 1000)
+        with self.lock:
+            self.round_trip = best[0] * 1000
+            self.offset = best[1]
+            self.synced = time.monotonic()
+            self.syncing = False
+        print(white.bold(f'Clock offset to server time: {round(self.offset, 1)} ms (± {round(self.round_trip / 2, 1)} ms).'))
+        return self.offset
+
+    def background_sync(self):
+        try:
+            self.sync()
+        except Exception as e:
+            with self.lock:
+                self.syncing = False
+            print(red.bold(f'x Server time could not be synced ({e})'))
+
+    def now(self):
+        """Server time in milliseconds. Synced on the first call, then in background once stale; the
+        local clock is used when the server time can not be requested."""
+        with self.lock:
+            stale = self.synced is not None and time.monotonic() - self.synced > self.sync_interval and not self.syncing
+            if (self.synced is None or stale):
+                self.syncing = True
+        if (self.synced is None):
+            self.background_sync()
+            with self.lock:
+                # Not tried again on every call when the server time is unreachable
+                self.synced = self.synced or time.monotonic()
+        elif (stale):
+            threading.Thread(target=self.background_sync, daemon=True).start()
+        return int(time.time() * 1000 + self.offset)
+
+    def wait(self, event, timeout):
+        """Sleep `timeout` seconds or until the event is set (a replay clock jumps them instead)."""
+        return event.wait(timeout)
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+# DOC: https://binance-docs.github.io/apidocs/futures/en/#exchange-information
+# Exchange information cached and indexed by symbol, so orders are prepared without requesting it.
+import threading
+import time
+
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+from simple_chalk import red
+from transport import TRANSPORT
+
+# Exchange information is refreshed in background once it is older than this (seconds)
+EXCHANGE_INFO_TTL = 60 * 60
+
+class SymbolInfo:
+    """Trading rules of a symbol with Decimal quantizers for its price tick and lot step."""
+
+    __slots__ = ('symbol', 'status', 'contract_type', 'tick_size', 'step_size', 'market_step_size', 'min_quantity', 'min_notional')
+
+    def __init__(self, item):
+        filters = { item_filter['filterType']: item_filter for item_filter in item.get('filters', []) }
+        self.symbol = item['symbol']
+        self.status = item.get('status')
+        self.contract_type = item.get('contractType')
+        self.tick_size = Decimal(filters.get('PRICE_FILTER', {}).get('tickSize', '0.00000001')).normalize()
+        self.step_size = Decimal(filters.get('LOT_SIZE', {}).get('stepSize', '0.00000001')).normalize()
+        self.market_step_size = Decimal(filters.get('MARKET_LOT_SIZE', {}).get('stepSize', self.step_size)).normalize()
+        self.min_quantity = Decimal(filters.get('LOT_SIZE', {}).get('minQty', '0'))
+        # Futures name it notional, spot minNotional (MIN_NOTIONAL or NOTIONAL filter)
+        notional = filters.get('MIN_NOTIONAL', filters.get('NOTIONAL', {}))
+        self.min_notional = Decimal(notional.get('notional', notional.get('minNotional', '0')))
+
+    @staticmethod
+    def quantize(value, step, rounding):
+        steps = (Decimal(str(value)) / step).to_integral_value(rounding=rounding)
+        return format((steps * step).quantize(step), 'f')
+
+    def price(self, value):
+        """Price rounded to the nearest tick, as a string ready for an order."""
+        return self.quantize(value, self.tick_size, ROUND_HALF_UP)
+
+    def quantity(self, value, market=False):
+        """Quantity rounded down to the lot step (market lot step for market orders), so it is never
+        bigger than the quantity asked."""
+        return self.quantize(value, self.market_step_size if market else self.step_size, ROUND_DOWN)
+
+    def valid_quantity(self, quantity, price):
+        """Whether an order of `quantity` at `price` passes the minimum quantity and notional."""
+        quantity = Decimal(str(quantity))
+        return quantity >= self.min_quantity and quantity * Decimal(str(price)) >= self.min_notional
+
+class ExchangeInfo:
+    """Exchange information of a market requested once and indexed by symbol. Once older than `ttl`
+    it is still used while it is refreshed in background, only the first lookup waits for it."""
+
+    def __init__(self, url, ttl=EXCHANGE_INFO_TTL):
+        self.url = url
+        self.ttl = ttl
+        self.index = {}
+        self.updated = None
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def refresh(self):
+        return self.load(TRANSPORT.get(self.url).json())
+
+    def load(self, exchange_info):
+        """Index an exchangeInfo response, requested or saved to disk for offline use."""
+        index = { item['symbol']: SymbolInfo(item) for item in exchange_info['symbols'] }
+        with self.lock:
+            self.index = index
+            self.updated = time.monotonic()
+            self.refreshing = False
+        return index
+
+    def background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            with self.lock:
+                self.refreshing = False
+            print(red.bold(f'x Exchange information could not be refreshed ({e})'))
+
+    def get(self):
+        """Symbols index, requested only when there is none yet."""
+        with self.lock:
+            index = self.index
+            stale = self.updated is not None and time.monotonic() - self.updated > self.ttl and not self.refreshing
+            if (stale):
+                self.refreshing = True
+        if (self.updated is None):
+            return self.refresh()
+        if (stale):
+            threading.Thread(target=self.background_refresh, daemon=True).start()
+        return index
+
+    def symbol(self, symbol):
+        """SymbolInfo of the symbol, KeyError when it is not listed."""
+        return self.get()[symbol]
+
+    def symbols(self):
+        """All the SymbolInfo in exchange information order."""
+        return list(self.get().values())
@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+# Historical klines store: closed klines of every symbol and interval are downloaded once, then only
+# the new ones are appended. Every column is a fixed-width little endian binary file, read back as
+# memory-mapped NumPy arrays without copying or parsing them.
+# Layout: <root>/<market>/<interval>/<SYMBOL>/<column>.bin, columns as candles.CANDLE_DTYPE, and
+#         <root>/<market>/exchangeInfo.json with the trading rules for offline paper trading
+# Usage: python3 klinestore.py --pair BTCUSDT ETHUSDT --intervals HOUR DAY --start 2021-01-01
+#        python3 klinestore.py --all --top-volume 50 --intervals DAY
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import liquidity
+from liquidity import Intervals, Markets
+from candles import CANDLE_DTYPE, candles_array, parse_klines
+from transport import TRANSPORT
+from simple_chalk import white, green, red
+
+KLINES_STORE_ROOT = os.environ.get('KLINES_STORE', 'klines')
+# Columns as stored on disk, little endian whatever the machine
+COLUMNS = { name: CANDLE_DTYPE[name].newbyteorder('<') for name in CANDLE_DTYPE.names }
+
+class KlineStore:
+    """Klines of every (symbol, interval, market) in a directory of column files. Columns are
+    appended one after the other, so after an interrupted append they are cut to the shortest one."""
+
+    def __init__(self, root=KLINES_STORE_ROOT):
+        self.root = root
+
+    def path(self, symbol, interval, market=Markets.FUTURES):
+        return os.path.join(self.root, Markets(market).value, Intervals(interval).value, symbol)
+
+    def column_path(self, symbol, interval, market, name):
+        return os.path.join(self.path(symbol, interval, market), '{}.bin'.format(name))
+
+    def length(self, symbol, interval, market=Markets.FUTURES):
+        """Klines stored, 0 when there are none."""
+        lengths = []
+        for name, dtype in COLUMNS.items():
+            path = self.column_path(symbol, interval, market, name)
+            lengths.append(os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0)
+        return min(lengths)
+
+    def repair(self, symbol, interval, market=Markets.FUTURES):
+        """Cut every column to the klines stored in all of them."""
+        length = self.length(symbol, interval, market)
+        for name, dtype in COLUMNS.items():
+            path = self.column_path(symbol, interval, market, name)
+            if (os.path.exists(path) and os.path.getsize(path) != length * dtype.itemsize):
+                os.truncate(path, length * dtype.itemsize)
+        return length
+
+    def append(self, symbol, interval, market, klines):
+        """Append a CANDLE_DTYPE array of klines."""
+        os.makedirs(self.path(symbol, interval, market), exist_ok=True)
+        for name, dtype in COLUMNS.items():
+            with open(self.column_path(symbol, interval, market, name), 'ab') as column:
+                column.write(np.ascontiguousarray(klines[name], dtype=dtype).tobytes())
+
+    def read(self, symbol, interval, market=Markets.FUTURES):
+        """{ column: read only memory-mapped array }, klines[i] of every column is the same kline."""
+        length = self.length(symbol, interval, market)
+        if (not length):
+            return { name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items() }
+        return { name: np.memmap(self.column_path(symbol, interval, market, name), dtype=dtype, mode='r', shape=(length,)) for name, dtype in COLUMNS.items() }
+
+    def last_open_time(self, symbol, interval, market=Markets.FUTURES):
+        """Open time (ms) of the last kline stored, None when there are none."""
+        length = self.length(symbol, interval, market)
+        if (not length):
+            return None
+        with open(self.column_path(symbol, interval, market, 'open_time'), 'rb') as column:
+            column.seek((length - 1) * COLUMNS['open_time'].itemsize)
+            return int(np.frombuffer(column.read(COLUMNS['open_time'].itemsize), dtype=COLUMNS['open_time'])[0])
+
+    def exchange_info_path(self, market=Markets.FUTURES):
+        return os.path.join(self.root, Markets(market).value, 'exchangeInfo.json')
+
+    def save_exchange_info(self, market, exchange_info):
+        os.makedirs(os.path.dirname(self.exchange_info_path(market)), exist_ok=True)
+        with open(self.exchange_info_path(market), 'w') as file:
+            json.dump(exchange_info, file)
+
+    def exchange_info(self, market=Markets.FUTURES):
+        """Saved exchangeInfo response of the market, None when there is none."""
+        if (not os.path.exists(self.exchange_info_path(market))):
+            return None
+        with open(self.exchange_info_path(market)) as file:
+            return json.load(file)
+
+    def symbols(self, interval, market=Markets.FUTURES):
+        path = os.path.join(self.root, Markets(market).value, Intervals(interval).value)
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+def get_klines_page(symbol, interval, market, start_time, limit):
+    """CANDLE_DTYPE array of up to `limit` klines opened from `start_time` (ms)."""
+    if (market == Markets.SPOT):
+        url = '{}{}?symbol={}&interval={}&limit={}&startTime={}'.format(liquidity.BINANCE_SPOT_BASE_URL, liquidity.BINANCE_SPOT_KLINES_ENDPOINT, symbol, interval, limit, start_time)
+    else:
+        url = '{}{}?pair={}&interval={}&limit={}&startTime={}&contractType=PERPETUAL'.format(liquidity.BINANCE_FUTURES_BASE_URL, liquidity.BINANCE_FUTURES_KLINES_ENDPOINT, symbol, interval, limit, start_time)
+    return candles_array(parse_klines(TRANSPORT.get(url).content))
+
+def download(store, symbol, interval, market=Markets.FUTURES, start_time=0):
+    """Append the klines closed after the last one stored (or from `start_time`), paging forward.
+    Returns the number of klines appended."""
+    interval = Intervals(interval)
+    if (interval not in liquidity.NATIVE_INTERVALS):
+        raise ValueError('{} klines are not served by Binance, store {} ones instead.'.format(interval.value, liquidity.get_base_interval([interval]).value))
+    limit = liquidity.MAX_SPOT_KLINES_LIMIT if market == Markets.SPOT else liquidity.MAX_KLINES_LIMIT
+
+    store.repair(symbol, interval, market)
+    last_open_time = store.last_open_time(symbol, interval, market)
+    start_time = last_open_time + 1 if last_open_time is not None else start_time
+    now = int(time.time() * 1000)
+    appended = 0
+    while True:
+        page = get_klines_page(symbol, interval.value, market, start_time, limit)
+        closed = page[page['close_time'] < now]
+        if (len(closed)):
+            store.append(symbol, interval, market, closed)
+            appended += len(closed)
+            start_time = int(closed['open_time'][-1]) + 1
+        if (len(closed) < limit):
+            return appended
+
+def download_all(store, symbols, intervals, market=Markets.FUTURES, start_time=0, workers=liquidity.SCAN_WORKERS):
+    """Download every symbol and interval using at most `workers` requests at the same time."""
+    jobs = [(symbol, Intervals(interval)) for symbol in symbols for interval in intervals]
+
+    def job(item):
+        symbol, interval = item
+        try:
+            appended = download(store, symbol, interval, market, start_time)
+            print('\t * {} {}: {} klines appended.'.format(symbol, interval.value, appended))
+            return appended
+        except Exception as e:
+            print(red.bold(f'\t x {symbol} {interval.value} klines could not be downloaded ({e})'))
+            return 0
+
+    download_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        appended = sum(executor.map(job, jobs))
+    print(green.bold(f'✓ {appended} klines of {len(symbols)} pairs and {len(intervals)} intervals stored in {round(time.perf_counter() - download_start, 2)} seconds ({liquidity.futures_weight_used()} request weight used this minute).'))
+    return appended
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Download historical klines to a local memory-mapped store.')
+    parser.add_argument('--pair', type=str, nargs='+', help='Symbols to download (BTCUSDT...).')
+    parser.add_argument('--all', action='store_true', help='Download every perpetual futures symbol.')
+    parser.add_argument('--min-volume', type=float, help='Minimum 24h quote volume (USDT) of the pairs to download (with --all).')
+    parser.add_argument('--top-volume', type=int, help='Download only the N pairs with the highest 24h quote volume (with --all).')
+    parser.add_argument('--intervals', type=Intervals.from_string, nargs='+', choices=list(Intervals), help='Candle timeframes to download.', default=[Intervals.DAY])
+    parser.add_argument('--market', type=Markets.from_string, help='Market of the symbols.', default=Markets.FUTURES)
+    parser.add_argument('--start', type=str, help='UTC date (YYYY-MM-DD) of the first kline when nothing is stored yet, from the listing by default.')
+    parser.add_argument('--root', type=str, help='Directory of the store.', default=KLINES_STORE_ROOT)
+    parser.add_argument('--workers', type=int, help='Maximum concurrent requests.', default=liquidity.SCAN_WORKERS)
+    args = parser.parse_args()
+
+    symbols = args.pair or []
+    if (args.all):
+        symbols = liquidity.get_perpetual_symbols(args.min_volume, args.top_volume)
+    start_time = 0
+    if (args.start):
+        start_time = int((datetime.strptime(args.start, '%Y-%m-%d') - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+    print(white.bold(f'Downloading {len(symbols)} pairs at {", ".join(interval.value for interval in args.intervals)} to {args.root}.'))
+    store = KlineStore(args.root)
+    download_all(store, symbols, args.intervals, args.market, start_time, args.workers)
+    # Trading rules are kept along the klines, so paper trading replays need no network
+    exchange_info_url = liquidity.FUTURES_EXCHANGE_INFO.url if args.market == Markets.FUTURES else liquidity.SPOT_EXCHANGE_INFO.url
+    store.save_exchange_info(args.market, TRANSPORT.get(exchange_info_url).json())
@@ -3,82 +3,127 @@
 # DOC: https://binance-docs.github.io/apidocs/futures/en/#continuous-contract-kline-candlestick-data
 # Usage: python3 liquidity.py --pair XMR --quantity 10 --interval HOUR --leverage 2 
 import sys
-import requests
 import time
+import atexit
 import argparse
 import os
+import threading
+import uuid
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from binance_f import RequestClient
 from binance_f.constant.test import *
 from binance_f.base.printobject import *
 from binance_f.model.constant import *
+from binance_f.impl import restapiinvoker
+from binance_f.exception.binanceapiexception import BinanceApiException
 from decimal import Decimal
+from urllib.parse import urlparse
 from dotenv import load_dotenv
+from requests.exceptions import ReadTimeout
 from enum import Enum
 from simple_chalk import yellow, red, green, white
+from clock import ServerClock
+from exchange import ExchangeInfo
+from aggregation import Timeframe, CandleAggregator
+from candles import Candle, candles_array, parse_klines
+from ranking import rank_wicks, wick_percentages
+from transport import TRANSPORT, install
+from streams import KlineStream, UserDataStream
 
 load_dotenv()
+# Signed requests of the binance_f clients share the pooled transport too
+install(restapiinvoker)
 
 API_KEY = os.environ.get('API_KEY')
 SECRET_KEY = os.environ.get('SECRET_KEY')
+# Url of a running scanner (scanner.py) answering best trades checks instead of scanning
+SCANNER_URL = os.environ.get('SCANNER_URL')
 
 MAX_ORDER_RETRIES = 3
+# Attempts to look up an order whose response timed out
+ORDER_LOOKUP_RETRIES = 3
+# Attempts to place a moved stop loss, and to cancel the replaced one
+STOP_MOVE_RETRIES = 3
 
 SLEEP_TIMEOUT = 15
-START_INTERVAL = 0
-END_INTERVAL = 8
-FIRST_TRY = True
+
+# Candles are polled every OPEN_POLL seconds for OPEN_BURST seconds from their open, then every
+# trade sleep timeout. Until the open the trades sleep.
+OPEN_POLL = 0.25
+OPEN_BURST = 30
+# Hours a trade is kept from its candle open. Intervals in NEXT_CANDLE_INTERVALS trade the next
+# candle, the others the current one while it is in the window
+TRADE_WINDOW_HOURS = { '1h': 2, '2h': 3, '4h': 5, '6h': 7, '12h': 13 }
+DEFAULT_TRADE_WINDOW_HOURS = 17
+NEXT_CANDLE_INTERVALS = ('1h', '2h', '4h', '6h', '12h')
 
 MAX_STOP_LOSS_RISK = 3
 
+# Take profits ladder of every fibonacci target: { target: [{ fibonacci level: quantity weight }] }
+WEIGHTED_TARGETS = {
+    1: [{ 1: 1}],
+    2: [{ 1: 0.25 }, { 2: 0.75 }],
+    3: [{1: 0.25}, {2: 0.25}, {3: 0.50}],
+    4: [{1: 0.20},{2: 0.20},{3: 0.20},{4: 0.40},
+    ]
+}
+
+# Maximum number of symbols fetched at the same time when checking best trades
+SCAN_WORKERS = 16
+
 # Futures environment variables
 BINANCE_FUTURES_BASE_URL = "https://fapi.binance.com"
 BINANCE_FUTURES_KLINES_ENDPOINT = "/fapi/v1/continuousKlines"
 BINANCE_FUTURES_EXCHANGE_INFO_ENDPOINT = "/fapi/v1/exchangeInfo"
+BINANCE_FUTURES_TICKER_ENDPOINT = "/fapi/v1/ticker/24hr"
+BINANCE_FUTURES_TIME_ENDPOINT = "/fapi/v1/time"
 
 # Spot environment variables
 BINANCE_SPOT_BASE_URL = "https://api.binance.com"
 BINANCE_SPOT_CREATE_ORDER_ENDPOINT = "/api/v3/order/test"
 BINANCE_SPOT_KLINES_ENDPOINT = "/api/v3/klines"
 BINANCE_SPOT_EXCHANGE_INFO_ENDPOINT = "/api/v3/exchangeInfo"
+BINANCE_SPOT_TICKER_ENDPOINT = "/api/v3/ticker/24hr"
 
-RETRIES = 0
-
-LAST_CANDLE_RED = True
-LAST_CANDLE_GREEN = True
+# Exchange information of every market, requested once and refreshed in background
+FUTURES_EXCHANGE_INFO = ExchangeInfo(BINANCE_FUTURES_BASE_URL + BINANCE_FUTURES_EXCHANGE_INFO_ENDPOINT)
+SPOT_EXCHANGE_INFO = ExchangeInfo(BINANCE_SPOT_BASE_URL + BINANCE_SPOT_EXCHANGE_INFO_ENDPOINT)
+# Candle opens are scheduled on the exchange clock
+SERVER_CLOCK = ServerClock(BINANCE_FUTURES_BASE_URL + BINANCE_FUTURES_TIME_ENDPOINT)
+# Clock of the trade loop (now() in ms and wait(event, seconds)), replaced by the replay clock when paper trading
+CLOCK = SERVER_CLOCK
 
-LAST_LOW_PRICE = 999999
-LAST_HIGH_PRICE = 0
+# User data stream listen keys expire after 60 minutes without a keepalive
+USER_STREAM_KEEPALIVE = 30 * 60
 
-STOP_LOSS_REACHED = False
-STOP_LOSS = 0
+# Maximum number of klines returned by a single request
+MAX_KLINES_LIMIT = 1500
+MAX_SPOT_KLINES_LIMIT = 1000
 
-CAN_CLEAR_STALE_ORDERS = False
+# Open orders of all pairs are requested at once (weight 40) from this number of pairs traded
+OPEN_ORDERS_ALL_PAIRS = 40
 
-TARGET_REACHED = False
-TARGET = 99999
-TARGETS = []
-
-STOP_LOSS_ORDER = None
-TAKE_PROFIT_ORDERS = []
-NEXT_STOP_LOSS = 0
-
-POSITION_ORDER_ID = None
-PRECISION = 0
-BREAKEVEN = None
-PARTIAL_TAKE_PROFIT_REACHED = False
+# Closed candles never change: they are cached per (market, pair, interval) until the next candle
+# opens, so polls only request the current one. Klines are taken as final this long (seconds) after
+# their close
+CLOSED_CANDLE_SETTLE = 2
+CLOSED_CANDLES = {}
 
 class Intervals(Enum):
     FIVETEEN_MINUTES = "15m"
     THIRTY_MINUTES = "30m"
     HOUR = "1h"
+    TWO_HOURS = "2h"
     FOUR_HOURS = "4h"
+    SIX_HOURS = "6h"
     TWELVE_HOURS = "12h"
     DAY = "1d"
     THREE_DAYS = "3d"
     WEEK = "1w"
     TWO_WEEKS = "2w"
+    THREE_WEEKS = "3w"
     MONTH = "1M"
 
     def __str__(self):
@@ -133,363 +178,895 @@ class MarketSide(Enum):
         except KeyError:
             raise ValueError()
 
-def check_best_trade(interval=Intervals.DAY):
-    request_client = RequestClient(api_key=API_KEY, secret_key=SECRET_KEY)
+MINUTE_MILLISECONDS = 60 * 1000
+DAY_MILLISECONDS = 24 * 60 * MINUTE_MILLISECONDS
+# Weekly candles open on monday, 2w candles are counted from monday 12th April 2021
+WEEK_REFERENCE = 4 * DAY_MILLISECONDS
+TWO_WEEKS_REFERENCE = 1618185600 * 1000
+
+INTERVAL_MILLISECONDS = {
+    Intervals.FIVETEEN_MINUTES: 15 * MINUTE_MILLISECONDS,
+    Intervals.THIRTY_MINUTES: 30 * MINUTE_MILLISECONDS,
+    Intervals.HOUR: 60 * MINUTE_MILLISECONDS,
+    Intervals.TWO_HOURS: 2 * 60 * MINUTE_MILLISECONDS,
+    Intervals.FOUR_HOURS: 4 * 60 * MINUTE_MILLISECONDS,
+    Intervals.SIX_HOURS: 6 * 60 * MINUTE_MILLISECONDS,
+    Intervals.TWELVE_HOURS: 12 * 60 * MINUTE_MILLISECONDS,
+    Intervals.DAY: DAY_MILLISECONDS,
+    Intervals.THREE_DAYS: 3 * DAY_MILLISECONDS,
+    Intervals.WEEK: 7 * DAY_MILLISECONDS,
+}
+
+# Intervals served by Binance klines endpoints, from the finest one
+NATIVE_INTERVALS = [Intervals.FIVETEEN_MINUTES, Intervals.THIRTY_MINUTES, Intervals.HOUR, Intervals.TWO_HOURS, Intervals.FOUR_HOURS, Intervals.SIX_HOURS, Intervals.TWELVE_HOURS, Intervals.DAY, Intervals.THREE_DAYS, Intervals.WEEK, Intervals.MONTH]
+
+# Intervals not served by Binance, built from a multiple of a native interval aligned to an anchor
+AGGREGATED_INTERVALS = {
+    Intervals.TWO_WEEKS: Timeframe(Intervals.TWO_WEEKS.value, Intervals.WEEK, INTERVAL_MILLISECONDS[Intervals.WEEK], 2, TWO_WEEKS_REFERENCE),
+    Intervals.THREE_WEEKS: Timeframe(Intervals.THREE_WEEKS.value, Intervals.WEEK, INTERVAL_MILLISECONDS[Intervals.WEEK], 3, WEEK_REFERENCE),
+}
+INTERVAL_MILLISECONDS.update({ interval: timeframe.duration for interval, timeframe in AGGREGATED_INTERVALS.items() })
+
+def candle_open_time(interval, timestamp):
+    """Open time (ms) of the `interval` candle containing `timestamp` (ms)."""
+    interval = Intervals(interval)
+    if (interval == Intervals.MONTH):
+        date = datetime.utcfromtimestamp(timestamp / 1000)
+        return int((datetime(date.year, date.month, 1) - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+    if (interval in AGGREGATED_INTERVALS):
+        return AGGREGATED_INTERVALS[interval].open_time(timestamp)
+
+    reference = 0
+    if (interval == Intervals.WEEK):
+        reference = WEEK_REFERENCE
+    duration = INTERVAL_MILLISECONDS[interval]
+    return timestamp - (timestamp - reference) % duration
+
+def next_candle_open_time(interval, timestamp):
+    """Open time (ms) of the `interval` candle following the one containing `timestamp` (ms)."""
+    interval = Intervals(interval)
+    open_time = candle_open_time(interval, timestamp)
+    if (interval == Intervals.MONTH):
+        date = datetime.utcfromtimestamp(open_time / 1000)
+        year, month = (date.year + 1, 1) if date.month == 12 else (date.year, date.month + 1)
+        return int((datetime(year, month, 1) - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return open_time + INTERVAL_MILLISECONDS[interval]
+
+def can_build_interval(base, interval):
+    """Whether `interval` candles can be built merging `base` candles."""
+    if (base == interval):
+        return True
+    if (interval in AGGREGATED_INTERVALS and AGGREGATED_INTERVALS[interval].base == base):
+        return True
+    if (base == Intervals.WEEK):
+        return False
+    if (base not in INTERVAL_MILLISECONDS or INTERVAL_MILLISECONDS[base] > DAY_MILLISECONDS):
+        return False
+    if (interval in AGGREGATED_INTERVALS):
+        timeframe = AGGREGATED_INTERVALS[interval]
+        return timeframe.anchor % INTERVAL_MILLISECONDS[base] == 0 and timeframe.duration % INTERVAL_MILLISECONDS[base] == 0
+    # Intervals up to a day are aligned to midnight, so they build every interval of a day or more
+    return interval == Intervals.MONTH or INTERVAL_MILLISECONDS[interval] % INTERVAL_MILLISECONDS[base] == 0
+
+def get_base_interval(intervals):
+    """Coarsest native interval able to build every interval of `intervals`."""
+    finest = min(intervals, key=lambda interval: INTERVAL_MILLISECONDS.get(interval, 31 * DAY_MILLISECONDS))
+    candidates = [interval for interval in NATIVE_INTERVALS if INTERVAL_MILLISECONDS.get(interval, 31 * DAY_MILLISECONDS) <= INTERVAL_MILLISECONDS.get(finest, 31 * DAY_MILLISECONDS)]
+    for base in reversed(candidates):
+        if all(can_build_interval(base, interval) for interval in intervals):
+            return base
+    return NATIVE_INTERVALS[0]
+
+def aggregate_candles(candles, open_time, close_time=None):
+    """Merge the candles opened at or after `open_time` (and before `close_time`) into a single one."""
+    selected = [candle for candle in candles if candle.open_time >= open_time and (close_time is None or candle.open_time < close_time)]
+    if (not len(selected)):
+        return None
+    cc_high = max(candle.high for candle in selected)
+    cc_low = min(candle.low for candle in selected)
+    cc_volume = sum(candle.volume for candle in selected)
+    return Candle(open_time, selected[0].open, cc_high, cc_low, selected[-1].close, cc_volume, selected[-1].close_time)
+
+def fetch_symbols_candles(symbols, interval, market=Markets.FUTURES, workers=SCAN_WORKERS, limit=None):
+    """Fetch last candles of every symbol using at most `workers` requests at the same time.
+    Without `limit` the last two candles are fetched as get_last_binance_candles does, otherwise
+    the last `limit` raw klines.
+    Result keeps the same order as `symbols`, failed requests return no candles."""
+    def fetch(symbol):
+        print('\t * Checking: {}'.format(symbol))
+        try:
+            if (limit is not None):
+                return get_binance_klines(symbol, interval, market, limit)
+            return get_last_binance_candles(symbol, interval, market)
+        except Exception as e:
+            print(red.bold(f'\t x Candles of {symbol} could not be fetched ({e})'))
+            return []
 
-    # Request info of all symbols to retrieve precision
-    response = requests.get(BINANCE_FUTURES_BASE_URL + BINANCE_FUTURES_EXCHANGE_INFO_ENDPOINT)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(fetch, symbols))
 
-    exchange_info = response.json()
+def filter_symbols_by_volume(symbols, min_volume=None, top=None, market=Markets.FUTURES):
+    """Keep symbols with a 24h quote volume over `min_volume` and/or the `top` ones by quote volume,
+    using a single 24h ticker request. Symbols keep their original order."""
+    if (min_volume is None and top is None):
+        return symbols
 
-    price_precision = 0
-    best_bullish_wicks = []
-    best_bearish_wicks = []
-    print('Number of pairs to check approximately: ', len(exchange_info['symbols']))
-    for item in exchange_info['symbols']:
-        if (not item['contractType'] == 'PERPETUAL'):
-            continue
-        print('\t * Checking: {}'.format(item['symbol']))
-        candles = get_last_binance_candles(item['symbol'], interval, Markets.FUTURES)
-        if (not len(candles) > 1):
-            continue
-        current_candle = candles[1]
-        cc_open = float(current_candle[1])
-        cc_high = float(current_candle[2])
-        cc_low = float(current_candle[3])
-        cc_close = float(current_candle[4])
-
-        if (cc_open < cc_close):
-            # Candle is green
-            diff = cc_high - cc_close
-            cc_wick = round((diff / cc_close) * 100, 2)
-            best_bullish_wicks.append({ 'wick': cc_wick, 'symbol': item['symbol'] })
-        else:
-            # Candle is red
-            diff = cc_close - cc_low
-            cc_wick = -round((diff / cc_low) * 100, 2)
-            best_bearish_wicks.append({ 'wick': cc_wick, 'symbol': item['symbol'] })
-
-    candles = get_last_binance_candles('BTCUSDT', interval, Markets.FUTURES)
-    current_candle = candles[1]
-    cc_open = float(current_candle[1])
-    cc_high = float(current_candle[2])
-    cc_low = float(current_candle[3])
-    cc_close = float(current_candle[4])
-    btc_green = None
-    btc_wick = None
-    if (cc_open < cc_close):
-        # Candle is green
-        diff = cc_high - cc_close
-        btc_wick = round((diff / cc_close) * 100, 2)
-        btc_green = True
+    if (market == Markets.SPOT):
+        response = TRANSPORT.get(BINANCE_SPOT_BASE_URL + BINANCE_SPOT_TICKER_ENDPOINT)
     else:
-        # Candle is red
-        diff = cc_close - cc_low
-        btc_wick = -round((diff / cc_low) * 100, 2)
-        btc_green = False
-
-    bullish_result = sorted(best_bullish_wicks, key=lambda k: k['wick'], reverse=True)
-    bearish_result = sorted(best_bearish_wicks, key=lambda k: k['wick'], reverse=False)
-    
+        response = TRANSPORT.get(BINANCE_FUTURES_BASE_URL + BINANCE_FUTURES_TICKER_ENDPOINT)
+    volumes = { ticker['symbol']: float(ticker['quoteVolume']) for ticker in response.json() }
+
+    candidates = [symbol for symbol in symbols if symbol in volumes]
+    if (min_volume is not None):
+        candidates = [symbol for symbol in candidates if volumes[symbol] >= min_volume]
+    if (top is not None):
+        candidates = set(sorted(candidates, key=lambda symbol: volumes[symbol], reverse=True)[0:top])
+    return [symbol for symbol in symbols if symbol in candidates]
+
+def get_perpetual_symbols(min_volume=None, top_volume=None):
+    """Perpetual futures symbols in exchangeInfo order, optionally filtered by 24h volume."""
+    exchange_symbols = FUTURES_EXCHANGE_INFO.symbols()
+
+    print('Number of pairs to check approximately: ', len(exchange_symbols))
+    symbols = [item.symbol for item in exchange_symbols if item.contract_type == 'PERPETUAL']
+    if (min_volume is not None or top_volume is not None):
+        symbols = filter_symbols_by_volume(symbols, min_volume, top_volume, Markets.FUTURES)
+        print(f'Pairs left after volume filter: {len(symbols)}')
+    return symbols
+
+def get_klines_limit(base, intervals, now):
+    """Number of `base` klines covering the current candle of every interval (and a clock drift)."""
+    first_open_time = min(candle_open_time(interval, now) for interval in intervals)
+    if (Intervals(base) == Intervals.MONTH):
+        first_open, current = datetime.utcfromtimestamp(first_open_time / 1000), datetime.utcfromtimestamp(now / 1000)
+        return (current.year - first_open.year) * 12 + current.month - first_open.month + 2
+    return (now - first_open_time) // INTERVAL_MILLISECONDS[Intervals(base)] + 2
+
+def query_scanner(url, interval, top=10):
+    """Ranking of the interval kept by a running scanner (scanner.py)."""
+    response = TRANSPORT.get('{}/ranking'.format(url.rstrip('/')), params={ 'interval': interval, 'top': top }, timeout=5)
+    response.raise_for_status()
+    return response.json()
+
+def check_best_trades_from_scanner(scanner, intervals):
+    """Print rankings answered by a running scanner and return them as a message, None if any
+    of them could not be queried."""
+    try:
+        query_start = time.perf_counter()
+        rankings = [query_scanner(scanner, Intervals(interval).value) for interval in intervals]
+        query_time = time.perf_counter() - query_start
+    except Exception as e:
+        print(red.bold(f'x Scanner at {scanner} could not be queried ({e}), scanning pairs.'))
+        return None
+
+    print(white.bold(f'Rankings of {rankings[0]["symbols"]} pairs answered by scanner in {round(query_time * 1000, 2)} ms.'))
+    messages = []
+    for ranking in rankings:
+        btc = ranking['btc'] or { 'green': None, 'wick': None }
+        messages.append(print_best_trades(ranking['interval'], btc['green'], btc['wick'], ranking['bullish'], ranking['bearish']))
+    return '\n'.join(messages)
+
+def futures_weight_used():
+    """'used/limit' request weight of the futures api in the current minute."""
+    headroom = TRANSPORT.governor.headroom().get(urlparse(BINANCE_FUTURES_BASE_URL).hostname)
+    if (headroom is None):
+        return '0'
+    return '{}/{}'.format(headroom['used'], headroom['limit'])
+
+def check_best_trade(interval=Intervals.DAY, workers=SCAN_WORKERS, min_volume=None, top_volume=None, scanner=SCANNER_URL):
+    if (scanner):
+        message = check_best_trades_from_scanner(scanner, [interval])
+        if (message is not None):
+            return message
+
+    symbols = get_perpetual_symbols(min_volume, top_volume)
+    scan_start = time.perf_counter()
+    symbols_candles = fetch_symbols_candles(symbols, interval, Markets.FUTURES, workers)
+    scan_time = time.perf_counter() - scan_start
+
+    # Current candle of every symbol as a single structured array
+    ranked_symbols = [symbol for symbol, candles in zip(symbols, symbols_candles) if len(candles) > 1]
+    current_candles = candles_array([candles[1] for candles in symbols_candles if len(candles) > 1])
+    bullish_result, bearish_result = rank_wicks(ranked_symbols, current_candles['open'], current_candles['high'], current_candles['low'], current_candles['close'], top=10)
+
+    if ('BTCUSDT' in ranked_symbols):
+        btc_candle = current_candles[ranked_symbols.index('BTCUSDT')]
+    else:
+        btc_candle = candles_array(get_last_binance_candles('BTCUSDT', interval, Markets.FUTURES)[1:2])[0]
+    btc_green, btc_wick = wick_percentages(btc_candle['open'], btc_candle['high'], btc_candle['low'], btc_candle['close'])
+    btc_wick = float(btc_wick)
+
+    print(white.bold(f'Scan of {len(symbols)} pairs took {round(scan_time, 2)} seconds ({workers} workers, {futures_weight_used()} request weight used this minute).'))
+    return print_best_trades(interval, btc_green, btc_wick, bullish_result, bearish_result)
+
+def check_best_trades(intervals, workers=SCAN_WORKERS, min_volume=None, top_volume=None, scanner=SCANNER_URL):
+    """Check best trades of several intervals at once, fetching each pair only once at the base
+    interval and building the current candle of every interval from it."""
+    intervals = [Intervals(interval) for interval in intervals]
+    if (scanner):
+        message = check_best_trades_from_scanner(scanner, intervals)
+        if (message is not None):
+            return message
+
+    base = get_base_interval(intervals)
+
+    symbols = get_perpetual_symbols(min_volume, top_volume)
+    # BTC candle is always shown, but only ranked if it passed the filters
+    rank_btc = 'BTCUSDT' in symbols
+    if (not rank_btc):
+        symbols.append('BTCUSDT')
+
+    now = int(time.time() * 1000)
+    limit = get_klines_limit(base, intervals, now)
+
+    scan_start = time.perf_counter()
+    symbols_candles = fetch_symbols_candles(symbols, base.value, Markets.FUTURES, workers, limit)
+    scan_time = time.perf_counter() - scan_start
+    print(white.bold(f'Scan of {len(symbols)} pairs at {base.value} for {len(intervals)} intervals took {round(scan_time, 2)} seconds ({workers} workers, {futures_weight_used()} request weight used this minute).'))
+
+    messages = []
+    for interval in intervals:
+        open_time = candle_open_time(interval, now)
+        ranked_symbols = []
+        current_candles = []
+        btc_candle = None
+        for symbol, candles in zip(symbols, symbols_candles):
+            current_candle = aggregate_candles(candles, open_time)
+            if (symbol == 'BTCUSDT'):
+                btc_candle = current_candle
+            if (current_candle is None or (symbol == 'BTCUSDT' and not rank_btc)):
+                continue
+            ranked_symbols.append(symbol)
+            current_candles.append(current_candle)
+        current_candles = candles_array(current_candles)
+        bullish_result, bearish_result = rank_wicks(ranked_symbols, current_candles['open'], current_candles['high'], current_candles['low'], current_candles['close'], top=10)
+
+        btc_green, btc_wick = None, None
+        if (btc_candle is not None):
+            btc_green, btc_wick = wick_percentages(btc_candle.open, btc_candle.high, btc_candle.low, btc_candle.close)
+            btc_wick = float(btc_wick)
+        messages.append(print_best_trades(interval.value, btc_green, btc_wick, bullish_result, bearish_result))
+    return '\n'.join(messages)
+
+def print_best_trades(interval, btc_green, btc_wick, bullish_result, bearish_result):
+    """Print the ranking and return it as an HTML message (Telegram bot)."""
     print(white.bold(f'Best options to trade the daily of {interval}'))
+    message = f'<b>Best options to trade the daily of {interval}</b>\n'
     if btc_green:
         print(green.bold(f'\tBTC bullish wick: {btc_wick}%'))
+        message += f'\tBTC bullish wick: {btc_wick}%\n'
     else:
         print(red.bold(f'\tBTC bearish wick: {btc_wick}%'))
+        message += f'\tBTC bearish wick: {btc_wick}%\n'
 
     print(white.bold('Best bullish wicks to trade found are:'))
-    for item in bullish_result[0:10]:
+    message += '<b>Best bullish wicks to trade found are:</b>\n'
+    for item in bullish_result:
         print(green.bold('\t{} -> {} % wick.'.format(item['symbol'], item['wick'])))
+        message += '\t<code>{} -> {} % wick.</code>\n'.format(item['symbol'], item['wick'])
 
     print(white.bold('Best bearish wicks to trade found are:'))
-    for item in bearish_result[0:10]:
+    message += '<b>Best bearish wicks to trade found are:</b>\n'
+    for item in bearish_result:
         print(red.bold('\t{} -> {} % wick.'.format(item['symbol'], item['wick'])))
+        message += '\t<code>{} -> {} % wick.</code>\n'.format(item['symbol'], item['wick'])
+    return message
+
+def get_symbol_info(pair, market=Markets.FUTURES):
+    """Cached trading rules (tick size, lot step, min notional) of the pair."""
+    if (market == Markets.FUTURES):
+        return FUTURES_EXCHANGE_INFO.symbol(pair)
+    return SPOT_EXCHANGE_INFO.symbol(pair)
+
+class Account:
+    """Binance account where trades are placed, with its own client and quantity (USD) to trade."""
 
-def move_stop_loss(pair, quantity_to_extract, new_stop):
-    global STOP_LOSS_ORDER
-    global PRECISION
-    request_client = RequestClient(api_key=API_KEY, secret_key=SECRET_KEY)
-    side = STOP_LOSS_ORDER["side"]
-    order_id = STOP_LOSS_ORDER["order_id"]
-    new_stop_with_precision = "{:0.0{}f}".format(float(new_stop), PRECISION)
-    sl_moved = False
-    print(white.bold(f'Moving stop loss with order id: {order_id} to {new_stop_with_precision}'))
+    __slots__ = ('name', 'request_client', 'quantity')
+
+    def __init__(self, name, request_client, quantity):
+        self.name = name
+        self.request_client = request_client
+        self.quantity = quantity
+
+    def __str__(self):
+        return self.name
+
+def load_accounts(names, quantity):
+    """Accounts from their <NAME>_API_KEY, <NAME>_SECRET_KEY and optional <NAME>_QUANTITY environment
+    variables. Without names, the account of API_KEY and SECRET_KEY."""
+    if (not names):
+        return [Account('main', RequestClient(api_key=API_KEY, secret_key=SECRET_KEY), quantity)]
+    accounts = []
+    for name in names:
+        prefix = name.upper()
+        api_key = os.environ.get(f'{prefix}_API_KEY')
+        secret_key = os.environ.get(f'{prefix}_SECRET_KEY')
+        if (api_key is None or secret_key is None):
+            raise ValueError(f'Missing {prefix}_API_KEY or {prefix}_SECRET_KEY of {name} account')
+        account_quantity = float(os.environ.get(f'{prefix}_QUANTITY', quantity))
+        accounts.append(Account(name, RequestClient(api_key=api_key, secret_key=secret_key), account_quantity))
+    return accounts
+
+class Position:
+    """Orders of a trade in one of its accounts."""
+
+    __slots__ = ('account', 'request_client', 'quantity',
+        'stop_loss_reached', 'stop_loss', 'can_clear_stale_orders', 'target_reached', 'target_price', 'targets',
+        'stop_loss_order', 'take_profit_orders', 'next_stop_loss', 'position_order_id', 'breakeven',
+        'partial_take_profit_reached', 'first_try', 'last_orders_check', 'order_tracker', 'open_orders', 'entry_time', 'protection_time', 'open_quantity', 'staged')
+
+    def __init__(self, account, side=MarketSide.LONG):
+        self.account = account
+        self.request_client = account.request_client
+        self.quantity = account.quantity
+        self.stop_loss_reached = False
+        self.stop_loss = 0
+        self.can_clear_stale_orders = False
+        self.target_reached = False
+        self.target_price = 0 if side == MarketSide.SHORT else 99999
+        self.targets = []
+        self.stop_loss_order = None
+        self.take_profit_orders = []
+        self.next_stop_loss = 0
+        self.position_order_id = None
+        self.breakeven = None
+        self.partial_take_profit_reached = False
+        self.first_try = True
+        self.last_orders_check = 0
+        self.order_tracker = None
+        self.open_orders = None
+        self.entry_time = None
+        self.protection_time = None
+        self.open_quantity = Decimal(0)
+        self.staged = None
+
+class Trade:
+    """State of the open candle trade of a pair, so a single process can trade several pairs. The
+    same trade is mirrored on every account, each of them with its own position."""
+
+    __slots__ = ('pair', 'interval', 'leverage', 'market', 'side', 'limit', 'target', 'positions',
+        'retries', 'last_candle_red', 'last_candle_green', 'last_low_price', 'last_high_price',
+        'sleep_timeout', 'start_time', 'end_time', 'finish_time', 'finished', 'aborted')
+
+    def __init__(self, pair, accounts, interval=Intervals.DAY.value, leverage=2, market=Markets.FUTURES, side=MarketSide.LONG, limit=0, target=1):
+        self.pair = pair + 'USDT' if market == Markets.FUTURES else pair
+        self.interval = interval
+        self.leverage = leverage
+        self.market = market
+        self.side = side
+        self.limit = limit
+        self.target = target
+        self.positions = [Position(account, side) for account in accounts]
+
+        self.retries = 0
+        self.last_candle_red = True
+        self.last_candle_green = True
+        self.last_low_price = 999999
+        self.last_high_price = 0
+        self.sleep_timeout = SLEEP_TIMEOUT
+        self.start_time = None
+        self.end_time = None
+        self.finish_time = None
+        self.finished = False
+        self.aborted = False
+        init(self)
+
+    @property
+    def target_reached(self):
+        return all(position.target_reached for position in self.positions)
+
+    @property
+    def stop_loss_reached(self):
+        return all(position.stop_loss_reached for position in self.positions)
+
+    @property
+    def partial_take_profit_reached(self):
+        return any(position.partial_take_profit_reached for position in self.positions)
+
+class OrderTracker:
+    """Status of the account orders kept from the ORDER_TRADE_UPDATE events of the user data
+    stream, so take profits and stop loss are not polled with get_order on every check.
+    Orders without events are still NEW. If the stream reconnects, events may have been lost, so
+    unknown orders are requested once (get_order_status) and followed by events again."""
+
+    def __init__(self, request_client=None, stream=UserDataStream, url=None, listen_key=None, on_update=None):
+        self.request_client = request_client or RequestClient(api_key=API_KEY, secret_key=SECRET_KEY)
+        self.stream_class = stream
+        self.url = url
+        self.listen_key = listen_key
+        self.on_update = on_update
+        self.stream = None
+        self.statuses = {}
+        self.synced = False
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.keepalive_thread = None
+        self.renewing = False
+
+    def start(self):
+        if (self.listen_key is None):
+            self.listen_key = self.request_client.start_user_data_stream()
+            self.start_keepalive()
+        self.connect()
+
+    def connect(self):
+        stream = self.stream_class(self.listen_key, self.on_event, True, self.url, self.on_reconnect)
+        self.stream = stream
+        stream.start()
+        synced = stream.connected.wait(5)
+        with self.lock:
+            self.synced = synced
+
+    def stop(self):
+        self.stopped.set()
+        self.stream.stop()
+
+    def start_keepalive(self):
+        """A single keepalive thread for the lifetime of the tracker, it keeps the current listen key."""
+        with self.lock:
+            if (self.keepalive_thread is not None):
+                return
+            self.keepalive_thread = threading.Thread(target=self.keepalive, daemon=True)
+        self.keepalive_thread.start()
+
+    def keepalive(self):
+        while not self.stopped.wait(USER_STREAM_KEEPALIVE):
+            try:
+                self.request_client.keep_user_data_stream()
+            except Exception as e:
+                print(red.bold(f'x User data stream keepalive failed ({e})'))
+
+    def renew(self):
+        """New listen key and stream once the listen key expired, events missed meanwhile are
+        recovered as after a reconnection."""
+        try:
+            self.stream.stop()
+            self.on_reconnect()
+            if (not self.stopped.is_set()):
+                self.listen_key = self.request_client.start_user_data_stream()
+                self.start_keepalive()
+                self.connect()
+        except Exception as e:
+            print(red.bold(f'x User data stream could not be started again ({e})'))
+        finally:
+            with self.lock:
+                self.renewing = False
+
+    def on_reconnect(self):
+        with self.lock:
+            self.statuses.clear()
+            self.synced = False
+
+    def on_event(self, event):
+        if (event.get('e') == 'ORDER_TRADE_UPDATE'):
+            self.update(event['o']['i'], event['o']['X'])
+        elif (event.get('e') == 'listenKeyExpired'):
+            with self.lock:
+                renewing, self.renewing = self.renewing, True
+            if (not renewing):
+                print(yellow.bold('User data stream listen key expired, starting it again.'))
+                # Not from the stream thread, its connection is the one being replaced
+                threading.Thread(target=self.renew, daemon=True).start()
+
+    def update(self, order_id, status):
+        with self.lock:
+            self.statuses[order_id] = status
+        if (self.on_update is not None):
+            self.on_update()
+
+    def status(self, order_id):
+        """Last known status of the order, None when it has to be requested."""
+        with self.lock:
+            if (order_id in self.statuses):
+                return self.statuses[order_id]
+            return 'NEW' if self.synced else None
+
+class OpenOrders:
+    """Open orders of an account taken once per check and shared by all its trades. Pairs are
+    requested lazily one by one, or all at once with a single request when there are many of them."""
+
+    def __init__(self, request_client, pairs):
+        self.request_client = request_client
+        self.pairs = set(pairs)
+        self.orders = {}
+        self.lock = threading.Lock()
+
+    def load(self, pair):
+        if (len(self.pairs) >= OPEN_ORDERS_ALL_PAIRS):
+            for pair_name in self.pairs:
+                self.orders[pair_name] = {}
+            for order in self.request_client.get_open_orders():
+                self.orders.setdefault(order.symbol, {})[order.orderId] = order.status
+        else:
+            self.orders[pair] = { order.orderId: order.status for order in self.request_client.get_open_orders(symbol=pair) }
+
+    def status(self, pair, order_id):
+        with self.lock:
+            if (pair not in self.orders):
+                self.load(pair)
+            orders = self.orders[pair]
+            if (order_id not in orders):
+                # Order is not open anymore (or was created after the snapshot), request its status
+                orders[order_id] = self.request_client.get_order(symbol=pair, orderId=order_id).status
+            return orders[order_id]
+
+    def add(self, pair, order_id, status):
+        """Just created orders, no need to request them if checked in this same snapshot."""
+        with self.lock:
+            if (pair in self.orders):
+                self.orders[pair][order_id] = status
+
+def order_not_found(e):
+    """Whether a request failed because Binance does not know the order (-2013)."""
+    return isinstance(e, BinanceApiException) and '-2013' in str(e.error_message)
+
+def send_order(request_client, **order):
+    """post_order with a client order id. An order whose response timed out may be live, so it is
+    looked up by that id instead of being sent again, the timeout is raised when it was not placed."""
+    order.setdefault('newClientOrderId', 'liq-{}'.format(uuid.uuid4().hex[:24]))
     try:
-        result = request_client.post_order(symbol=pair, side=side, stopPrice=new_stop_with_precision, closePosition=True, ordertype=OrderType.STOP_MARKET, positionSide="BOTH", timeInForce="GTC")
-        STOP_LOSS_ORDER = {"order_id": result.orderId, "stop_loss": new_stop_with_precision, "side": side}
-        sl_moved = True
-        print(f'\t ✓ Stop loss succesfully moved.')
-    except Exception as e:
-        print(red.bold(f'\tStop loss could not be moved ({e})'))
+        return request_client.post_order(**order)
+    except ReadTimeout as timeout:
+        print(yellow.bold(f'\t Order {order["newClientOrderId"]} response timed out, looking it up.'))
+        for attempt in range(1, ORDER_LOOKUP_RETRIES + 1):
+            try:
+                return request_client.get_order(symbol=order['symbol'], origClientOrderId=order['newClientOrderId'])
+            except Exception as e:
+                # It was never placed
+                if (order_not_found(e)):
+                    raise timeout
+                print(red.bold(f'\t x Order {order["newClientOrderId"]} could not be looked up ({e}), attempt {attempt}/{ORDER_LOOKUP_RETRIES}'))
+        raise timeout
+
+def get_order_status(trade, position, order_id):
+    """Order status from the order tracker when it is running. Otherwise from the open orders
+    snapshot of the check, only orders no longer open are requested one by one. Failed requests
+    raise, the status is then unknown (not reached) unless Binance does not know the order."""
+    if (position.order_tracker is not None):
+        status = position.order_tracker.status(order_id)
+        if (status is not None):
+            return status
+
+    if (position.open_orders is None):
+        position.open_orders = OpenOrders(position.request_client, [trade.pair])
+    status = position.open_orders.status(trade.pair, order_id)
+    if (position.order_tracker is not None):
+        position.order_tracker.update(order_id, status)
+    return status
+
+def move_stop_loss(trade, position, quantity_to_extract, new_stop):
+    """Replace the stop loss without leaving the position unprotected. The new stop is a reduce only
+    STOP_MARKET for the quantity still open (a second closePosition stop is rejected with -4130) and
+    the previous one is cancelled in background once the new one is acknowledged, so moving it takes
+    a single round trip. Placement and cancellation are retried on their own."""
+    request_client = position.request_client
+    side = position.stop_loss_order["side"]
+    order_id = position.stop_loss_order["order_id"]
+    symbol_info = get_symbol_info(trade.pair, trade.market)
+    new_stop_with_precision = symbol_info.price(new_stop)
+    open_quantity = symbol_info.quantity(position.open_quantity)
+    print(white.bold(f'Moving {trade.pair} stop loss with order id: {order_id} to {new_stop_with_precision} ({open_quantity} open)'))
+    start = time.perf_counter()
+    for attempt in range(1, STOP_MOVE_RETRIES + 1):
+        try:
+            result = send_order(request_client, symbol=trade.pair, side=side, quantity=open_quantity, stopPrice=new_stop_with_precision, reduceOnly=True, ordertype=OrderType.STOP_MARKET, positionSide="BOTH", timeInForce="GTC")
+            break
+        except Exception as e:
+            print(red.bold(f'\tStop loss could not be moved ({e}), attempt {attempt}/{STOP_MOVE_RETRIES}'))
+    else:
+        # Previous stop loss is still protecting the position
+        return False
+
+    position.stop_loss_order = {"order_id": result.orderId, "stop_loss": new_stop_with_precision, "side": side}
+    if (position.open_orders is not None):
+        position.open_orders.add(trade.pair, result.orderId, result.status)
+    print(f'\t ✓ Stop loss succesfully moved in {round((time.perf_counter() - start) * 1000)} ms.')
 
-    if (order_id and sl_moved):
-        print(white.bold(f'\tCancelling previous stop loss with order id: {order_id}'))
+    if (order_id):
+        threading.Thread(target=cancel_stop_loss, args=(trade, position, order_id), daemon=True).start()
+    return True
+
+def cancel_stop_loss(trade, position, order_id):
+    """Cancel a replaced stop loss, retrying until STOP_MOVE_RETRIES."""
+    start = time.perf_counter()
+    for attempt in range(1, STOP_MOVE_RETRIES + 1):
         try:
-            result = request_client.cancel_order(symbol=pair, orderId=order_id)
-            print(green.bold('\t✓ Previous stop loss cancelled.'))
+            position.request_client.cancel_order(symbol=trade.pair, orderId=order_id)
+            print(green.bold(f'\t✓ Previous stop loss {order_id} cancelled in {round((time.perf_counter() - start) * 1000)} ms.'))
+            return True
         except Exception as e:
-            print(red.bold(f'\tx Previous stop loss could not be cancelled ({e})'))
+            print(red.bold(f'\tx Previous stop loss {order_id} could not be cancelled ({e}), attempt {attempt}/{STOP_MOVE_RETRIES}'))
+    return False
 
 
-def check_take_profits_reached(pair, cc_open):
-    global TAKE_PROFIT_ORDERS
-    global NEXT_STOP_LOSS
-    global TARGET_REACHED
-    global BREAKEVEN
-    global PARTIAL_TAKE_PROFIT_REACHED
-    request_client = RequestClient(api_key=API_KEY, secret_key=SECRET_KEY)
+def check_take_profits_reached(trade, position, cc_open):
     new_take_profits = []
     stop_loss = { "trigger": False, "pair": None, "quantity": None}
-    for index in range(len(TAKE_PROFIT_ORDERS)):
-        quantity = TAKE_PROFIT_ORDERS[index]["quantity"]
+    for index in range(len(position.take_profit_orders)):
+        quantity = position.take_profit_orders[index]["quantity"]
         try:
-            result = request_client.get_order(symbol=pair, orderId=TAKE_PROFIT_ORDERS[index]["orderId"])
-            if (result.status == 'FILLED' or result.status == 'CANCELED' or result.status == 'REJECTED' or result.status == 'EXPIRED'):
-                print(green.bold(f'\t✓ Take profit {TAKE_PROFIT_ORDERS[index]}'))
-                stop_loss = { "trigger": True, "pair": pair, "quantity": quantity}
-                NEXT_STOP_LOSS += 1
-                PARTIAL_TAKE_PROFIT_REACHED = True
-            else:
-                new_take_profits = TAKE_PROFIT_ORDERS[index::]
-                break
+            status = get_order_status(trade, position, position.take_profit_orders[index]["orderId"])
         except Exception as e:
-            print(red.bold(f'\t x Something failed checking take profits ({e})'))
-            stop_loss = { "trigger": True, "pair": pair, "quantity": quantity}
-            NEXT_STOP_LOSS += 1
-    TAKE_PROFIT_ORDERS = new_take_profits
-    if (not len(TAKE_PROFIT_ORDERS)):
-        TARGET_REACHED = True
+            if (not order_not_found(e)):
+                # Status unknown (request held, timed out...): nothing moves until it is checked again
+                print(red.bold(f'\t x Something failed checking take profits ({e}), checking them again later'))
+                new_take_profits = position.take_profit_orders[index::]
+                break
+            status = 'NOT_FOUND'
+        if (status == 'FILLED' or status == 'CANCELED' or status == 'REJECTED' or status == 'EXPIRED' or status == 'NOT_FOUND'):
+            print(green.bold(f'\t✓ Take profit {position.take_profit_orders[index]}'))
+            if (status == 'FILLED'):
+                position.open_quantity -= Decimal(quantity)
+            stop_loss = { "trigger": True, "pair": trade.pair, "quantity": quantity}
+            position.next_stop_loss += 1
+            position.partial_take_profit_reached = True
+        else:
+            new_take_profits = position.take_profit_orders[index::]
+            break
+    position.take_profit_orders = new_take_profits
+    if (not len(position.take_profit_orders)):
+        position.target_reached = True
     elif (stop_loss["trigger"]):
-        if (NEXT_STOP_LOSS == 1):
-            move_stop_loss(pair, quantity, BREAKEVEN)
+        if (position.next_stop_loss == 1):
+            move_stop_loss(trade, position, quantity, position.breakeven)
         else:
-            move_stop_loss(pair, quantity, TARGETS[NEXT_STOP_LOSS - 1])
+            move_stop_loss(trade, position, quantity, position.targets[position.next_stop_loss - 1])
 
 
-def check_stop_loss_reached(pair, side, cc_low, cc_high):
-    global STOP_LOSS_REACHED
-    global STOP_LOSS
-    global STOP_LOSS_ORDER
-    global CAN_CLEAR_STALE_ORDERS
-    if (side == MarketSide.LONG):
+def stop_loss_tracked(position):
+    """Stop loss fills are known without requests when orders are tracked, no need to wait for
+    the price to cross it."""
+    return position.order_tracker is not None and position.stop_loss_order is not None and position.stop_loss_order["order_id"] is not None
+
+def stop_loss_reached(trade, position):
+    position.stop_loss_reached = True
+    position.stop_loss_order = None
+    position.stop_loss = 0
+    if (position.can_clear_stale_orders):
+        clear_take_profit_orders(trade, position)
+        position.can_clear_stale_orders = False
+
+def check_stop_loss_reached(trade, position, cc_low, cc_high):
+    if (trade.side == MarketSide.LONG):
         # Check if previous SL has been reached
-        if (cc_low < float(STOP_LOSS)):
-            if (not STOP_LOSS_REACHED):
-                request_client = RequestClient(api_key=API_KEY, secret_key=SECRET_KEY)
-                try:
-                    print(f'Checking stop loss: {STOP_LOSS_ORDER}')
-                    result = request_client.get_order(symbol=pair, orderId=STOP_LOSS_ORDER["order_id"])
-                    if (result.status == 'FILLED' or result.status == 'CANCELED' or result.status == 'REJECTED' or result.status == 'EXPIRED'):
-                        print(yellow.bold(f'x Stop loss reached ({result.status}): {STOP_LOSS}'))
-                        STOP_LOSS_REACHED = True
-                        STOP_LOSS_ORDER = None
-                        STOP_LOSS = 0
-                        if (CAN_CLEAR_STALE_ORDERS):
-                            clear_take_profit_orders(pair)
-                            CAN_CLEAR_STALE_ORDERS = False
-                except Exception as e:
-                    print(yellow.bold(f'x Something failed while checking stop loss ({e}) -> {STOP_LOSS}'))
-                    STOP_LOSS_REACHED = True
-                    STOP_LOSS_ORDER = None
-                    STOP_LOSS = 0
-
-                    if (CAN_CLEAR_STALE_ORDERS):
-                        clear_take_profit_orders(pair)
-                        CAN_CLEAR_STALE_ORDERS = False
+        crossed = cc_low < float(position.stop_loss)
     else:
-        if (cc_high > float(STOP_LOSS)):
-            if (not STOP_LOSS_REACHED):
-                request_client = RequestClient(api_key=API_KEY, secret_key=SECRET_KEY)
-                try:
-                    print(f'Checking stop loss: {STOP_LOSS_ORDER} -> "order_id')
-                    result = request_client.get_order(symbol=pair, orderId=STOP_LOSS_ORDER["order_id"])
-                    if (result.status == 'FILLED' or result.status == 'CANCELED' or result.status == 'REJECTED' or result.status == 'EXPIRED'):
-                        print(yellow.bold(f'x Stop loss reached ({result.status}): {STOP_LOSS}'))
-                        STOP_LOSS_REACHED = True
-                        STOP_LOSS_ORDER = None
-                        STOP_LOSS = 0
-                        if (CAN_CLEAR_STALE_ORDERS):
-                            clear_take_profit_orders(pair)
-                            CAN_CLEAR_STALE_ORDERS = False
-                except Exception as e:
-                    print(yellow.bold(f'x Something failed while checking stop loss ({e})'))
-                    STOP_LOSS_REACHED = True
-                    STOP_LOSS_ORDER = None
-                    STOP_LOSS = 0
-                    if (CAN_CLEAR_STALE_ORDERS):
-                        clear_take_profit_orders(pair)
-                        CAN_CLEAR_STALE_ORDERS = False
-
-def check_open_trade_ready():
-    now = datetime.utcnow()
-    hour_check = now.hour >= START_INTERVAL and now.hour <= END_INTERVAL
-    if (hour_check):
-        print(yellow("\nChecking candle open: {} -> {}.".format(now.strftime('%B %d %Y - %H:%M:%S'), hour_check)))
-        time.sleep(SLEEP_TIMEOUT)
-    else:
-        print(yellow("\nChecking candle open: {} -> {}. Checking again in {} seconds.".format(now.strftime('%B %d %Y - %H:%M:%S'), hour_check, SLEEP_TIMEOUT)))
-        time.sleep(SLEEP_TIMEOUT)
-    return hour_check
-
-def clear_stale_orders(pair):
-    global TAKE_PROFIT_ORDERS
-    global STOP_LOSS
-    global FIRST_TRY
-    if (FIRST_TRY):
-        FIRST_TRY = False
+        crossed = cc_high > float(position.stop_loss)
+    if ((crossed or stop_loss_tracked(position)) and not position.stop_loss_reached):
+        # Tracked stops are checked on every step, only logged when the price crossed them
+        if (crossed):
+            print(f'Checking {trade.pair} stop loss: {position.stop_loss_order}')
+        if (position.stop_loss_order is None or position.stop_loss_order["order_id"] is None):
+            # No stop order was placed, the price crossing it is all there is
+            status = 'NOT_FOUND'
+        else:
+            try:
+                status = get_order_status(trade, position, position.stop_loss_order["order_id"])
+            except Exception as e:
+                if (not order_not_found(e)):
+                    # Status unknown (request held, timed out...): checked again on the next step
+                    print(yellow.bold(f'x Something failed while checking stop loss ({e}), checking it again later -> {position.stop_loss}'))
+                    return
+                status = 'NOT_FOUND'
+        if (status == 'FILLED' or status == 'CANCELED' or status == 'REJECTED' or status == 'EXPIRED' or status == 'NOT_FOUND'):
+            print(yellow.bold(f'x Stop loss reached ({status}): {position.stop_loss}'))
+            stop_loss_reached(trade, position)
+
+def is_open_trade_window(trade, now=None):
+    """Whether the server time is in the trade window, once it is over the next candle is scheduled."""
+    now = now or CLOCK.now()
+    if (now > trade.end_time):
+        schedule(trade, now)
+    return trade.start_time <= now <= trade.end_time
+
+def clear_stale_orders(trade, position):
+    if (position.first_try):
+        position.first_try = False
         return
-    request_client = RequestClient(api_key=API_KEY, secret_key=SECRET_KEY)
-    result = request_client.cancel_all_orders(symbol=pair)
-    TAKE_PROFIT_ORDERS = []
-    print(yellow.bold('\n\t ✓ All the previous stale {} orders have been cleared.'.format(pair)))
-
-def clear_take_profit_orders(pair):
-    global TAKE_PROFIT_ORDERS
-    global NEXT_STOP_LOSS
-    request_client = RequestClient(api_key=API_KEY, secret_key=SECRET_KEY)
-    for index in range(len(TAKE_PROFIT_ORDERS)):
-        id = TAKE_PROFIT_ORDERS[index]["orderId"]
+    result = position.request_client.cancel_all_orders(symbol=trade.pair)
+    position.take_profit_orders = []
+    print(yellow.bold('\n\t ✓ All the previous stale {} orders have been cleared.'.format(trade.pair)))
+
+def clear_take_profit_orders(trade, position):
+    for index in range(len(position.take_profit_orders)):
+        id = position.take_profit_orders[index]["orderId"]
         try:
-            result = request_client.cancel_order(symbol=pair, orderId=id)
+            result = position.request_client.cancel_order(symbol=trade.pair, orderId=id)
             print(yellow.bold('Take profit order id removed: {}'.format(result.orderId)))
         except Exception as e:
-            print(white.bold(f' x Something failed while cleaning take profit order ({e}) -> {TAKE_PROFIT_ORDERS["index"]}'))
-    TAKE_PROFIT_ORDERS = []
-    NEXT_STOP_LOSS = 0
-    print(yellow.bold(f'\n\t All {pair} take profit order ids have been cancelled.'))
-
-def open_position_binance_futures(pair, targets, target, stop_loss, pair_change, quantity, leverage, side):
-    global STOP_LOSS_ORDER
-    global TARGET
-    global STOP_LOSS_REACHED
-    global STOP_LOSS
-    global TAKE_PROFIT_ORDERS
-    global CAN_CLEAR_STALE_ORDERS
-    global POSITION_ORDER_ID
-    global PRECISION
-    global TARGETS
-    global BREAKEVEN
-
-    request_client = RequestClient(api_key=API_KEY, secret_key=SECRET_KEY)
-    # Cancel previous take profit and stop loss orders
-    clear_stale_orders(pair)
-
-    # Change leverage
+            print(white.bold(f' x Something failed while cleaning take profit order ({e}) -> {position.take_profit_orders[index]}'))
+    position.take_profit_orders = []
+    position.next_stop_loss = 0
+    print(yellow.bold(f'\n\t All {trade.pair} take profit order ids have been cancelled.'))
+
+def stage_position(trade, position):
+    """Everything the entry needs but the price, done before the candle opens: leverage and margin
+    type are set, and trading rules, notional and order sides are resolved."""
+    request_client = position.request_client
     try:
-        request_client.change_initial_leverage(pair, leverage)
+        request_client.change_initial_leverage(trade.pair, trade.leverage)
     except:
         pass
     try:
-        margin_type = request_client.change_margin_type(symbol=pair, marginType=FuturesMarginType.ISOLATED)
+        margin_type = request_client.change_margin_type(symbol=trade.pair, marginType=FuturesMarginType.ISOLATED)
     except:
         pass
-    # Request info of all symbols to retrieve precision
-    exchange_info = request_client.get_exchange_information()
-    price_precision = 0
-    tick_size = 0
-    for item in exchange_info.symbols:
-        if (item.symbol == pair):
-            precision = item.quantityPrecision
-            price_precision = item.pricePrecision
-            tick_size = item.filters[0]["tickSize"]
-            tick_size = str(tick_size).split('.')[1].find("1") + 1
-            PRECISION = price_precision
-            if (tick_size < price_precision):
-                print(white.bold(f'Tick size ({tick_size}) lower than price precision ({price_precision}), new precision is {price_precision}.'))
-                price_precision = tick_size
-                PRECISION = price_precision
+    entry_side, exit_side = OrderSide.BUY, OrderSide.SELL
+    if (trade.side == MarketSide.SHORT):
+        entry_side, exit_side = OrderSide.SELL, OrderSide.BUY
+    position.staged = {
+        "symbol_info": get_symbol_info(trade.pair, Markets.FUTURES),
+        "notional": float(position.quantity * trade.leverage),
+        "entry_side": entry_side,
+        "exit_side": exit_side,
+    }
+    return position.staged
+
+def stage_positions(trades, executor):
+    """Stage the futures positions of the trades concurrently, positions failing to stage are
+    staged again when entering."""
+    def stage(item):
+        trade, position = item
+        try:
+            stage_position(trade, position)
+        except Exception as e:
+            print(red.bold(f'x {trade.pair} entry could not be staged on {position.account} account ({e})'))
+    positions = [(trade, position) for trade in trades if trade.market == Markets.FUTURES for position in trade.positions if position.staged is None]
+    list(executor.map(stage, positions))
+    print(white.bold(f'Staged {len([position for trade, position in positions if position.staged is not None])}/{len(positions)} futures entries.'))
+
+def open_position_binance_futures(trade, position, targets, stop_loss, pair_change, ready=None):
+    pair = trade.pair
+    target = trade.target
+    side = trade.side
+    request_client = position.request_client
+    # Cancel previous take profit and stop loss orders
+    clear_stale_orders(trade, position)
+
+    # Leverage, margin type and trading rules are staged before the candle opens
+    staged = position.staged or stage_position(trade, position)
+    symbol_info = staged["symbol_info"]
 
     # Create order
-    quantity_rounded = float(quantity * leverage) / float(pair_change)
-    quantity_with_precision = "{:0.0{}f}".format(quantity_rounded, precision)
+    quantity_rounded = staged["notional"] / float(pair_change)
+    quantity_with_precision = symbol_info.quantity(quantity_rounded, market=True)
+    if (not symbol_info.valid_quantity(quantity_with_precision, pair_change)):
+        print(red.bold(f'\n\t\t x Quantity {quantity_with_precision} {pair} is under the minimum quantity or notional ({symbol_info.min_notional} USDT) of {position.account} account.'))
+        return False
 
-    stop_loss = "{:0.0{}f}".format(stop_loss, price_precision)
-    take_profit = "{:0.0{}f}".format(targets[target], price_precision)
+    stop_loss = symbol_info.price(stop_loss)
+    take_profit = symbol_info.price(targets[target])
 
-    STOP_LOSS = stop_loss
-    STOP_LOSS_REACHED = False
+    position.stop_loss = stop_loss
+    position.stop_loss_reached = False
 
-    TARGET = targets[target]
+    position.target_price = targets[target]
 
-    print(white.bold('\n\tOpening future position {} at market ({}) with quantity: {} {} with take profit on: {} and stop loss: {}'.format(side, pair_change, quantity_with_precision, pair, take_profit, stop_loss)))
-    BREAKEVEN = pair_change
-    order_side = OrderSide.BUY
-    if (side == MarketSide.SHORT):
-        order_side = OrderSide.SELL
+    print(white.bold('\n\tOpening future position {} at market ({}) with quantity: {} {} with take profit on: {} and stop loss: {} ({} account)'.format(side, pair_change, quantity_with_precision, pair, take_profit, stop_loss, position.account)))
+    position.breakeven = pair_change
+    order_side = staged["entry_side"]
 
-    result = request_client.post_order(symbol=pair, side=order_side, quantity=quantity_with_precision, ordertype=OrderType.MARKET, positionSide="BOTH")
-    POSITION_ORDER_ID = result.orderId
+    if (ready is not None):
+        # Wait for the other accounts to send all the entries at the same time
+        ready()
+    result = send_order(request_client, symbol=pair, side=order_side, quantity=quantity_with_precision, ordertype=OrderType.MARKET, positionSide="BOTH")
+    entry_start = time.perf_counter()
+    position.open_quantity = Decimal(quantity_with_precision)
+    position.entry_time = getattr(result, 'updateTime', 0) or int(time.time() * 1000)
+    position.position_order_id = result.orderId
     print(green.bold('\n\t\t✓ Market order created.'))
 
     # Set take profit and stop loss orders
-    weighted_targets = {
-        1: [{ 1: 1}],
-        2: [{ 1: 0.25 }, { 2: 0.75 }],
-        3: [{1: 0.25}, {2: 0.25}, {3: 0.50}],
-        4: [{1: 0.20},{2: 0.20},{3: 0.20},{4: 0.40},
-        ]
-    }
-
-    order_side = OrderSide.SELL
-    if (side == MarketSide.SHORT):
-        order_side = OrderSide.BUY
-    CAN_CLEAR_STALE_ORDERS = True
+    order_side = staged["exit_side"]
+    position.can_clear_stale_orders = True
     remaining_quantity = float(quantity_with_precision)
-    try:
-        take_profits_set = 0
-        for index in range(len(weighted_targets[target])):
-            for key, weight in weighted_targets[target][index].items():
-                weighted_quantity = quantity_rounded * weight
-                #if (index == len(weighted_targets[target]) - 1 and target != 1):
-                    #print(f'Sumo a weighted quantity remaining: {weighted_quantity} + {remaining_quantity}')
-                    #weighted_quantity += remaining_quantity
-                weighted_quantity_with_precision = "{:0.0{}f}".format(weighted_quantity, precision)
-                remaining_quantity -= float(weighted_quantity_with_precision)
-
-                take_profit = "{:0.0{}f}".format(targets[key], price_precision)
-                try:
-                    print(white.bold(f'\n\t\t Creating take profit order weight: {weight * 100} at {take_profit} with weighted quantity: {weighted_quantity_with_precision}, current price: {pair_change}'))
-                    result = request_client.post_order(symbol=pair, side=order_side, quantity=weighted_quantity_with_precision, price=take_profit, stopPrice=take_profit, ordertype=OrderType.TAKE_PROFIT, positionSide="BOTH", timeInForce="GTC")
-                    print(green.bold('\n\t\t✓ Take profit successfully created.'))
-                    TAKE_PROFIT_ORDERS.append({ "take_profit": take_profit, "quantity": weighted_quantity_with_precision, "orderId": result.orderId})
-                    TARGETS.append(take_profit)
-                    take_profits_set += 1
-                except Exception as e:
-                    weighted_quantity_with_precision = "{:0.0{}f}".format(weighted_quantity, precision)
-                    print(yellow.bold('\n\t\tx Take profit with {} weight created at: {} failed ({}). Weighted quantity: {}. Selling at market price'.format(weight * 100, take_profit, e, weighted_quantity_with_precision)))
-                    request_client.post_order(symbol=pair, side=order_side, ordertype=OrderType.MARKET, quantity=weighted_quantity_with_precision, positionSide="BOTH")
-                    
-        if (take_profits_set == 0):
-            raise Exception('Take profit orders were all market selled. Close position and stop loss')
+    take_profits = []
+    for index in range(len(WEIGHTED_TARGETS[target])):
+        for key, weight in WEIGHTED_TARGETS[target][index].items():
+            weighted_quantity = quantity_rounded * weight
+            #if (index == len(WEIGHTED_TARGETS[target]) - 1 and target != 1):
+                #print(f'Sumo a weighted quantity remaining: {weighted_quantity} + {remaining_quantity}')
+                #weighted_quantity += remaining_quantity
+            weighted_quantity_with_precision = symbol_info.quantity(weighted_quantity)
+            remaining_quantity -= float(weighted_quantity_with_precision)
+            take_profits.append((weight, weighted_quantity, weighted_quantity_with_precision, symbol_info.price(targets[key])))
+
+    # Quantities of the take profits sold at market because they could not be placed
+    market_sold = []
+    def place_take_profit(weight, weighted_quantity, weighted_quantity_with_precision, take_profit):
+        try:
+            print(white.bold(f'\n\t\t Creating take profit order weight: {weight * 100} at {take_profit} with weighted quantity: {weighted_quantity_with_precision}, current price: {pair_change}'))
+            result = send_order(request_client, symbol=pair, side=order_side, quantity=weighted_quantity_with_precision, price=take_profit, stopPrice=take_profit, ordertype=OrderType.TAKE_PROFIT, positionSide="BOTH", timeInForce="GTC")
+            print(green.bold('\n\t\t✓ Take profit successfully created.'))
+            return { "take_profit": take_profit, "quantity": weighted_quantity_with_precision, "orderId": result.orderId}
+        except Exception as e:
+            weighted_quantity_with_precision = symbol_info.quantity(weighted_quantity, market=True)
+            print(yellow.bold('\n\t\tx Take profit with {} weight created at: {} failed ({}). Weighted quantity: {}. Selling at market price'.format(weight * 100, take_profit, e, weighted_quantity_with_precision)))
+            send_order(request_client, symbol=pair, side=order_side, ordertype=OrderType.MARKET, quantity=weighted_quantity_with_precision, positionSide="BOTH")
+            market_sold.append(weighted_quantity_with_precision)
+            return None
 
+    def place_stop_loss():
         #if (remaining_quantity > 0):
-        #    remaining_quantity_with_precision = "{:0.0{}f}".format(remaining_quantity, precision)
-        result = request_client.post_order(symbol=pair, side=order_side, stopPrice=stop_loss, closePosition=True, ordertype=OrderType.STOP_MARKET, positionSide="BOTH", timeInForce="GTC")
+        #    remaining_quantity_with_precision = symbol_info.quantity(remaining_quantity)
+        result = send_order(request_client, symbol=pair, side=order_side, stopPrice=stop_loss, closePosition=True, ordertype=OrderType.STOP_MARKET, positionSide="BOTH", timeInForce="GTC")
+        position.protection_time = round((time.perf_counter() - entry_start) * 1000)
+        return result
+
+    try:
+        # Stop loss and take profits are sent together, so the position is protected after a single round trip
+        with ThreadPoolExecutor(max_workers=len(take_profits) + 1) as executor:
+            stop_loss_result = executor.submit(place_stop_loss)
+            take_profit_results = [executor.submit(place_take_profit, *take_profit) for take_profit in take_profits]
+            take_profit_orders = [result.result() for result in take_profit_results]
+        # Moved stop losses are sized from the quantity still open
+        position.open_quantity -= sum(Decimal(quantity) for quantity in market_sold)
+
+        for take_profit_order in take_profit_orders:
+            if (take_profit_order is not None):
+                position.take_profit_orders.append(take_profit_order)
+                position.targets.append(take_profit_order["take_profit"])
+
+        if (not any(take_profit_orders)):
+            raise Exception('Take profit orders were all market selled. Close position and stop loss')
 
-        STOP_LOSS_ORDER = {"order_id": result.orderId, "stop_loss": stop_loss, "side": order_side}
-        print(green.bold(f'\n\t\t✓ Stop order at: {stop_loss} created .'))
+        result = stop_loss_result.result()
+        position.stop_loss_order = {"order_id": result.orderId, "stop_loss": stop_loss, "side": order_side}
+        print(green.bold(f'\n\t\t✓ Stop order at: {stop_loss} created {position.protection_time} ms after the entry fill.'))
         return True
     except Exception as e:
         # Cancel order if something did not work as expected
         print(red.bold('\n\t\t x Stop loss failed ({}). Cancelling order at market price, quantity: {}.'.format(e, quantity_with_precision)))
-        STOP_LOSS_ORDER = {"order_id": None, "quantity": quantity_with_precision, "stop_loss": stop_loss, "side": order_side}
+        position.stop_loss_order = {"order_id": None, "quantity": quantity_with_precision, "stop_loss": stop_loss, "side": order_side}
         
-        clear_stale_orders(pair)
-        result = request_client.post_order(symbol=pair, side=order_side, quantity=quantity_with_precision, ordertype=OrderType.MARKET, positionSide="BOTH")
+        clear_stale_orders(trade, position)
+        result = send_order(request_client, symbol=pair, side=order_side, quantity=quantity_with_precision, ordertype=OrderType.MARKET, positionSide="BOTH")
+        position.open_quantity = Decimal(0)
         return False
 
+def open_positions(trade, targets, stop_loss, pair_change):
+    """Open the trade on every account at once. Accounts are prepared concurrently (stale orders,
+    leverage, sizing) and the entries are sent together when all of them are ready,
+    then the skew between the first and the last fill is reported."""
+    positions = trade.positions
+    if (len(positions) == 1):
+        return open_position_binance_futures(trade, positions[0], targets, stop_loss, pair_change)
+
+    barrier = threading.Barrier(len(positions))
+    def open_position(position):
+        arrived = []
+        def ready():
+            arrived.append(True)
+            barrier.wait()
+        try:
+            return open_position_binance_futures(trade, position, targets, stop_loss, pair_change, ready)
+        except Exception as e:
+            print(red.bold(f'\n\t\t x {trade.pair} position could not be opened on {position.account} account ({e})'))
+            return False
+        finally:
+            if (not len(arrived)):
+                # Do not leave the other accounts waiting for this one
+                barrier.wait()
+
+    with ThreadPoolExecutor(max_workers=len(positions)) as executor:
+        results = list(executor.map(open_position, positions))
+
+    entry_times = [position.entry_time for position in positions if position.entry_time]
+    if (len(entry_times)):
+        print(white.bold(f'\n\t{trade.pair} entries filled on {len(entry_times)}/{len(positions)} accounts, skew between first and last fill: {max(entry_times) - min(entry_times)} ms.'))
+    protection_times = [position.protection_time for position in positions if position.protection_time is not None]
+    if (len(protection_times)):
+        print(white.bold(f'\t{trade.pair} stop losses acknowledged {min(protection_times)}-{max(protection_times)} ms after the entry fills.'))
+    return all(results)
+
+
 def open_position_binance_spot(pair, limit, pair_change, quantity, side = SpotSides.BUY):
     url = BINANCE_SPOT_BASE_URL + BINANCE_SPOT_CREATE_ORDER_ENDPOINT
     
-    response = requests.get(BINANCE_SPOT_BASE_URL + BINANCE_SPOT_EXCHANGE_INFO_ENDPOINT)
-    exchange_info = response.json()
-    price_precision = 0
-    for item in exchange_info["symbols"]:
-        if (item["symbol"] == pair):
-            price_precision = item["baseAssetPrecision"]
-
     quantity_rounded = float(quantity) / float(pair_change)
-    quantity_with_precision = "{:0.0{}f}".format(quantity_rounded, price_precision)
+    quantity_with_precision = get_symbol_info(pair, Markets.SPOT).quantity(quantity_rounded)
     
     parameters = {}
     if (side == SpotSides.BUY):
@@ -497,7 +1074,7 @@ def open_position_binance_spot(pair, limit, pair_change, quantity, side = SpotSi
     else:
         parameters = { "symbol": pair, "side": SpotSides.SELL, "type": "STOP_LOSS", "quantity": quantity_with_precision, "stopPrice": quantity_with_precision }
     
-    response = requests.post(url, data = parameters)
+    response = TRANSPORT.post(url, data = parameters)
     print(response)
     print('***********')
     print(response.json())
@@ -511,69 +1088,120 @@ def fib_retracement(min, max):
     return { 1: min + 0.236 * diff, 2: min + 0.382 * diff, 3: min + 0.5 * diff, 4: min + 0.618 * diff}
 
 
-def get_last_binance_candles(pair, interval, market=Markets.FUTURES):
-    response = None
-    limit = 2
-    if (interval == Intervals.TWO_WEEKS.value):
-        two_week_reference = datetime.utcfromtimestamp(1618185600)
-        now = datetime.utcfromtimestamp(1619433046)
-        now = datetime.utcnow()
-        diff = now - two_week_reference
-        diff_in_minutes = (diff.total_seconds() % (14 * 24 * 60 * 60)) / 60
-        diff_in_hours = diff_in_minutes / 60
-
-        next_two_week_candle = (14 * 24) - diff_in_hours
-        interval = Intervals.WEEK.value
-        limit = 3
-        if (next_two_week_candle < 24):
-            limit = 4
+def get_binance_klines(pair, interval, market=Markets.FUTURES, limit=2):
+    """Last `limit` klines of the pair as Candle, paging backwards when over the endpoint limit."""
+    max_limit = MAX_SPOT_KLINES_LIMIT if market == Markets.SPOT else MAX_KLINES_LIMIT
+    result = []
+    end_time = None
+    while (limit > 0):
+        page_limit = min(limit, max_limit)
+        if (market == Markets.SPOT):
+            url = '{}{}?symbol={}&interval={}&limit={}'.format(BINANCE_SPOT_BASE_URL, BINANCE_SPOT_KLINES_ENDPOINT, pair, interval, page_limit)
+        else:
+            url = '{}{}?pair={}&interval={}&limit={}&contractType=PERPETUAL'.format(BINANCE_FUTURES_BASE_URL, BINANCE_FUTURES_KLINES_ENDPOINT, pair, interval, page_limit)
+        if (end_time is not None):
+            url = '{}&endTime={}'.format(url, end_time)
+        page = parse_klines(TRANSPORT.get(url).content)
+        result = page + result
+        if (len(page) < page_limit):
+            break
+        limit -= page_limit
+        end_time = page[0].open_time - 1
+    return result
 
-    if (market == Markets.SPOT):
-        url = '{}{}?symbol={}&interval={}&limit={}'.format(BINANCE_SPOT_BASE_URL, BINANCE_SPOT_KLINES_ENDPOINT, pair, interval, limit)
-        response = requests.get(url)
-    else:
-        url = '{}{}?pair={}&interval={}&limit={}&contractType=PERPETUAL'.format(BINANCE_FUTURES_BASE_URL, BINANCE_FUTURES_KLINES_ENDPOINT, pair, interval, limit)
-        response = requests.get(url)
-    data = response.json()
-
-    result = data
-    # Parse intervals non accepted by binance API (2w)
-    if (len(result) > 2):
-        first_week = result[0]
-        second_week = result[1]
-        third_week = result[2]
-        lc_low = min(float(first_week[3]), float(second_week[3]))
-        lc_open = float(first_week[1])
-        lc_close = float(second_week[4])
-        lc_high = max(float(first_week[2]), float(second_week[2]))
-
-        cc_low = float(third_week[3])
-        cc_open = float(third_week[1])
-        cc_close = float(third_week[4])
-        cc_high = float(third_week[2])
-
-        if (next_two_week_candle < 24):
-            fourth_week = result[3]
-            cc_low = min(float(third_week[3]), float(fourth_week[3]))
-            cc_open = float(third_week[1])
-            cc_close = float(fourth_week[4])
-            cc_high = max(float(third_week[2]), float(fourth_week[2]))
-        result = [[first_week[0], lc_open, lc_high, lc_low, lc_close], [third_week[0], cc_open, cc_high, cc_low, cc_close]]  
+def get_binance_candles(pair, interval, market, now, count):
+    """Last `count` (1 or 2) candles of the pair at `now` (ms), intervals not served by Binance
+    (2w, 3w) are built from the klines of their base interval."""
+    timeframe = AGGREGATED_INTERVALS.get(Intervals(interval))
+    if (timeframe is None):
+        return get_binance_klines(pair, interval, market, count)
 
-    return result
+    limit = timeframe.klines_limit(now, count)
+    return CandleAggregator(timeframe, get_binance_klines(pair, timeframe.base.value, market, limit)).candles()[-count:]
 
-def check_safe_stop_loss(low, open):
+def get_last_binance_candles(pair, interval, market=Markets.FUTURES):
+    """[last candle, current candle] of the pair. Once the last candle is cached (CLOSED_CANDLES)
+    only the current one is requested."""
+    now = CLOCK.now()
+    open_time = candle_open_time(interval, now)
+    last_open_time = candle_open_time(interval, open_time - 1)
+    key = (market, pair, interval)
+    last_candle = CLOSED_CANDLES.get(key)
+    if (last_candle is not None and last_candle.open_time == last_open_time):
+        candles = get_binance_candles(pair, interval, market, now, 1)
+        # Both candles are requested again when the exchange has not opened the candle yet, the
+        # caller skips them if it is still not there
+        if (len(candles) and candles[-1] is not None and candles[-1].open_time == open_time):
+            return [last_candle, candles[-1]]
+
+    candles = get_binance_candles(pair, interval, market, now, 2)
+    if (now - open_time >= CLOSED_CANDLE_SETTLE * 1000 and len(candles) == 2 and candles[0] is not None and candles[0].open_time == last_open_time):
+        CLOSED_CANDLES[key] = candles[0]
+    return candles
+
+class LiveCandles:
+    """Last and current candles of a pair kept up to date from its kline stream, instead of
+    polling get_last_binance_candles. Intervals not served by Binance (2w, 3w) are aggregated
+    from the klines of their base interval as they arrive. `on_update()` is called on every
+    kline update."""
+
+    def __init__(self, pair, interval, market=Markets.FUTURES, stream=KlineStream, url=None, on_update=None):
+        self.pair = pair
+        self.interval = Intervals(interval)
+        self.timeframe = AGGREGATED_INTERVALS.get(self.interval)
+        self.base = self.timeframe.base if self.timeframe is not None else self.interval
+        self.market = market
+        self.stream = stream([pair], self.base.value, self.on_kline, market == Markets.FUTURES, url)
+        self.on_update = on_update
+        self.klines = []
+        self.aggregator = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        if (self.timeframe is not None):
+            limit = self.timeframe.klines_limit(int(time.time() * 1000))
+            self.aggregator = CandleAggregator(self.timeframe, get_binance_klines(self.pair, self.base.value, self.market, limit))
+        else:
+            self.klines = get_binance_klines(self.pair, self.base.value, self.market, 2)
+        self.stream.start()
+
+    def stop(self):
+        self.stream.stop()
+
+    def on_kline(self, pair, candle, closed):
+        with self.lock:
+            if (self.aggregator is not None):
+                if (not self.aggregator.update(candle)):
+                    return
+            elif (len(self.klines) and self.klines[-1].open_time == candle.open_time):
+                self.klines[-1] = candle
+            elif (not len(self.klines) or self.klines[-1].open_time < candle.open_time):
+                self.klines = [self.klines[-1], candle] if len(self.klines) else [candle]
+            else:
+                return
+        if (self.on_update is not None):
+            self.on_update()
+
+    def candles(self):
+        """[last candle, current candle] as get_last_binance_candles returns them."""
+        with self.lock:
+            if (self.aggregator is not None):
+                return self.aggregator.candles()
+            return self.klines[-2:]
+
+def check_safe_stop_loss(trade, low, open):
     diff = open - low
     trade_risk = (diff / low) * 100
     is_safe = MAX_STOP_LOSS_RISK > trade_risk
-    print(yellow.bold('\n\t⚠ Position risk is: {}%'.format(round(trade_risk, 2))))
+    print(yellow.bold('\n\t⚠ {} position risk is: {}%'.format(trade.pair, round(trade_risk, 2))))
     if not is_safe:
-        print(red.bold('\n\tTrade is too risky ({}), aborting!.'.format(trade_risk)))
-        exit(1)
+        print(red.bold('\n\t{} trade is too risky ({}), aborting!.'.format(trade.pair, trade_risk)))
+        trade.aborted = True
+        trade.finished = True
     return is_safe
 
-def set_sleep_timeout(interval):
-    global SLEEP_TIMEOUT
+def set_sleep_timeout(trade):
+    interval = trade.interval
     sleep = 15
     lowest_tf_sleep = 1
     low_tf_sleep = 3
@@ -583,104 +1211,104 @@ def set_sleep_timeout(interval):
         sleep = lowest_tf_sleep
     if (interval == Intervals.HOUR.value):
         sleep = lowest_tf_sleep
+    elif (interval == Intervals.TWO_HOURS.value):
+        sleep = lowest_tf_sleep
     elif (interval == Intervals.FOUR_HOURS.value):
         sleep = low_tf_sleep
+    elif (interval == Intervals.SIX_HOURS.value):
+        sleep = low_tf_sleep
     elif (interval == Intervals.TWELVE_HOURS.value):
         sleep = low_tf_sleep
-    SLEEP_TIMEOUT = sleep
-
-def init(interval):
-    global START_INTERVAL
-    global END_INTERVAL
-    set_sleep_timeout(interval)
-    now = datetime.utcnow()
-    if interval == Intervals.HOUR.value:
-        START_INTERVAL = now.hour + 1
-        END_INTERVAL = now.hour + 2
-    elif interval == Intervals.FOUR_HOURS.value:
-        START_INTERVAL = now.hour + 1
-        END_INTERVAL = START_INTERVAL + 4
-    elif interval == Intervals.TWELVE_HOURS.value:
-        START_INTERVAL = now.hour + 1
-        END_INTERVAL = START_INTERVAL + 12
-    else:
-        START_INTERVAL = 0
-        END_INTERVAL = 16
-
-
-def trade_the_open(pair, interval, quantity, leverage, market, side, limit, target):
-    global LAST_CANDLE_RED
-    global LAST_CANDLE_GREEN
-    global LAST_LOW_PRICE
-    global LAST_HIGH_PRICE
-    global TARGET
-    global TARGETS
-    global TARGET_REACHED
-    global STOP_LOSS_REACHED
-    global STOP_LOSS
-    global STOP_LOSS
-    global CAN_CLEAR_STALE_ORDERS
-    global RETRIES
-    global PARTIAL_TAKE_PROFIT_REACHED
-    try:
-        candles = get_last_binance_candles(pair, interval, market)
-    except:
+    trade.sleep_timeout = sleep
+
+def schedule(trade, now=None):
+    """Trade window from the exact open (server time, ms) of the candle to trade."""
+    now = now or CLOCK.now()
+    window = TRADE_WINDOW_HOURS.get(trade.interval, DEFAULT_TRADE_WINDOW_HOURS) * 60 * MINUTE_MILLISECONDS
+    start_time = candle_open_time(trade.interval, now)
+    if (trade.interval in NEXT_CANDLE_INTERVALS or now > start_time + window):
+        start_time = next_candle_open_time(trade.interval, now)
+    trade.start_time = start_time
+    trade.end_time = start_time + window
+
+def init(trade):
+    set_sleep_timeout(trade)
+    schedule(trade)
+
+def poll_timeout(trade, now=None):
+    """Seconds to sleep before checking the trade candle again: until its open, then OPEN_POLL
+    during OPEN_BURST seconds and the trade sleep timeout afterwards."""
+    now = now or CLOCK.now()
+    if (now < trade.start_time):
+        return (trade.start_time - now) / 1000
+    if (now < trade.start_time + OPEN_BURST * 1000):
+        return OPEN_POLL
+    return trade.sleep_timeout
+
+def format_time(timestamp):
+    return datetime.utcfromtimestamp(timestamp / 1000).strftime('%B %d %Y - %H:%M:%S')
+
+
+def orders_check_due(trade, position):
+    """Whether the trade sleep timeout has passed since the position orders were last checked, so
+    candle streams updating several times per second do not check orders on every update."""
+    now = CLOCK.now()
+    if (now - position.last_orders_check < trade.sleep_timeout * 1000):
+        return False
+    position.last_orders_check = now
+    return True
+
+def trade_the_open(trade, candles=None):
+    if (candles is None):
+        try:
+            candles = get_last_binance_candles(trade.pair, trade.interval, trade.market)
+        except:
+            return False
+
+    # candles is [last, current] Candle. Right at the open Binance (or the kline stream) may not have
+    # the new candle yet and the current one would be the candle just closed: the tick is skipped
+    open_time = candle_open_time(trade.interval, CLOCK.now())
+    if (len(candles) < 2 or candles[1] is None or candles[1].open_time != open_time):
+        print(white.bold(f'\t{trade.pair} candle opened at {format_time(open_time)} is not available yet, checking again.'))
         return False
-            
-    """ Binance API response format
-    [
-        [
-            1499040000000,      // Open time
-            "0.01634790",       // Open
-            "0.80000000",       // High
-            "0.01575800",       // Low
-            "0.01577100",       // Close
-            "148976.11427815",  // Volume
-            1499644799999,      // Close time
-            "2434.19055334",    // Quote asset volume
-            308,                // Number of trades
-            "1756.87402397",    // Taker buy base asset volume
-            "28.46694368",      // Taker buy quote asset volume
-            "17928899.62484339" // Ignore.
-        ]
-    ]"""
 
     last_candle = candles[0]
-    lc_open = float(last_candle[1])
-    lc_high = float(last_candle[2])
-    lc_low = float(last_candle[3])
-    lc_close = float(last_candle[4])
+    lc_open = last_candle.open
+    lc_high = last_candle.high
+    lc_low = last_candle.low
+    lc_close = last_candle.close
 
     current_candle = candles[1]
-    cc_open = float(current_candle[1])
-    cc_high = float(current_candle[2])
-    cc_low = float(current_candle[3])
-    cc_close = float(current_candle[4])
+    cc_open = current_candle.open
+    cc_high = current_candle.high
+    cc_low = current_candle.low
+    cc_close = current_candle.close
     # Check if candlestick turned green
     
-    if (not len(TARGETS)):
-        TARGETS = [cc_open]
+    for position in trade.positions:
+        if (not len(position.targets)):
+            position.targets = [cc_open]
 
-    if (len(TAKE_PROFIT_ORDERS)):
-        check_take_profits_reached(pair, cc_open)
-        check_stop_loss_reached(pair, side, cc_low, cc_high)
+        if (len(position.take_profit_orders) and (position.order_tracker is not None or orders_check_due(trade, position))):
+            check_take_profits_reached(trade, position, cc_open)
+            check_stop_loss_reached(trade, position, cc_low, cc_high)
 
-    if (RETRIES > 1 and not STOP_LOSS_REACHED):
-        print(white.bold(f'\tCurrent order is still in play. Checking again in {SLEEP_TIMEOUT} seconds'))
+    if (trade.retries > 1 and not trade.stop_loss_reached):
+        print(white.bold(f'\tCurrent order is still in play. Checking again in {trade.sleep_timeout} seconds'))
         return False
 
-    if (PARTIAL_TAKE_PROFIT_REACHED or RETRIES >= MAX_ORDER_RETRIES):
-        print(white.bold(f'Some take profit has been reached, avoid opening new trades. Checking finish again in {SLEEP_TIMEOUT} seconds.'))
+    if (trade.partial_take_profit_reached or trade.retries >= MAX_ORDER_RETRIES):
+        print(white.bold(f'Some take profit has been reached, avoid opening new trades. Checking finish again in {trade.sleep_timeout} seconds.'))
         return False
 
     # LONG trades
-    if (side == MarketSide.LONG):
+    if (trade.side == MarketSide.LONG):
         if (cc_open < cc_close and cc_open >= cc_low):
-            if (LAST_CANDLE_RED and cc_low < LAST_LOW_PRICE):
-                print(white.bold('\t * Attempt number: {}'.format(RETRIES)))
-                RETRIES += 1
-                LAST_CANDLE_RED = False
-                LAST_LOW_PRICE = cc_low
+            if (trade.last_candle_red and cc_low < trade.last_low_price):
+                print(white.bold('\t * Attempt number: {}'.format(trade.retries)))
+                trade.retries += 1
+                trade.last_candle_red = False
+                trade.last_low_price = cc_low
             else:
                 print(yellow.bold('\tCandle is still GREEN as to try again.'))
                 return False
@@ -694,26 +1322,27 @@ def trade_the_open(pair, interval, quantity, leverage, market, side, limit, targ
                 targets = fib_retracement(lc_open, lc_high)
             print(white.bold('\n\tTargets based on fib retracement: {}'.format(targets)))
 
-            if (check_safe_stop_loss(cc_low, cc_open)):
+            if (check_safe_stop_loss(trade, cc_low, cc_open)):
                 result = False
-                if (market == Markets.FUTURES):
-                    result = open_position_binance_futures(pair, targets, target, cc_low, cc_close, quantity, leverage, side)
+                if (trade.market == Markets.FUTURES):
+                    result = open_positions(trade, targets, cc_low, cc_close)
                 else:
-                    result = open_position_binance_spot(pair, cc_close, cc_close, quantity, SpotSides.BUY)
+                    for position in trade.positions:
+                        result = open_position_binance_spot(trade.pair, cc_close, cc_close, position.quantity, SpotSides.BUY)
                 return result
         else:
-            if not LAST_CANDLE_RED:
-                LAST_CANDLE_RED = True
-            print(yellow.bold('\t Candle is still RED after the open. Checking again in {} seconds'.format(SLEEP_TIMEOUT)))    
+            if not trade.last_candle_red:
+                trade.last_candle_red = True
+            print(yellow.bold('\t Candle is still RED after the open. Checking again in {} seconds'.format(trade.sleep_timeout)))    
             return False
     
     else:
         if (cc_open > cc_close and cc_open <= cc_high):
-            if (LAST_CANDLE_GREEN and cc_high > LAST_HIGH_PRICE):
-                print(white.bold('\t* Attempt number: {}'.format(RETRIES)))
-                RETRIES += 1
-                LAST_CANDLE_GREEN = False
-                LAST_HIGH_PRICE = cc_high
+            if (trade.last_candle_green and cc_high > trade.last_high_price):
+                print(white.bold('\t* Attempt number: {}'.format(trade.retries)))
+                trade.retries += 1
+                trade.last_candle_green = False
+                trade.last_high_price = cc_high
             else:
                 print(yellow.bold('\tCandle is still RED as to try again.'))
                 return False
@@ -727,77 +1356,228 @@ def trade_the_open(pair, interval, quantity, leverage, market, side, limit, targ
                 targets = fib_retracement(lc_close, lc_low)
             print(white.bold('\n\tTargets based on fib retracement: {}'.format(targets)))
 
-            if (check_safe_stop_loss(cc_open, cc_high)):
-                if (market == Markets.FUTURES):
-                    open_position_binance_futures(pair, targets, target, cc_high, cc_close, quantity, leverage, side)
+            if (check_safe_stop_loss(trade, cc_open, cc_high)):
+                if (trade.market == Markets.FUTURES):
+                    open_positions(trade, targets, cc_high, cc_close)
                 else:
-                    open_position_binance_spot(pair, cc_close, cc_close, quantity, SpotSides.BUY)
+                    for position in trade.positions:
+                        open_position_binance_spot(trade.pair, cc_close, cc_close, position.quantity, SpotSides.BUY)
                 return True
         else:
-            if not LAST_CANDLE_GREEN:
-                LAST_CANDLE_GREEN = True
-            print(yellow.bold('\t Candle is still GREEN after the open. Checking again in {} seconds'.format(SLEEP_TIMEOUT)))    
+            if not trade.last_candle_green:
+                trade.last_candle_green = True
+            print(yellow.bold('\t Candle is still GREEN after the open. Checking again in {} seconds'.format(trade.sleep_timeout)))    
             return False
 
-def check_trade_finished(pair, side, interval, market):
-    current_hour = datetime.utcnow().hour
-    global TARGET_REACHED
-    global STOP_LOSS_REACHED
-    global RETRIES
-    global MAX_ORDER_RETRIES
-    print(f'Number of tries: {RETRIES} and maximum value: {MAX_ORDER_RETRIES}')
-
-    print('TARGET REACHED: {} - {} < {}'.format(TARGET_REACHED, current_hour, END_INTERVAL))
-    print(f'Target reached?: {TARGET_REACHED}')
-    print(f'SL reached?: {STOP_LOSS_REACHED}')
-    print(f'Interval finished?: {current_hour < END_INTERVAL}')
-    while not TARGET_REACHED and not STOP_LOSS_REACHED and current_hour < END_INTERVAL:
-        print(white.bold('Waiting for trade to reach a condition to end and clear orders...'))
-        time.sleep(SLEEP_TIMEOUT)
+def leave_trade(trade):
+    """Leave a cancelled trade safely: open positions protected by their stop loss are kept with
+    their orders, other positions get their stale orders cleared and what is still open (no stop
+    loss acknowledged) is closed at market."""
+    if (trade.market != Markets.FUTURES):
+        return
+    for position in trade.positions:
+        opened = position.open_quantity > 0 and not position.stop_loss_reached and not position.target_reached
+        if (opened and position.stop_loss_order is not None and position.stop_loss_order["order_id"] is not None):
+            print(white.bold(f'{trade.pair} position kept on {position.account} account, protected by its stop loss at {position.stop_loss_order["stop_loss"]}.'))
+            continue
         try:
-            candles = get_last_binance_candles(pair, interval, market)
-        except:
-            time.sleep(SLEEP_TIMEOUT)
-            candles = get_last_binance_candles(pair, interval, market)
-        current_candle = candles[1]
-        cc_high = float(current_candle[2])
-        cc_low = float(current_candle[3])
-        check_stop_loss_reached(pair, side, cc_low, cc_high)
-        
-    if TARGET_REACHED:
-        print(green.bold('\n\t\tTarget has been reached!'))
-    elif RETRIES < MAX_ORDER_RETRIES:
-        print(red.bold(f'\n\t\tMax number of retries reached: {RETRIES} === {MAX_ORDER_RETRIES}.'))
-    else:
-        print(red.bold(f'\n\t\tInterval has finished ({current_hour} < {END_INTERVAL}), target has NOT been reached. Exiting.'))
+            clear_stale_orders(trade, position)
+            if (opened):
+                staged = position.staged or stage_position(trade, position)
+                quantity = staged["symbol_info"].quantity(position.open_quantity, market=True)
+                send_order(position.request_client, symbol=trade.pair, side=staged["exit_side"], quantity=quantity, reduceOnly=True, ordertype=OrderType.MARKET, positionSide="BOTH")
+                position.open_quantity = Decimal(0)
+                print(yellow.bold(f'{trade.pair} unprotected position of {quantity} closed at market on {position.account} account.'))
+        except Exception as e:
+            print(red.bold(f'x {trade.pair} could not be left safely on {position.account} account ({e})'))
 
-    time.sleep(60)
-    clear_stale_orders(pair)
+def check_trade_finished(trade):
+    now = CLOCK.now()
+    print(f'{trade.pair} number of tries: {trade.retries} and maximum value: {MAX_ORDER_RETRIES}')
 
-def main(pair, quantity, interval=Intervals.DAY, leverage=2, market=Markets.FUTURES, side=MarketSide.LONG, limit=0, target=1):
-    global TARGET 
-    global TARGET_REACHED
-    global MAX_ORDER_RETRIES
-    global RETRIES
-    init(interval)
+    print('TARGET REACHED: {} - {} < {}'.format(trade.target_reached, format_time(now), format_time(trade.end_time)))
+    print(f'Target reached?: {trade.target_reached}')
+    print(f'SL reached?: {trade.stop_loss_reached}')
+    print(f'Interval finished?: {now < trade.end_time}')
 
-    if (market == Markets.FUTURES):
-        pair = pair + 'USDT'
-   
+    if trade.target_reached:
+        print(green.bold(f'\n\t\t{trade.pair} target has been reached!'))
+    elif trade.retries < MAX_ORDER_RETRIES:
+        print(red.bold(f'\n\t\tMax number of retries reached: {trade.retries} === {MAX_ORDER_RETRIES}.'))
+    else:
+        print(red.bold(f'\n\t\tInterval has finished ({format_time(now)} < {format_time(trade.end_time)}), target has NOT been reached. Exiting.'))
+
+    # Stale orders are cleared a minute later
+    trade.finish_time = CLOCK.now() + 60 * 1000
+
+class TradingEngine:
+    """Drives several trades from a single loop. Candles of the same pair and interval are fetched
+    (or streamed) once for all its trades, open orders are taken in one snapshot per account and
+    check, and the order tracker of the account is shared by all its trades. Candles come from
+    `candles(pair, interval, market)` when given (paper trading feeds) instead of Binance, and
+    streamed candles from `stream_url` when given (a local stream server) instead of Binance. Once
+    `stop_event` (threading or multiprocessing Event) is set, the loop stops between two steps and
+    the trades are left safely (leave_trade)."""
+
+    def __init__(self, trades, stream=False, track_orders=False, workers=SCAN_WORKERS, candles=None, stop_event=None, stream_url=None):
+        self.trades = list(trades)
+        self.stop_event = stop_event
+        self.stream_url = stream_url
+        self.stream = stream and candles is None
+        self.candles = candles or get_last_binance_candles
+        self.track_orders = track_orders
+        self.executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(self.trades))))
+        self.live_candles = {}
+        self.order_trackers = {}
+        self.updated = threading.Event()
+
+    @staticmethod
+    def candles_key(trade):
+        return (trade.pair, trade.interval, trade.market)
+
+    def accounts(self, trades):
+        """(trade, position) of the trades grouped by the request client of their account."""
+        accounts = {}
+        for trade in trades:
+            for position in trade.positions:
+                accounts.setdefault(position.request_client, []).append((trade, position))
+        return accounts
+
+    def start(self):
+        if (self.stop_event is not None):
+            # Wake the loop up as soon as the trade is cancelled
+            threading.Thread(target=self.wake_on_stop, daemon=True).start()
+
+        # Trading rules are loaded and futures entries staged before the candle opens, so only the
+        # entry order is sent when the candle turns
+        for trade in self.trades:
+            get_symbol_info(trade.pair, trade.market)
+        stage_positions(self.trades, self.executor)
+
+        if (self.stream):
+            # Candle updates are pushed by the kline stream instead of polled every sleep timeout
+            for key in dict.fromkeys(self.candles_key(trade) for trade in self.trades):
+                self.live_candles[key] = LiveCandles(*key, url=self.stream_url, on_update=self.updated.set)
+                self.live_candles[key].start()
+                print(white.bold(f'Streaming {key[0]} {key[1]} candles.'))
+
+        if (self.track_orders):
+            # Take profit and stop loss fills are pushed by the user data stream instead of polled
+            futures_trades = [trade for trade in self.trades if trade.market == Markets.FUTURES]
+            for request_client, positions in self.accounts(futures_trades).items():
+                order_tracker = OrderTracker(request_client, on_update=self.updated.set)
+                order_tracker.start()
+                self.order_trackers[request_client] = order_tracker
+                for trade, position in positions:
+                    position.order_tracker = order_tracker
+            if (len(self.order_trackers)):
+                print(white.bold('Tracking orders from the user data stream.'))
+
+    def wake_on_stop(self):
+        self.stop_event.wait()
+        self.updated.set()
+
+    def stop(self):
+        for live_candles in self.live_candles.values():
+            live_candles.stop()
+        for order_tracker in self.order_trackers.values():
+            order_tracker.stop()
+        self.executor.shutdown(wait=False)
+
+    def active_trades(self):
+        return [trade for trade in self.trades if not trade.finished]
+
+    def wait(self):
+        """Sleep until the next candle open or poll of the active trades (see poll_timeout), waking
+        up as soon as a candle or order update arrives."""
+        now = CLOCK.now()
+        CLOCK.wait(self.updated, min(poll_timeout(trade, now) for trade in self.active_trades()))
+        self.updated.clear()
+
+    def fetch_candles(self, trades):
+        """Last and current candles of every pair and interval traded, None when they failed."""
+        keys = list(dict.fromkeys(self.candles_key(trade) for trade in trades))
+        if (self.stream):
+            return { key: self.live_candles[key].candles() for key in keys }
+
+        def fetch(key):
+            try:
+                return self.candles(*key)
+            except Exception:
+                return None
+        return dict(zip(keys, self.executor.map(fetch, keys)))
+
+    def step(self):
+        now = CLOCK.now()
+        trades = []
+        for trade in self.active_trades():
+            if (trade.target_reached or is_open_trade_window(trade, now)):
+                trades.append(trade)
+            elif (not self.stream):
+                print(yellow("\nChecking {} candle open: {} -> {}. Waiting for the open at {}.".format(trade.pair, format_time(now), False, format_time(trade.start_time))))
+        if (not len(trades)):
+            return
+
+        # A single open orders snapshot per account for this check
+        for request_client, positions in self.accounts(trades).items():
+            open_orders = OpenOrders(request_client, [trade.pair for trade, position in positions])
+            for trade, position in positions:
+                position.open_orders = open_orders
+
+        candles = self.fetch_candles(trades)
+        # Trades run concurrently so orders placed for a pair do not delay the others
+        list(self.executor.map(lambda trade: self.step_trade(trade, candles[self.candles_key(trade)]), trades))
+
+    def step_trade(self, trade, candles):
+        try:
+            if (trade.target_reached):
+                if (trade.finish_time is None):
+                    check_trade_finished(trade)
+                elif (CLOCK.now() >= trade.finish_time):
+                    for position in trade.positions:
+                        clear_stale_orders(trade, position)
+                    trade.finished = True
+            elif (candles is not None):
+                if (not self.stream):
+                    print(yellow("\nChecking {} candle open: {} -> {}.".format(trade.pair, format_time(CLOCK.now()), True)))
+                trade_the_open(trade, candles)
+        except Exception as e:
+            print(red.bold(f'x Something failed trading {trade.pair} ({e})'))
 
-    if (side == MarketSide.SHORT):
-        TARGET = 0
+    def stopped(self):
+        return self.stop_event is not None and self.stop_event.is_set()
 
-    print(white.bold('* Liquidity trading of: {} with {} as amount at {} candle with x{} leverage and at {} market starting at {} and finishing at {}.'.format(pair, quantity, interval, leverage, market, START_INTERVAL, END_INTERVAL)))
-    while not TARGET_REACHED:
-        if (check_open_trade_ready()):
-            trade_the_open(pair, interval, quantity, leverage, market, side, limit, target)
-    # Close stale orders when target has been reached
-    check_trade_finished(pair, side, interval, market)
+    def run(self):
+        self.start()
+        try:
+            while len(self.active_trades()) and not self.stopped():
+                self.wait()
+                if (self.stopped()):
+                    break
+                self.step()
+            if (self.stopped()):
+                print(yellow.bold('\nTrade cancelled, leaving it safely.'))
+                for trade in self.active_trades():
+                    leave_trade(trade)
+        finally:
+            self.stop()
+
+def main(pair, quantity, interval=Intervals.DAY, leverage=2, market=Markets.FUTURES, side=MarketSide.LONG, limit=0, target=1, stream=False, track_orders=False, accounts=None, stop_event=None):
+    pairs = [pair] if isinstance(pair, str) else pair
+    accounts = load_accounts(accounts, quantity)
+    trades = [Trade(pair, accounts, interval, leverage, market, side, limit, target) for pair in pairs]
+
+    for trade in trades:
+        for position in trade.positions:
+            print(white.bold('* Liquidity trading of: {} with {} as amount at {} candle with x{} leverage and at {} market starting at {} and finishing at {} ({} account).'.format(trade.pair, position.quantity, interval, leverage, market, format_time(trade.start_time), format_time(trade.end_time), position.account)))
+
+    TradingEngine(trades, stream, track_orders, stop_event=stop_event).run()
+    if (any(trade.aborted for trade in trades)):
+        sys.exit(1)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Trade the open of candles in different timeframes.')
-    parser.add_argument('--pair', type=str, help='Cryptocurrency pair to trade.')
+    parser.add_argument('--pair', type=str, nargs='+', help='Cryptocurrency pairs to trade, all of them from a single process.')
     parser.add_argument('--quantity', type=float, help='Quantity in USD to trade.')
     parser.add_argument('--interval', type=Intervals.from_string, choices=list(Intervals), help='Candle timeframe to trade.')
     parser.add_argument('--leverage', type=int, help='Leverage to apply on the trade.')
@@ -809,14 +1589,33 @@ if __name__ == "__main__":
     parser.add_argument('--risk', type=int, help='Risk to take with the trade.', default=4)
     parser.add_argument('--target', type=int, help='Fibonnacci target to reach.', default=4)
     parser.add_argument('--check', action='store_true', help='Check best pair to trade.')
+    parser.add_argument('--workers', type=int, help='Maximum concurrent requests when checking best pair to trade.', default=SCAN_WORKERS)
+
+    parser.add_argument('--min-volume', type=float, help='Minimum 24h quote volume (USDT) of the pairs to check.')
+    parser.add_argument('--top-volume', type=int, help='Check only the N pairs with the highest 24h quote volume.')
+
+    parser.add_argument('--intervals', type=Intervals.from_string, nargs='+', choices=list(Intervals), help='Candle timeframes to check at once (with --check).')
+
+    parser.add_argument('--stream', action='store_true', help='Follow candles from the kline stream instead of polling them.')
+    parser.add_argument('--track-orders', action='store_true', help='Follow take profit and stop loss orders from the user data stream instead of polling them.')
+    parser.add_argument('--scanner', type=str, help='Url of a running scanner to query instead of scanning (with --check).', default=SCANNER_URL)
+    parser.add_argument('--latency', action='store_true', help='Print the latency of the requests per endpoint when finished.')
+    parser.add_argument('--accounts', type=str, nargs='+', help='Accounts to mirror the trade on, keys of every account are read from <ACCOUNT>_API_KEY and <ACCOUNT>_SECRET_KEY.')
 
     args = parser.parse_args()
 
+    if (args.latency):
+        atexit.register(TRANSPORT.print_stats)
+
+    if (args.check and args.intervals):
+        check_best_trades(args.intervals, args.workers, args.min_volume, args.top_volume, args.scanner)
+        sys.exit()
+
     if (args.check):
-        check_best_trade(args.interval.value)
+        check_best_trade(args.interval.value, args.workers, args.min_volume, args.top_volume, args.scanner)
         sys.exit()
 
     MAX_STOP_LOSS_RISK = args.risk
-    main(args.pair, args.quantity, args.interval.value, args.leverage, args.market, args.side, args.limit, args.target)
+    main(args.pair, args.quantity, args.interval.value, args.leverage, args.market, args.side, args.limit, args.target, args.stream, args.track_orders, args.accounts)
 
     print(green.bold('\nOrders successfully set.'))
@@ -0,0 +1,405 @@
+#!/usr/bin/python3
+
+# Paper trading: the trade loop of liquidity.py with every order sent to a futures exchange simulated
+# in process instead of Binance. Orders are matched against the live candles, or against the klines
+# store replayed faster than real time, with no network needed once the klines are stored.
+# Usage: python3 paper.py --pair XMR --quantity 10 --interval DAY --leverage 5 --target 2
+#        python3 klinestore.py --pair XMRUSDT --intervals HOUR --start 2024-01-01
+#        python3 paper.py --pair XMR --quantity 10 --interval DAY --leverage 5 --target 2 --replay 2024-01-01 2024-03-01
+import argparse
+import copy
+import itertools
+import math
+import threading
+import time
+import numpy as np
+
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+from binance_f.exception.binanceapiexception import BinanceApiException
+from binance_f.model.constant import OrderSide, OrderType
+from binance_f.model.order import Order
+
+import liquidity
+from liquidity import Intervals, Markets, MarketSide, Account, Trade, TradingEngine
+from backtest import default_base
+from candles import Candle
+from klinestore import KlineStore, KLINES_STORE_ROOT
+from simple_chalk import white, green, red, yellow
+
+# Wallet balance (USDT) of every paper account
+PAPER_BALANCE = 1000
+# Fee of every fill as a fraction of its notional
+PAPER_FEE = 0.0004
+
+STOP_ORDER_TYPES = (OrderType.STOP, OrderType.STOP_MARKET)
+TAKE_PROFIT_ORDER_TYPES = (OrderType.TAKE_PROFIT, OrderType.TAKE_PROFIT_MARKET)
+
+def paper_error(code, message):
+    """Exception as the RequestClient raises it for an error response."""
+    return BinanceApiException(BinanceApiException.EXEC_ERROR, '[Executing] {}: {}'.format(code, message))
+
+class PaperExchange:
+    """Futures account answering the RequestClient calls of the trading code in process. MARKET
+    orders fill at the last price, TAKE_PROFIT, STOP_MARKET and LIMIT orders rest until a price
+    update reaches them. Positions are one way (positionSide BOTH), closePosition and reduceOnly
+    orders only reduce them and expire when there is nothing to reduce."""
+
+    def __init__(self, name='paper', clock=None, balance=PAPER_BALANCE, fee=PAPER_FEE):
+        self.name = name
+        self.clock = clock
+        self.balance = balance
+        self.fee = fee
+        self.orders = {}
+        self.order_ids = itertools.count(1)
+        self.prices = {}
+        # symbol: [amount (negative when short), entry price]
+        self.positions = {}
+        self.leverages = {}
+        self.margin_types = {}
+        self.realized_pnl = 0.0
+        self.fees = 0.0
+        self.fills = 0
+        self.lock = threading.RLock()
+
+    def now(self):
+        return int(self.clock.now()) if self.clock is not None else int(time.time() * 1000)
+
+    def change_initial_leverage(self, symbol, leverage):
+        with self.lock:
+            self.leverages[symbol] = leverage
+        return SimpleNamespace(symbol=symbol, leverage=leverage)
+
+    def change_margin_type(self, symbol, marginType):
+        with self.lock:
+            if (self.margin_types.get(symbol) == marginType):
+                raise paper_error(-4046, 'No need to change margin type.')
+            self.margin_types[symbol] = marginType
+        return SimpleNamespace(code=200, msg='success')
+
+    def post_order(self, symbol, side, ordertype, timeInForce=None, quantity=None, reduceOnly=None, price=None, newClientOrderId=None, stopPrice=None, workingType=None, closePosition=None, positionSide=None, **kwargs):
+        with self.lock:
+            last_price = self.prices.get(symbol)
+            if (last_price is None):
+                raise paper_error(-1121, 'Invalid symbol.')
+            order = Order()
+            order.orderId = next(self.order_ids)
+            order.symbol = symbol
+            order.side = side
+            order.type = order.origType = ordertype
+            order.timeInForce = timeInForce
+            order.positionSide = positionSide or 'BOTH'
+            order.origQty = float(quantity) if quantity is not None else 0.0
+            order.executedQty = 0.0
+            order.price = float(price) if price is not None else 0.0
+            order.stopPrice = float(stopPrice) if stopPrice is not None else 0.0
+            order.reduceOnly = bool(reduceOnly or closePosition)
+            order.closePosition = bool(closePosition)
+            order.clientOrderId = newClientOrderId
+            order.status = 'NEW'
+            order.updateTime = self.now()
+
+            if (ordertype == OrderType.MARKET):
+                self.fill(order, last_price, order.updateTime)
+                return copy.copy(order)
+            if (ordertype not in STOP_ORDER_TYPES + TAKE_PROFIT_ORDER_TYPES + (OrderType.LIMIT,)):
+                raise paper_error(-1116, 'Invalid orderType.')
+            if (order.closePosition and any(other.status == 'NEW' and other.closePosition and other.symbol == symbol and other.side == side and (other.type in STOP_ORDER_TYPES) == (ordertype in STOP_ORDER_TYPES) for other in self.orders.values())):
+                raise paper_error(-4130, 'An open stop or take profit order with GTE and closePosition in the direction is existing.')
+            if (ordertype != OrderType.LIMIT and self.triggered(order, last_price, last_price)):
+                raise paper_error(-2021, 'Order would immediately trigger.')
+            self.orders[order.orderId] = order
+            return copy.copy(order)
+
+    def get_order(self, symbol, orderId=None, origClientOrderId=None):
+        with self.lock:
+            if (orderId is None):
+                orderId = next((order.orderId for order in self.orders.values() if origClientOrderId is not None and order.clientOrderId == origClientOrderId), None)
+            order = self.orders.get(orderId)
+            if (order is None or order.symbol != symbol):
+                raise paper_error(-2013, 'Order does not exist.')
+            return copy.copy(order)
+
+    def cancel_order(self, symbol, orderId=None, origClientOrderId=None):
+        with self.lock:
+            order = self.orders.get(orderId)
+            if (order is None or order.symbol != symbol or order.status != 'NEW'):
+                raise paper_error(-2011, 'Unknown order sent.')
+            order.status = 'CANCELED'
+            order.updateTime = self.now()
+            return copy.copy(order)
+
+    def cancel_all_orders(self, symbol):
+        with self.lock:
+            for order in self.orders.values():
+                if (order.symbol == symbol and order.status == 'NEW'):
+                    order.status = 'CANCELED'
+                    order.updateTime = self.now()
+        return SimpleNamespace(code=200, msg='The operation of cancel all open order is done.')
+
+    def get_open_orders(self, symbol=None):
+        with self.lock:
+            return [copy.copy(order) for order in self.orders.values() if order.status == 'NEW' and (symbol is None or order.symbol == symbol)]
+
+    @staticmethod
+    def triggered(order, high, low):
+        """Whether prices from `low` to `high` reach the resting order."""
+        if (order.type == OrderType.LIMIT):
+            return high >= order.price if order.side == OrderSide.SELL else low <= order.price
+        if (order.type in STOP_ORDER_TYPES):
+            return low <= order.stopPrice if order.side == OrderSide.SELL else high >= order.stopPrice
+        return high >= order.stopPrice if order.side == OrderSide.SELL else low <= order.stopPrice
+
+    @staticmethod
+    def fill_price(order, open):
+        """Price of the order once reached: its stop price (market orders) or limit price, or the open
+        when the price gapped through it, worse for stops and better for take profits and limits."""
+        price = order.stopPrice if order.type in (OrderType.STOP_MARKET, OrderType.TAKE_PROFIT_MARKET) else order.price
+        if (order.type in STOP_ORDER_TYPES):
+            return min(price, open) if order.side == OrderSide.SELL else max(price, open)
+        return max(price, open) if order.side == OrderSide.SELL else min(price, open)
+
+    def fill(self, order, price, timestamp):
+        amount, entry_price = self.positions.get(order.symbol, (Decimal(0), 0.0))
+        sign = 1 if order.side == OrderSide.BUY else -1
+        quantity = Decimal(str(order.origQty))
+        if (order.reduceOnly):
+            reducible = abs(amount) if amount * sign < 0 else Decimal(0)
+            quantity = reducible if order.closePosition else min(quantity, reducible)
+            if (not quantity):
+                order.status = 'EXPIRED'
+                order.updateTime = timestamp
+                return order
+
+        if (amount * sign < 0):
+            closed = min(quantity, abs(amount))
+            self.realized_pnl += float(closed) * (price - entry_price) * (1 if amount > 0 else -1)
+        new_amount = amount + sign * quantity
+        if (not new_amount):
+            entry_price = 0.0
+        elif (not amount or amount * new_amount < 0):
+            entry_price = price
+        elif (abs(new_amount) > abs(amount)):
+            entry_price = (entry_price * float(abs(amount)) + price * float(quantity)) / float(abs(new_amount))
+        self.positions[order.symbol] = [new_amount, entry_price]
+        self.fees += float(quantity) * price * self.fee
+        self.fills += 1
+
+        order.status = 'FILLED'
+        order.executedQty = float(quantity)
+        order.avgPrice = price
+        order.updateTime = timestamp
+        return order
+
+    def update(self, symbol, price, high=None, low=None, open=None, timestamp=None):
+        """Trades of the symbol from `open` through `high` and `low` to `price`, filling the resting
+        orders they reach. Stops are filled before take profits reached by the same update."""
+        high = price if high is None else high
+        low = price if low is None else low
+        open = price if open is None else open
+        timestamp = timestamp or self.now()
+        with self.lock:
+            self.prices[symbol] = price
+            orders = [order for order in self.orders.values() if order.symbol == symbol and order.status == 'NEW' and self.triggered(order, high, low)]
+            orders.sort(key=lambda order: order.type not in STOP_ORDER_TYPES)
+            for order in orders:
+                self.fill(order, self.fill_price(order, open), timestamp)
+
+    def unrealized_pnl(self):
+        with self.lock:
+            return sum(float(amount) * (self.prices.get(symbol, entry_price) - entry_price) for symbol, (amount, entry_price) in self.positions.items())
+
+    def wallet_balance(self):
+        return self.balance + self.realized_pnl - self.fees
+
+class LiveFeed:
+    """Binance candles of the trade loop, their last price is sent to the paper exchanges too. Resting
+    orders are matched against that price only, once per poll."""
+
+    def __init__(self):
+        self.exchanges = []
+        self.finished = False
+
+    def attach(self, exchange):
+        self.exchanges.append(exchange)
+
+    def candles(self, pair, interval, market=Markets.FUTURES):
+        candles = liquidity.get_last_binance_candles(pair, interval, market)
+        if (len(candles) and candles[-1] is not None):
+            for exchange in self.exchanges:
+                exchange.update(pair, candles[-1].close)
+        return candles
+
+class ReplayFeed:
+    """Clock and candles of a replay of the klines store. Base klines are released once the replay
+    time goes past their close, matching the paper exchanges orders against their range, and waits
+    jump the replay time forward (at least to the next kline released) instead of sleeping."""
+
+    def __init__(self, store, symbols, base, start_time, end_time, market=Markets.FUTURES):
+        self.base = Intervals(base)
+        self.klines = {}
+        for symbol in symbols:
+            klines = store.read(symbol, self.base, market)
+            if (not len(klines['open_time'])):
+                raise ValueError(f'No {self.base.value} klines of {symbol} stored, download them first with klinestore.py.')
+            self.klines[symbol] = klines
+        self.time = int(start_time)
+        self.end_time = int(end_time)
+        self.released = { symbol: int(np.searchsorted(klines['close_time'], self.time)) for symbol, klines in self.klines.items() }
+        self.exchanges = []
+        self.finished = False
+
+    def now(self):
+        return self.time
+
+    def attach(self, exchange):
+        """Send the released klines to the exchange from now on, starting at the last close."""
+        for symbol, released in self.released.items():
+            if (released):
+                exchange.update(symbol, float(self.klines[symbol]['close'][released - 1]), timestamp=self.time)
+        self.exchanges.append(exchange)
+
+    def next_release(self):
+        """Replay time when the next kline of any symbol is released, None once all of them are."""
+        times = [int(klines['close_time'][self.released[symbol]]) + 1 for symbol, klines in self.klines.items() if self.released[symbol] < len(klines['close_time'])]
+        return min(times) if len(times) else None
+
+    def advance(self, timestamp):
+        released = []
+        for symbol, klines in self.klines.items():
+            end = int(np.searchsorted(klines['close_time'], timestamp))
+            released += [(int(klines['close_time'][index]), symbol, index) for index in range(self.released[symbol], end)]
+            self.released[symbol] = end
+        for close_time, symbol, index in sorted(released):
+            klines = self.klines[symbol]
+            for exchange in self.exchanges:
+                exchange.update(symbol, float(klines['close'][index]), float(klines['high'][index]), float(klines['low'][index]), float(klines['open'][index]), close_time)
+        self.time = timestamp
+
+    def wait(self, event, timeout):
+        next_release = self.next_release()
+        timestamp = self.time + int(round(timeout * 1000))
+        if (next_release is not None):
+            timestamp = max(timestamp, next_release)
+        if (timestamp >= self.end_time or next_release is None):
+            timestamp = min(timestamp, self.end_time)
+            self.finished = True
+        self.advance(timestamp)
+        return event.is_set()
+
+    def candles(self, pair, interval, market=Markets.FUTURES):
+        """[last candle, current candle] of the klines released, as get_last_binance_candles."""
+        klines = self.klines[pair]
+        released = self.released[pair]
+        open_time = liquidity.candle_open_time(interval, self.time)
+        last_open_time = liquidity.candle_open_time(interval, open_time - 1)
+        open_times = klines['open_time'][:released]
+        first, middle = (int(index) for index in np.searchsorted(open_times, [last_open_time, open_time]))
+
+        def candle(start, end, candle_open_time, close_time):
+            if (end <= start):
+                return None
+            return Candle(candle_open_time, float(klines['open'][start]), float(klines['high'][start:end].max()), float(klines['low'][start:end].min()), float(klines['close'][end - 1]), float(klines['volume'][start:end].sum()), close_time)
+        close_time = liquidity.next_candle_open_time(interval, self.time) - 1
+        current = candle(middle, released, open_time, close_time)
+        if (current is None and released):
+            # Just opened, no kline of the candle released yet: flat at the last price as Binance returns it
+            price = float(klines['close'][released - 1])
+            current = Candle(open_time, price, price, price, price, 0.0, close_time)
+        return [candle(first, middle, last_open_time, open_time - 1), current]
+
+def replay_exchange_info(store, feed, market=Markets.FUTURES):
+    """exchangeInfo saved along the klines, or trading rules made up from the prices of the replay
+    (price tick of 5 significant digits) when it was not saved."""
+    exchange_info = store.exchange_info(market)
+    if (exchange_info is not None):
+        return exchange_info
+    print(yellow.bold('No exchange information saved in the klines store, price ticks and lot steps are made up from the prices.'))
+    symbols = []
+    for symbol, klines in feed.klines.items():
+        price = float(klines['close'][max(feed.released[symbol] - 1, 0)])
+        exponent = math.floor(math.log10(price))
+        filters = [
+            { 'filterType': 'PRICE_FILTER', 'tickSize': '1e{}'.format(exponent - 4) },
+            { 'filterType': 'LOT_SIZE', 'stepSize': '1e{}'.format(-exponent - 1), 'minQty': '1e{}'.format(-exponent - 1) },
+            { 'filterType': 'MIN_NOTIONAL', 'notional': '5' },
+        ]
+        symbols.append({ 'symbol': symbol, 'status': 'TRADING', 'contractType': 'PERPETUAL', 'filters': filters })
+    return { 'symbols': symbols }
+
+def print_summary(exchanges):
+    for exchange in exchanges:
+        pnl = exchange.realized_pnl - exchange.fees
+        color = green if pnl >= 0 else red
+        print(color.bold(f'\nPaper account {exchange.name}: {exchange.fills} fills, realized PnL {round(exchange.realized_pnl, 4)} USDT, fees {round(exchange.fees, 4)} USDT, wallet balance {round(exchange.wallet_balance(), 4)} USDT.'))
+        for symbol, (amount, entry_price) in exchange.positions.items():
+            if (amount):
+                print(white.bold(f'\t{symbol} position {amount} at {round(entry_price, 8)}, unrealized PnL {round(float(amount) * (exchange.prices[symbol] - entry_price), 4)} USDT.'))
+
+def date_milliseconds(date):
+    """Milliseconds of a YYYY-MM-DD UTC date."""
+    return int((datetime.strptime(date, '%Y-%m-%d') - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+def main(pair, quantity, interval=Intervals.DAY, leverage=2, side=MarketSide.LONG, target=1, accounts=None, replay=None, base=None, store=None, balance=PAPER_BALANCE, fee=PAPER_FEE):
+    """Paper trade the pairs on Binance live candles, or replay them from `replay[0]` to `replay[1]`
+    (ms) over the `base` klines of the store."""
+    pairs = [pair] if isinstance(pair, str) else pair
+    interval = Intervals(interval)
+    names = accounts or ['paper']
+    feed = LiveFeed()
+    clock = liquidity.SERVER_CLOCK
+    if (replay is not None):
+        store = store or KlineStore()
+        base = Intervals(base or default_base(interval))
+        if (not liquidity.can_build_interval(base, interval)):
+            raise ValueError(f'{interval.value} candles can not be built from {base.value} klines.')
+        feed = clock = ReplayFeed(store, [pair + 'USDT' for pair in pairs], base, replay[0], replay[1])
+        liquidity.FUTURES_EXCHANGE_INFO.load(replay_exchange_info(store, feed))
+
+    exchanges = [PaperExchange(name, clock, balance, fee) for name in names]
+    for exchange in exchanges:
+        feed.attach(exchange)
+    liquidity.CLOCK = clock
+    try:
+        paper_accounts = [Account(exchange.name, exchange, quantity) for exchange in exchanges]
+        trades = [Trade(pair, paper_accounts, interval.value, leverage, Markets.FUTURES, side, 0, target) for pair in pairs]
+        for trade in trades:
+            print(white.bold('* Paper trading of: {} with {} as amount at {} candle with x{} leverage starting at {} and finishing at {} ({} accounts).'.format(trade.pair, quantity, interval.value, leverage, liquidity.format_time(trade.start_time), liquidity.format_time(trade.end_time), len(exchanges))))
+
+        engine = TradingEngine(trades, candles=feed.candles)
+        paper_start = time.perf_counter()
+        engine.start()
+        try:
+            while len(engine.active_trades()) and not feed.finished:
+                engine.wait()
+                engine.step()
+        finally:
+            engine.stop()
+        if (replay is not None):
+            print(white.bold(f'\nReplayed {round((feed.time - replay[0]) / (60 * liquidity.MINUTE_MILLISECONDS), 1)} hours of {base.value} klines in {round(time.perf_counter() - paper_start, 2)} seconds.'))
+    finally:
+        liquidity.CLOCK = liquidity.SERVER_CLOCK
+    print_summary(exchanges)
+    return exchanges
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Paper trade the open of candles on a simulated futures exchange.')
+    parser.add_argument('--pair', type=str, nargs='+', help='Cryptocurrency pairs to trade, all of them from a single process.')
+    parser.add_argument('--quantity', type=float, help='Quantity in USD to trade.')
+    parser.add_argument('--interval', type=Intervals.from_string, choices=list(Intervals), help='Candle timeframe to trade.', default=Intervals.DAY)
+    parser.add_argument('--leverage', type=int, help='Leverage to apply on the trade.', default=2)
+    parser.add_argument('--side', type=MarketSide.from_string, help='Type of order to be executed.', default=MarketSide.LONG)
+    parser.add_argument('--risk', type=int, help='Risk to take with the trade.', default=4)
+    parser.add_argument('--target', type=int, help='Fibonnacci target to reach.', default=4)
+    parser.add_argument('--accounts', type=str, nargs='+', help='Paper accounts to mirror the trade on.')
+    parser.add_argument('--balance', type=float, help='Wallet balance (USDT) of every paper account.', default=PAPER_BALANCE)
+    parser.add_argument('--fee', type=float, help='Fee of every fill.', default=PAPER_FEE)
+    parser.add_argument('--replay', type=str, nargs=2, metavar=('START', 'END'), help='Replay the klines store from START to END (UTC dates YYYY-MM-DD) instead of trading live candles.')
+    parser.add_argument('--base', type=Intervals.from_string, choices=list(Intervals), help='Stored klines replayed, HOUR (FIVETEEN_MINUTES under a day) by default.')
+    parser.add_argument('--root', type=str, help='Directory of the klines store.', default=KLINES_STORE_ROOT)
+    args = parser.parse_args()
+
+    liquidity.MAX_STOP_LOSS_RISK = args.risk
+    replay = (date_milliseconds(args.replay[0]), date_milliseconds(args.replay[1])) if args.replay else None
+    main(args.pair, args.quantity, args.interval, args.leverage, args.side, args.target, args.accounts, replay, args.base, KlineStore(args.root), args.balance, args.fee)
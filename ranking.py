@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+# Vectorized scoring of candles, shared by every code that needs to rank a lot of symbols at once.
+import numpy as np
+
+from bisect import bisect_left, insort
+
+def wick_percentages(opens, highs, lows, closes):
+    """Return a mask of green candles and the wick % of every candle.
+    Green candles wick is measured from the close to the high (positive), red ones from the close
+    to the low (negative), rounded to 2 decimals."""
+    opens = np.asarray(opens, dtype=float)
+    highs = np.asarray(highs, dtype=float)
+    lows = np.asarray(lows, dtype=float)
+    closes = np.asarray(closes, dtype=float)
+
+    green = opens < closes
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bullish = (highs - closes) / closes * 100
+        bearish = -((closes - lows) / lows * 100)
+    wicks = np.round(np.where(green, bullish, bearish), 2)
+    return green, wicks
+
+def top_k(values, k, reverse=False):
+    """Indexes of the k lowest values (greatest ones when reverse) ordered by value.
+    Only the candidates are sorted, ties keep the original order as a stable sort would."""
+    keys = np.asarray(values, dtype=float)
+    if reverse:
+        keys = -keys
+    keys = np.where(np.isnan(keys), np.inf, keys)
+    size = len(keys)
+    if (k <= 0 or not size):
+        return np.empty(0, dtype=int)
+
+    if (k < size):
+        kth = np.partition(keys, k - 1)[k - 1]
+        candidates = np.flatnonzero(keys <= kth)
+    else:
+        candidates = np.arange(size)
+    order = np.lexsort((candidates, keys[candidates]))
+    return candidates[order][:k]
+
+def rank_wicks(symbols, opens, highs, lows, closes, top=10):
+    """Best bullish (biggest wick first) and bearish (most negative wick first) candles, as lists of
+    { 'wick': ..., 'symbol': ... }."""
+    symbols = np.asarray(symbols, dtype=object)
+    green, wicks = wick_percentages(opens, highs, lows, closes)
+
+    bullish_indexes = np.flatnonzero(green)
+    bearish_indexes = np.flatnonzero(~green)
+    bullish = bullish_indexes[top_k(wicks[bullish_indexes], top, reverse=True)]
+    bearish = bearish_indexes[top_k(wicks[bearish_indexes], top)]
+
+    best_bullish_wicks = [{ 'wick': float(wicks[index]), 'symbol': symbols[index] } for index in bullish]
+    best_bearish_wicks = [{ 'wick': float(wicks[index]), 'symbol': symbols[index] } for index in bearish]
+    return best_bullish_wicks, best_bearish_wicks
+
+class WickLeaderboard:
+    """Bullish and bearish wick rankings kept sorted while candles are updated one by one.
+    Every symbol is indexed to its current entry, so an update is a binary search plus an insert
+    and a query just slices the best entries. Ties keep the symbols `order` as the full scan does."""
+
+    def __init__(self, order=None):
+        self.order = { symbol: index for index, symbol in enumerate(order or []) }
+        self.entries = {}
+        self.bullish = []
+        self.bearish = []
+
+    def update(self, symbol, cc_open, cc_high, cc_low, cc_close):
+        green, wick = wick_percentages(cc_open, cc_high, cc_low, cc_close)
+        green, wick = bool(green), float(wick)
+        if (symbol not in self.order):
+            self.order[symbol] = len(self.order)
+
+        self.remove(symbol)
+        if (np.isnan(wick)):
+            return
+        if (green):
+            entry = (-wick, self.order[symbol], symbol)
+            insort(self.bullish, entry)
+        else:
+            entry = (wick, self.order[symbol], symbol)
+            insort(self.bearish, entry)
+        self.entries[symbol] = (green, entry)
+
+    def remove(self, symbol):
+        if (symbol not in self.entries):
+            return
+        green, entry = self.entries.pop(symbol)
+        ranking = self.bullish if green else self.bearish
+        del ranking[bisect_left(ranking, entry)]
+
+    def wick(self, symbol):
+        """(green, wick) of the symbol current candle, None when unknown."""
+        if (symbol not in self.entries):
+            return None
+        green, entry = self.entries[symbol]
+        return green, -entry[0] if green else entry[0]
+
+    def top(self, k=10):
+        best_bullish_wicks = [{ 'wick': -wick, 'symbol': symbol } for wick, _, symbol in self.bullish[0:k]]
+        best_bearish_wicks = [{ 'wick': wick, 'symbol': symbol } for wick, _, symbol in self.bearish[0:k]]
+        return best_bullish_wicks, best_bearish_wicks
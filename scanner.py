@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+
+# Resident scanner: keeps the wick rankings of every perpetual up to date from live kline streams
+# and answers them through http, so best trades checks do not need to scan all the pairs.
+# Usage: python3 scanner.py --intervals HOUR DAY --port 8765
+#        SCANNER_URL=http://127.0.0.1:8765 python3 liquidity.py --interval DAY --check
+import argparse
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import liquidity
+from liquidity import Intervals, Markets
+from candles import Candle
+from ranking import WickLeaderboard
+from streams import KlineStream
+from simple_chalk import white, green
+
+SCANNER_HOST = '127.0.0.1'
+SCANNER_PORT = 8765
+
+class WickScanner:
+    """Wick rankings of several intervals, all of them built from a single kline stream of their
+    base interval. Rankings are seeded with one scan and then updated with every kline received."""
+
+    def __init__(self, intervals, symbols=None, feed=KlineStream, workers=liquidity.SCAN_WORKERS, min_volume=None, top_volume=None):
+        self.intervals = [Intervals(interval) for interval in intervals]
+        self.base = liquidity.get_base_interval(self.intervals)
+        self.symbols = symbols
+        self.feed = feed
+        self.workers = workers
+        self.min_volume = min_volume
+        self.top_volume = top_volume
+        self.lock = threading.Lock()
+        self.candles = { interval: {} for interval in self.intervals }
+        self.leaderboards = {}
+        self.updated = None
+        self.stream = None
+
+    def start(self):
+        if (self.symbols is None):
+            self.symbols = liquidity.get_perpetual_symbols(self.min_volume, self.top_volume)
+        self.leaderboards = { interval: WickLeaderboard(self.symbols) for interval in self.intervals }
+
+        now = int(time.time() * 1000)
+        limit = liquidity.get_klines_limit(self.base, self.intervals, now)
+        scan_start = time.perf_counter()
+        symbols_candles = liquidity.fetch_symbols_candles(self.symbols, self.base.value, Markets.FUTURES, self.workers, limit)
+        for symbol, candles in zip(self.symbols, symbols_candles):
+            for candle in candles:
+                self.update(symbol, candle)
+        print(white.bold(f'Scanner seeded with {len(self.symbols)} pairs in {round(time.perf_counter() - scan_start, 2)} seconds.'))
+
+        self.stream = self.feed(self.symbols, self.base.value, self.on_kline)
+        self.stream.start()
+        print(green.bold(f'✓ Scanner streaming {self.base.value} klines for {", ".join(interval.value for interval in self.intervals)}.'))
+
+    def stop(self):
+        if (self.stream is not None):
+            self.stream.stop()
+
+    def on_kline(self, pair, candle, closed):
+        self.update(pair, candle)
+
+    def update(self, symbol, kline):
+        """Merge a base kline (Candle) into the current candle of every interval and re-rank the
+        symbol. Highs and lows of a kline only grow, so merging the updates of the same kline is safe."""
+        with self.lock:
+            for interval in self.intervals:
+                open_time = liquidity.candle_open_time(interval, kline.open_time)
+                candle = self.candles[interval].get(symbol)
+                if (candle is not None and candle.open_time > open_time):
+                    continue
+                if (candle is None or candle.open_time < open_time):
+                    candle = Candle(open_time, kline.open, kline.high, kline.low, kline.close)
+                    self.candles[interval][symbol] = candle
+                else:
+                    candle.high = max(candle.high, kline.high)
+                    candle.low = min(candle.low, kline.low)
+                    candle.close = kline.close
+                self.leaderboards[interval].update(symbol, candle.open, candle.high, candle.low, candle.close)
+            self.updated = int(time.time() * 1000)
+
+    def ranking(self, interval, top=10):
+        interval = Intervals(interval)
+        with self.lock:
+            leaderboard = self.leaderboards[interval]
+            bullish, bearish = leaderboard.top(top)
+            btc = leaderboard.wick('BTCUSDT')
+            return {
+                'interval': interval.value,
+                'symbols': len(leaderboard.entries),
+                'updated': self.updated,
+                'btc': { 'green': btc[0], 'wick': btc[1] } if btc else None,
+                'bullish': bullish,
+                'bearish': bearish,
+            }
+
+def create_server(scanner, host=SCANNER_HOST, port=SCANNER_PORT):
+    """Http server answering GET /ranking?interval=1d&top=10 with the scanner rankings."""
+    class RankingHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if (url.path != '/ranking'):
+                return self.reply(404, { 'error': 'Not found' })
+            try:
+                interval = Intervals(query.get('interval', [scanner.intervals[0].value])[0])
+                top = int(query.get('top', [10])[0])
+                self.reply(200, scanner.ranking(interval, top))
+            except (ValueError, KeyError):
+                self.reply(400, { 'error': 'Interval not scanned' })
+
+        def reply(self, status, body):
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), RankingHandler)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Keep best wicks to trade up to date from live klines.')
+    parser.add_argument('--intervals', type=Intervals.from_string, nargs='+', choices=list(Intervals), help='Candle timeframes to rank.', default=[Intervals.DAY])
+    parser.add_argument('--host', type=str, help='Host to answer rankings queries.', default=SCANNER_HOST)
+    parser.add_argument('--port', type=int, help='Port to answer rankings queries.', default=SCANNER_PORT)
+    parser.add_argument('--workers', type=int, help='Maximum concurrent requests when seeding the rankings.', default=liquidity.SCAN_WORKERS)
+    parser.add_argument('--min-volume', type=float, help='Minimum 24h quote volume (USDT) of the pairs to rank.')
+    parser.add_argument('--top-volume', type=int, help='Rank only the N pairs with the highest 24h quote volume.')
+    args = parser.parse_args()
+
+    scanner = WickScanner(args.intervals, workers=args.workers, min_volume=args.min_volume, top_volume=args.top_volume)
+    scanner.start()
+    server = create_server(scanner, args.host, args.port)
+    print(white.bold(f'Answering rankings at http://{args.host}:{args.port}/ranking'))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    scanner.stop()
+    server.server_close()
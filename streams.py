@@ -0,0 +1,259 @@
+#!/usr/bin/python3
+
+# DOC: https://binance-docs.github.io/apidocs/futures/en/#continuous-contract-kline-candlestick-streams
+import base64
+import hashlib
+import json
+import socket
+import socketserver
+import struct
+import threading
+import websocket
+
+from candles import Candle, loads
+from simple_chalk import red, white
+
+BINANCE_FUTURES_STREAM_URL = "wss://fstream.binance.com/stream"
+BINANCE_SPOT_STREAM_URL = "wss://stream.binance.com:9443/stream"
+BINANCE_FUTURES_USER_STREAM_URL = "wss://fstream.binance.com/ws"
+BINANCE_SPOT_USER_STREAM_URL = "wss://stream.binance.com:9443/ws"
+
+# Binance accepts up to 200 streams in a single connection
+MAX_STREAMS_PER_CONNECTION = 200
+RECONNECT_TIMEOUT = 5
+
+def kline_stream_name(pair, interval, futures=True):
+    if (futures):
+        return '{}_perpetual@continuousKline_{}'.format(pair.lower(), interval)
+    return '{}@kline_{}'.format(pair.lower(), interval)
+
+def kline_event(pair, candle, closed=False, interval='1m', futures=True):
+    """Kline stream event of a Candle or a [open time, open, high, low, close, volume, close time] kline."""
+    if (isinstance(candle, Candle)):
+        candle = list(candle.as_tuple())
+    kline = { 't': candle[0], 'T': candle[6] if len(candle) > 6 else candle[0], 'i': interval, 'o': str(candle[1]), 'h': str(candle[2]), 'l': str(candle[3]), 'c': str(candle[4]), 'v': str(candle[5]) if len(candle) > 5 else '0', 'x': closed }
+    if (futures):
+        data = { 'e': 'continuous_kline', 'ps': pair, 'ct': 'PERPETUAL', 'k': kline }
+    else:
+        data = { 'e': 'kline', 's': pair, 'k': kline }
+    return { 'stream': kline_stream_name(pair, interval, futures), 'data': data }
+
+def order_update_event(symbol, order_id, status, side=None, order_type=None):
+    """ORDER_TRADE_UPDATE user data stream event."""
+    return { 'e': 'ORDER_TRADE_UPDATE', 'o': { 's': symbol, 'i': order_id, 'X': status, 'S': side, 'o': order_type } }
+
+def parse_kline_event(message):
+    """Return (pair, candle, closed) from a kline stream event, candle is a Candle as parsed from
+    REST klines."""
+    data = message.get('data', message)
+    if (data.get('e') not in ('kline', 'continuous_kline')):
+        return None
+    kline = data['k']
+    pair = data.get('ps', data.get('s'))
+    candle = Candle(int(kline['t']), float(kline['o']), float(kline['h']), float(kline['l']), float(kline['c']), float(kline['v']), int(kline['T']))
+    return pair, candle, kline['x']
+
+class KlineStream:
+    """Live klines of several pairs, every update is sent to `callback(pair, candle, closed)`
+    from the stream threads. Pairs are split in connections of MAX_STREAMS_PER_CONNECTION."""
+
+    def __init__(self, pairs, interval, callback, futures=True, url=None):
+        self.pairs = list(pairs)
+        self.interval = interval
+        self.callback = callback
+        self.futures = futures
+        self.url = url or (BINANCE_FUTURES_STREAM_URL if futures else BINANCE_SPOT_STREAM_URL)
+        self.connections = []
+        self.threads = []
+        self.running = False
+
+    def start(self):
+        self.running = True
+        for index in range(0, len(self.pairs), MAX_STREAMS_PER_CONNECTION):
+            names = [kline_stream_name(pair, self.interval, self.futures) for pair in self.pairs[index:index + MAX_STREAMS_PER_CONNECTION]]
+            url = '{}?streams={}'.format(self.url, '/'.join(names))
+            thread = threading.Thread(target=self.run, args=(url,), daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def run(self, url):
+        while self.running:
+            connection = websocket.WebSocketApp(url, on_message=self.on_message, on_error=self.on_error)
+            self.connections.append(connection)
+            connection.run_forever(ping_interval=60)
+            self.connections.remove(connection)
+            if (self.running):
+                print(white.bold(f'Kline stream closed, reconnecting in {RECONNECT_TIMEOUT} seconds.'))
+                threading.Event().wait(RECONNECT_TIMEOUT)
+
+    def on_message(self, connection, message):
+        event = parse_kline_event(loads(message))
+        if (event is not None):
+            self.callback(*event)
+
+    def on_error(self, connection, error):
+        print(red.bold(f'x Kline stream error ({error})'))
+
+    def stop(self):
+        self.running = False
+        for connection in list(self.connections):
+            connection.close()
+
+class UserDataStream:
+    """Events of the account user data stream (order updates, balance updates...) sent to
+    `callback(event)`. `on_reconnect()` is called when the connection is opened again, as events
+    may have been lost meanwhile."""
+
+    def __init__(self, listen_key, callback, futures=True, url=None, on_reconnect=None):
+        self.url = '{}/{}'.format(url or (BINANCE_FUTURES_USER_STREAM_URL if futures else BINANCE_SPOT_USER_STREAM_URL), listen_key)
+        self.callback = callback
+        self.on_reconnect = on_reconnect
+        self.connection = None
+        self.connection_count = 0
+        self.connected = threading.Event()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while self.running:
+            self.connection = websocket.WebSocketApp(self.url, on_open=self.on_open, on_message=self.on_message, on_error=self.on_error)
+            self.connection.run_forever(ping_interval=60)
+            self.connected.clear()
+            if (self.running):
+                print(white.bold(f'User data stream closed, reconnecting in {RECONNECT_TIMEOUT} seconds.'))
+                threading.Event().wait(RECONNECT_TIMEOUT)
+
+    def on_open(self, connection):
+        if (self.connection_count and self.on_reconnect is not None):
+            self.on_reconnect()
+        self.connection_count += 1
+        self.connected.set()
+
+    def on_message(self, connection, message):
+        self.callback(json.loads(message))
+
+    def on_error(self, connection, error):
+        print(red.bold(f'x User data stream error ({error})'))
+
+    def stop(self):
+        self.running = False
+        if (self.connection is not None):
+            self.connection.close()
+
+class LocalKlineFeed:
+    """Stand-in for KlineStream without network, klines are pushed by hand (tests, replays)."""
+
+    def __init__(self, pairs, interval, callback, futures=True, url=None):
+        self.pairs = list(pairs)
+        self.interval = interval
+        self.callback = callback
+        self.running = False
+
+    def start(self):
+        self.running = True
+
+    def push(self, pair, candle, closed=False):
+        """Push a Candle or a raw [open time, open, high, low, close...] kline."""
+        if (not isinstance(candle, Candle)):
+            candle = Candle.from_kline(candle)
+        if (self.running):
+            self.callback(pair, candle, closed)
+
+    def stop(self):
+        self.running = False
+
+class LocalStreamServer:
+    """Stand-in for Binance streams without network (tests, replays): a websocket server on
+    localhost sending every message to all the connected clients. Point KlineStream to `url`."""
+
+    GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.clients = []
+        self.lock = threading.Lock()
+        self.connected = threading.Condition(self.lock)
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                server.handshake(self.request)
+                with server.lock:
+                    server.clients.append(self.request)
+                    server.connected.notify_all()
+                try:
+                    server.read_frames(self.request)
+                finally:
+                    with server.lock:
+                        server.clients.remove(self.request)
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server((host, port), Handler)
+        self.url = 'ws://{}:{}/stream'.format(*self.server.server_address)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            for client in self.clients:
+                client.close()
+
+    def drop_clients(self):
+        """Close the connection of every client, as Binance does from time to time, so they reconnect."""
+        with self.lock:
+            for client in self.clients:
+                client.shutdown(socket.SHUT_RDWR)
+
+    def wait_clients(self, count=1, timeout=5):
+        with self.lock:
+            return self.connected.wait_for(lambda: len(self.clients) >= count, timeout)
+
+    def handshake(self, connection):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            request += connection.recv(1024)
+        key = next(line.split(': ', 1)[1] for line in request.decode().split('\r\n') if line.lower().startswith('sec-websocket-key: '))
+        accept = base64.b64encode(hashlib.sha1((key + self.GUID).encode()).digest()).decode()
+        connection.sendall('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: {}\r\n\r\n'.format(accept).encode())
+
+    def read_frames(self, connection):
+        """Discard client frames (pings) until the client closes the connection."""
+        while True:
+            header = connection.recv(2)
+            if (len(header) < 2 or header[0] & 0x0f == 0x8):
+                return
+            length = header[1] & 0x7f
+            if (length == 126):
+                length = struct.unpack('!H', connection.recv(2))[0]
+            elif (length == 127):
+                length = struct.unpack('!Q', connection.recv(8))[0]
+            # Client frames are always masked
+            length += 4
+            while length > 0:
+                chunk = connection.recv(min(length, 4096))
+                if (not chunk):
+                    return
+                length -= len(chunk)
+
+    def send(self, message):
+        payload = json.dumps(message).encode()
+        if (len(payload) < 126):
+            frame = struct.pack('!BB', 0x81, len(payload))
+        elif (len(payload) < 65536):
+            frame = struct.pack('!BBH', 0x81, 126, len(payload))
+        else:
+            frame = struct.pack('!BBQ', 0x81, 127, len(payload))
+        with self.lock:
+            for client in self.clients:
+                client.sendall(frame + payload)
+
+    def push_kline(self, pair, candle, closed=False, interval='1m', futures=True):
+        self.send(kline_event(pair, candle, closed, interval, futures))
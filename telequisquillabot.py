@@ -18,6 +18,9 @@ bot.
 import logging
 import liquidity
 import argparse
+import multiprocessing
+import threading
+import time
 from telegram import Update
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext
 
@@ -31,7 +34,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 parser = argparse.ArgumentParser(description='Trade the open of candles in different timeframes.')
-parser.add_argument('--pair', type=str, help='Cryptocurrency pair to trade.')
+parser.add_argument('--pair', type=str, nargs='+', help='Cryptocurrency pairs to trade, all of them from a single process.')
 parser.add_argument('--quantity', type=float, help='Quantity in USD to trade.')
 parser.add_argument('--interval', type=liquidity.Intervals.from_string, choices=list(liquidity.Intervals), help='Candle timeframe to trade.')
 parser.add_argument('--leverage', type=int, help='Leverage to apply on the trade.')
@@ -43,32 +46,200 @@ parser.add_argument('--end', type=int, help='Candle UTC end.', default=8)
 parser.add_argument('--risk', type=int, help='Risk to take with the trade.', default=4)
 parser.add_argument('--target', type=int, help='Fibonnacci target to reach.', default=4)
 parser.add_argument('--check', action='store_true', help='Check best pair to trade.')
+parser.add_argument('--stream', action='store_true', help='Follow candles from the kline stream instead of polling them.')
+parser.add_argument('--track-orders', action='store_true', help='Follow take profit and stop loss orders from the user data stream instead of polling them.')
+parser.add_argument('--accounts', type=str, nargs='+', help='Accounts to mirror the trade on, keys of every account are read from <ACCOUNT>_API_KEY and <ACCOUNT>_SECRET_KEY.')
+
+# Seconds a /check result is reused, it also expires when a new candle opens
+CHECK_CACHE_TTL = 60
+
+class CheckCache:
+    """Results of /check by intervals. Concurrent checks of the same intervals wait for the one
+    already scanning instead of scanning again."""
+
+    def __init__(self, ttl=CHECK_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.results = {}
+        self.scans = {}
+
+    def expiration(self, intervals, now):
+        """Expiration of a result scanned from `now` (ms): a scan running past a candle open still
+        ranks the previous candle, so it expires at that open."""
+        next_candle = min(liquidity.next_candle_open_time(interval, now) for interval in intervals)
+        return min(now + self.ttl * 1000, next_candle)
+
+    def get(self, intervals, scan):
+        key = tuple(liquidity.Intervals(interval).value for interval in intervals)
+        while True:
+            with self.lock:
+                result = self.results.get(key)
+                if (result is not None and result[0] > time.time() * 1000):
+                    return result[1]
+                scanning = self.scans.get(key)
+                if (scanning is None):
+                    scanning = self.scans[key] = threading.Event()
+                    break
+            # Another check is scanning these intervals, wait for its result
+            scanning.wait()
+
+        try:
+            scan_start = int(time.time() * 1000)
+            message = scan()
+            with self.lock:
+                self.results[key] = (self.expiration(key, scan_start), message)
+            return message
+        finally:
+            with self.lock:
+                del self.scans[key]
+            scanning.set()
+
+check_cache = CheckCache()
+
+# Trades running at the same time, each of them in its own process
+MAX_TRADE_JOBS = 4
+# Seconds a cancelled trade has to leave its positions safely before its process is terminated
+CANCEL_TIMEOUT = 30
+
+class TradeJobs:
+    """Trades launched from the bot. Every trade runs liquidity.main in its own process, so
+    handlers return straight away and a trade exiting (sys.exit on abort), crashing or stuck in
+    a request can not take the bot or the other trades with it. Trades are cancelled through
+    their stop event, so they stop between two checks and leave their positions safely
+    (liquidity.leave_trade), and a trade not stopping in time can still be terminated, which a
+    thread could not."""
+
+    def __init__(self, max_jobs=MAX_TRADE_JOBS):
+        self.max_jobs = max_jobs
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.next_id = 1
+        self.context = multiprocessing.get_context('spawn')
+
+    def running(self):
+        return [job for job in self.jobs.values() if job['status'] == 'running']
+
+    def start(self, description, args, on_finish):
+        """Launch liquidity.main(*args), `on_finish(job)` is called when it ends. Returns the job
+        or None when MAX_TRADE_JOBS trades are already running."""
+        with self.lock:
+            if (len(self.running()) >= self.max_jobs):
+                return None
+            stop_event = self.context.Event()
+            process = self.context.Process(target=liquidity.main, args=args, kwargs={ 'stop_event': stop_event })
+            job = { 'id': self.next_id, 'description': description, 'status': 'running', 'started': time.time(), 'process': process, 'stop_event': stop_event }
+            self.jobs[job['id']] = job
+            self.next_id += 1
+        job['process'].start()
+        threading.Thread(target=self.wait, args=(job, on_finish), daemon=True).start()
+        return job
+
+    def wait(self, job, on_finish):
+        job['process'].join()
+        with self.lock:
+            if (job['status'] == 'running'):
+                job['status'] = 'finished' if job['process'].exitcode == 0 else 'failed'
+        on_finish(job)
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if (job is None or job['status'] != 'running'):
+                return False
+            job['status'] = 'cancelled'
+        threading.Thread(target=self.stop, args=(job,), daemon=True).start()
+        return True
+
+    def stop(self, job, timeout=CANCEL_TIMEOUT):
+        """Ask the trade to stop, it is terminated only when it has not stopped after `timeout`."""
+        job['stop_event'].set()
+        job['process'].join(timeout)
+        if (job['process'].is_alive()):
+            logger.warning('Trade #%s did not stop in %s seconds, terminating it.', job['id'], timeout)
+            job['process'].terminate()
+            job['process'].join()
+
+    def shutdown(self, timeout=CANCEL_TIMEOUT):
+        """Stop every running trade when the bot exits."""
+        with self.lock:
+            jobs = self.running()
+            for job in jobs:
+                job['status'] = 'cancelled'
+        threads = [threading.Thread(target=self.stop, args=(job, timeout)) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def status(self):
+        with self.lock:
+            return [dict((key, value) for key, value in job.items() if key not in ('process', 'stop_event')) for job in self.jobs.values()]
+
+trade_jobs = TradeJobs()
 
 # Define a few command handlers. These usually take the two arguments update and
 # context.user = liquidity.check_best_trade(liquidity.Intervals.DAY.value)
 def check(update: Update, context: CallbackContext) -> None:
     """Send a message when the command /check is issued."""
-    if (len(context.args) == 1):
-        list = liquidity.check_best_trade(context.args[0])
-    else:
-        list = liquidity.check_best_trade(liquidity.Intervals.DAY.value)
+    intervals = context.args or [liquidity.Intervals.DAY.value]
+    try:
+        if (len(intervals) > 1):
+            list = check_cache.get(intervals, lambda: liquidity.check_best_trades(intervals))
+        else:
+            list = check_cache.get(intervals, lambda: liquidity.check_best_trade(intervals[0]))
+    except ValueError:
+        list = 'Intervalo no valido, usa /help'
     update.message.reply_text(list, parse_mode='HTML')
 
 def quisquilla(update: Update, context: CallbackContext) -> None:
-    """Send a message when the command /check is issued."""
+    """Launch a trade in background when the command /quisquilla is issued."""
     args = parser.parse_args(context.args)
-    message = liquidity.main(args.pair, args.quantity, args.interval.value, args.leverage, args.market, args.side, args.limit, args.target)
+    description = '{} {} {} x{} ({} USD)'.format(' '.join(args.pair), args.side, args.interval.value, args.leverage, args.quantity)
+    chat_id = update.message.chat_id
+
+    def on_finish(job):
+        context.bot.send_message(chat_id, f'<code>Trade #{job["id"]} {job["description"]}: {job["status"]}</code>', parse_mode='HTML')
+
+    job = trade_jobs.start(description, (args.pair, args.quantity, args.interval.value, args.leverage, args.market, args.side, args.limit, args.target, args.stream, args.track_orders, args.accounts), on_finish)
+    if (job is None):
+        update.message.reply_text(f'<code>Ya hay {MAX_TRADE_JOBS} trades en marcha, espera o usa /cancel</code>', parse_mode='HTML')
+        return
+    update.message.reply_text(f'<code>Trade #{job["id"]} {description} en marcha, usa /status o /cancel {job["id"]}</code>', parse_mode='HTML')
+
+def status(update: Update, _: CallbackContext) -> None:
+    """Send the trades status when the command /status is issued."""
+    jobs = trade_jobs.status()
+    if (not len(jobs)):
+        update.message.reply_text('<code>No hay trades</code>', parse_mode='HTML')
+        return
+    message = ''
+    for job in jobs:
+        minutes = int((time.time() - job['started']) / 60)
+        message += f'<code>#{job["id"]} {job["description"]}: {job["status"]} ({minutes} min)</code>\n'
     update.message.reply_text(message, parse_mode='HTML')
 
+def cancel(update: Update, context: CallbackContext) -> None:
+    """Stop a trade when the command /cancel is issued. Positions protected by their stop loss are
+    left on the exchange with their orders, the rest of orders are cancelled."""
+    try:
+        job_id = int(context.args[0])
+    except (IndexError, ValueError):
+        update.message.reply_text('<code>Uso: /cancel ID</code>', parse_mode='HTML')
+        return
+    if (trade_jobs.cancel(job_id)):
+        update.message.reply_text(f'<code>Trade #{job_id} cancelado, las posiciones abiertas siguen en Binance con su stop loss y take profits (las que no tienen stop loss se cierran)</code>', parse_mode='HTML')
+    else:
+        update.message.reply_text(f'<code>No hay ningun trade #{job_id} en marcha</code>', parse_mode='HTML')
+
 def help_command(update: Update, _: CallbackContext) -> None:
     """Send a message when the command /help is issued."""
     user ='Comandos G validos:\n' 
     user = user + '\n\t<code>/check: para ver las velitas donde poner manteca</code>\n'
-    user = user + '<code>\t\t\t\tParametros aceptados: 1h 4h 12h 1d 3d 1w 2w 1M</code>\n'
+    user = user + '<code>\t\t\t\tParametros aceptados: 1h 2h 4h 6h 12h 1d 3d 1w 2w 3w 1M (uno o varios)</code>\n'
     user = user + '<code>\t\t\t\tValor por defecto: 1d</code>\n'
     
     user = user + '\n\t<code>/quisquilla: Trade the open of candles in different timeframes.</code>\n'
-    user = user + '<code>\t\t\t\t--pair: Cryptocurrency pair to trade.</code>\n'
+    user = user + '<code>\t\t\t\t--pair: Cryptocurrency pairs to trade (one or several).</code>\n'
     user = user + '<code>\t\t\t\t--quantity: Quantity in USD to trade.</code>\n'
     user = user + '<code>\t\t\t\t--interval: Candle timeframe to trade.</code>\n'
     user = user + '<code>\t\t\t\t--leverage: Leverage to apply on the trade.</code>\n'
@@ -78,6 +249,13 @@ def help_command(update: Update, _: CallbackContext) -> None:
     user = user + '<code>\t\t\t\t--risk: Risk to take with the trade.</code>\n'
     user = user + '<code>\t\t\t\t--target: Fibonnacci target to reach.</code>\n'
     user = user + '<code>\t\t\t\t--check: Check best pair to trade.</code>\n'
+    user = user + '<code>\t\t\t\t--stream: Follow candles from the kline stream instead of polling them.</code>\n'
+    user = user + '<code>\t\t\t\t--track-orders: Follow take profit and stop loss orders from the user data stream.</code>\n'
+    user = user + '<code>\t\t\t\t--accounts: Accounts to mirror the trade on.</code>\n'
+
+    user = user + '\n\t<code>/status: para ver los trades lanzados con /quisquilla</code>\n'
+    user = user + '\n\t<code>/cancel: para parar un trade (las posiciones con stop loss siguen en Binance)</code>\n'
+    user = user + '<code>\t\t\t\tParametros aceptados: ID del trade</code>\n'
 
     user = user + '\n\t<code>/help: para ver los comandos G aceptados</code>\n'
     user = user + '<code>\t\t\t\tParametros aceptados: niguno joder, por eso pides ayuda</code>\n'
@@ -99,8 +277,10 @@ def main() -> None:
     dispatcher = updater.dispatcher
 
     # on different commands - answer in Telegram
-    dispatcher.add_handler(CommandHandler("check", check))
+    dispatcher.add_handler(CommandHandler("check", check, run_async=True))
     dispatcher.add_handler(CommandHandler("quisquilla", quisquilla))
+    dispatcher.add_handler(CommandHandler("status", status))
+    dispatcher.add_handler(CommandHandler("cancel", cancel))
     dispatcher.add_handler(CommandHandler("help", help_command))
 
     # on non command i.e message - echo the message on Telegram
@@ -113,6 +293,8 @@ def main() -> None:
     # SIGTERM or SIGABRT. This should be used most of the time, since
     # start_polling() is non-blocking and will stop the bot gracefully.
     updater.idle()
+    # Running trades leave their positions safely before the bot exits
+    trade_jobs.shutdown()
 
 
 if __name__ == '__main__':
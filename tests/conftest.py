@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# Modules are flat at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import liquidity
+from exchange import ExchangeInfo
+from streams import LocalStreamServer
+
+@pytest.fixture
+def server():
+    server = LocalStreamServer()
+    server.start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def exchange_info(monkeypatch):
+    """Futures exchange information with only BTCUSDT (tick 0.01, step 0.001)."""
+    exchange_info = ExchangeInfo('')
+    exchange_info.load({ 'symbols': [{ 'symbol': 'BTCUSDT', 'filters': [{ 'filterType': 'PRICE_FILTER', 'tickSize': '0.01' }, { 'filterType': 'LOT_SIZE', 'stepSize': '0.001' }] }] })
+    monkeypatch.setattr(liquidity, 'FUTURES_EXCHANGE_INFO', exchange_info)
+    return exchange_info
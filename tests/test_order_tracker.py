@@ -0,0 +1,138 @@
+import threading
+import time
+from decimal import Decimal
+
+import pytest
+
+import liquidity
+import streams
+from binance_f.model.constant import OrderSide, OrderType
+from streams import order_update_event
+from transport import RequestHeld
+
+class Client:
+    """RequestClient of an account whose stop loss is 10 and take profits 11 and 12."""
+
+    def __init__(self):
+        self.listen_keys = 0
+        self.orders = []
+        self.cancelled = []
+        self.get_order_calls = []
+        self.open_orders = [12]
+
+    def start_user_data_stream(self):
+        self.listen_keys += 1
+        return 'key{}'.format(self.listen_keys)
+
+    def keep_user_data_stream(self):
+        pass
+
+    def post_order(self, **order):
+        self.orders.append(order)
+        return type('Order', (), { 'orderId': 100 + len(self.orders), 'status': 'NEW' })()
+
+    def cancel_order(self, symbol, orderId):
+        self.cancelled.append(orderId)
+
+    def get_open_orders(self, symbol=None):
+        return [type('Order', (), { 'orderId': order_id, 'status': 'NEW', 'symbol': symbol })() for order_id in self.open_orders]
+
+    def get_order(self, symbol, orderId):
+        self.get_order_calls.append(orderId)
+        return type('Order', (), { 'orderId': orderId, 'status': 'FILLED' })()
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if (time.time() > deadline):
+            return False
+        time.sleep(0.01)
+    return True
+
+@pytest.fixture
+def tracked(server, exchange_info, monkeypatch):
+    monkeypatch.setattr(liquidity.SERVER_CLOCK, 'synced', time.monotonic())
+    monkeypatch.setattr(streams, 'RECONNECT_TIMEOUT', 0.05)
+
+    client = Client()
+    tracker = liquidity.OrderTracker(client, url=server.url)
+    tracker.start()
+    trade = liquidity.Trade('BTC', [liquidity.Account('test', client, 20)], liquidity.Intervals.HOUR.value, 2)
+    position = trade.positions[0]
+    position.order_tracker = tracker
+    position.open_quantity = Decimal('0.4')
+    position.breakeven = 100.0
+    position.targets = ['101.00', '102.00']
+    position.stop_loss_order = { 'order_id': 10, 'stop_loss': '99.00', 'side': OrderSide.SELL }
+    position.take_profit_orders = [{ 'take_profit': '101.00', 'quantity': '0.200', 'orderId': 11 }, { 'take_profit': '102.00', 'quantity': '0.200', 'orderId': 12 }]
+    yield trade, position, tracker, client
+    tracker.stop()
+
+def test_take_profit_fill_moves_the_stop_loss_without_requests(server, tracked):
+    trade, position, tracker, client = tracked
+    assert tracker.synced
+    server.send(order_update_event('BTCUSDT', 11, 'FILLED', OrderSide.SELL, OrderType.TAKE_PROFIT))
+    assert wait_for(lambda: tracker.status(11) == 'FILLED')
+
+    liquidity.check_take_profits_reached(trade, position, 100.0)
+
+    stop_loss = client.orders[-1]
+    assert stop_loss['ordertype'] == OrderType.STOP_MARKET and stop_loss['reduceOnly']
+    assert stop_loss['quantity'] == '0.200' and stop_loss['stopPrice'] == '100.00'
+    assert position.stop_loss_order['order_id'] == 101
+    assert [order['orderId'] for order in position.take_profit_orders] == [12]
+    assert wait_for(lambda: client.cancelled == [10])
+    assert client.get_order_calls == []
+
+def test_held_order_checks_move_nothing(tracked, monkeypatch):
+    trade, position, tracker, client = tracked
+    position.order_tracker = None
+    def get_open_orders(symbol=None):
+        raise RequestHeld('GET /fapi/v1/openOrders held by the request weight governor')
+    monkeypatch.setattr(client, 'get_open_orders', get_open_orders)
+
+    # Status unknown, checked again later
+    liquidity.check_take_profits_reached(trade, position, 100.0)
+    liquidity.check_stop_loss_reached(trade, position, 98.0, 101.0)
+
+    assert [order['orderId'] for order in position.take_profit_orders] == [11, 12]
+    assert not position.target_reached and not position.stop_loss_reached
+    assert position.open_quantity == Decimal('0.4')
+    assert client.orders == [] and client.cancelled == []
+
+def test_unknown_orders_are_requested_once_after_a_reconnection(server, tracked):
+    trade, position, tracker, client = tracked
+    server.send(order_update_event('BTCUSDT', 11, 'FILLED'))
+    assert wait_for(lambda: tracker.status(11) == 'FILLED')
+
+    # Events sent while disconnected are lost
+    server.drop_clients()
+    assert wait_for(lambda: not tracker.synced)
+    assert server.wait_clients(1)
+    assert tracker.status(11) is None and tracker.status(12) is None
+
+    # Still open orders come from the open orders snapshot, the others are requested once
+    assert liquidity.get_order_status(trade, position, 12) == 'NEW'
+    assert liquidity.get_order_status(trade, position, 11) == 'FILLED'
+    assert client.get_order_calls == [11]
+    assert tracker.status(12) == 'NEW' and tracker.status(11) == 'FILLED'
+
+    # Known again, followed by events
+    server.send(order_update_event('BTCUSDT', 12, 'FILLED'))
+    assert wait_for(lambda: tracker.status(12) == 'FILLED')
+    position.open_orders = None
+    assert liquidity.get_order_status(trade, position, 12) == 'FILLED'
+    assert client.get_order_calls == [11]
+
+def test_expired_listen_key_is_renewed_with_a_single_keepalive(server, tracked):
+    trade, position, tracker, client = tracked
+    keepalive_thread = tracker.keepalive_thread
+    first_stream = tracker.stream
+    server.send({ 'e': 'listenKeyExpired' })
+    assert wait_for(lambda: tracker.stream is not first_stream and tracker.synced)
+    assert client.listen_keys == 2 and tracker.listen_key == 'key2'
+    assert tracker.keepalive_thread is keepalive_thread
+    assert wait_for(lambda: len([thread for thread in threading.enumerate() if thread.name.endswith('(keepalive)')]) == 1)
+
+    server.send(order_update_event('BTCUSDT', 12, 'FILLED'))
+    assert wait_for(lambda: tracker.status(12) == 'FILLED')
@@ -0,0 +1,46 @@
+import random
+
+import liquidity
+import ranking
+from candles import Candle
+from liquidity import Intervals
+from scanner import WickScanner
+from streams import LocalKlineFeed
+
+HOUR = 60 * 60 * 1000
+DAY_OPEN = 1700006400000 // (24 * HOUR) * (24 * HOUR)
+SYMBOLS = ['S{}USDT'.format(index) for index in range(40)]
+
+def random_kline(rng, open_time):
+    open = rng.uniform(50, 150)
+    close = open * rng.uniform(0.95, 1.05)
+    return Candle(open_time, open, max(open, close) * rng.uniform(1, 1.04), min(open, close) * rng.uniform(0.96, 1), close)
+
+def full_ranking(scanner, interval, top):
+    candles = [scanner.candles[interval][symbol] for symbol in SYMBOLS]
+    return ranking.rank_wicks(SYMBOLS, [candle.open for candle in candles], [candle.high for candle in candles], [candle.low for candle in candles], [candle.close for candle in candles], top)
+
+def leaderboard(scanner, interval, top):
+    ranked = scanner.ranking(interval, top)
+    return ranked['bullish'], ranked['bearish']
+
+def test_leaderboards_follow_the_feed_as_a_full_ranking(monkeypatch):
+    rng = random.Random(7)
+    seed = { symbol: [random_kline(rng, DAY_OPEN + HOUR * index) for index in range(3)] for symbol in SYMBOLS }
+    monkeypatch.setattr(liquidity, 'fetch_symbols_candles', lambda symbols, *args, **kwargs: [seed[symbol] for symbol in symbols])
+
+    scanner = WickScanner([Intervals.FOUR_HOURS, Intervals.DAY], SYMBOLS, feed=LocalKlineFeed)
+    scanner.start()
+    assert isinstance(scanner.stream, LocalKlineFeed)
+    for interval in scanner.intervals:
+        assert leaderboard(scanner, interval, 10) == full_ranking(scanner, interval, 10)
+
+    # Updates of the current kline, new klines and the next 4h candle, pushed in random order of symbols
+    for step in range(300):
+        symbol = rng.choice(SYMBOLS)
+        scanner.stream.push(symbol, random_kline(rng, DAY_OPEN + HOUR * (2 + step // 60)))
+        for interval in scanner.intervals:
+            assert leaderboard(scanner, interval, 5) == full_ranking(scanner, interval, 5)
+
+    scanner.stop()
+    assert not scanner.stream.running
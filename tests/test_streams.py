@@ -0,0 +1,105 @@
+import threading
+import time
+
+import liquidity
+from binance_f.model.constant import OrderSide, OrderType
+from candles import Candle
+
+HOUR = 60 * 60 * 1000
+
+class Clock:
+    """Local clock waking the engine often, so the test ends as soon as it is stopped."""
+
+    def now(self):
+        return int(time.time() * 1000)
+
+    def wait(self, event, timeout):
+        return event.wait(min(timeout, 0.05))
+
+class RecordingClient:
+    """RequestClient accepting every order and keeping them."""
+
+    def __init__(self):
+        self.orders = []
+        self.placed = threading.Event()
+
+    def change_initial_leverage(self, symbol, leverage):
+        pass
+
+    def change_margin_type(self, symbol, marginType):
+        pass
+
+    def post_order(self, **order):
+        self.orders.append(order)
+        if (order['ordertype'] == OrderType.STOP_MARKET):
+            self.placed.set()
+        return type('Order', (), { 'orderId': len(self.orders), 'status': 'NEW', 'updateTime': 0 })()
+
+    def get_open_orders(self, symbol=None):
+        return []
+
+    def cancel_all_orders(self, symbol):
+        pass
+
+def test_streamed_green_turn_opens_the_trade(server, exchange_info, monkeypatch):
+    open_time = int(time.time() * 1000) // HOUR * HOUR
+    last = Candle(open_time - HOUR, 110.0, 112.0, 99.0, 100.0, 1.0, open_time - 1)
+    current = Candle(open_time, 100.0, 100.2, 99.6, 99.8, 1.0, open_time + HOUR - 1)
+    monkeypatch.setattr(liquidity, 'CLOCK', Clock())
+    monkeypatch.setattr(liquidity, 'get_binance_klines', lambda *args, **kwargs: [last, current])
+
+    client = RecordingClient()
+    trade = liquidity.Trade('BTC', [liquidity.Account('test', client, 20)], liquidity.Intervals.HOUR.value, 2)
+    trade.start_time = open_time
+    trade.end_time = open_time + HOUR
+    stop_event = threading.Event()
+    engine = liquidity.TradingEngine([trade], stream=True, stop_event=stop_event, stream_url=server.url)
+    thread = threading.Thread(target=engine.run, daemon=True)
+    thread.start()
+    try:
+        assert server.wait_clients(1)
+        # Still red: no entry
+        server.push_kline('BTCUSDT', current, interval='1h')
+        time.sleep(0.2)
+        assert not len(client.orders)
+
+        server.push_kline('BTCUSDT', Candle(open_time, 100.0, 100.6, 99.5, 100.4, 2.0, open_time + HOUR - 1), interval='1h')
+        assert client.placed.wait(5)
+    finally:
+        stop_event.set()
+        thread.join(5)
+    assert not thread.is_alive()
+
+    entry = client.orders[0]
+    assert entry['ordertype'] == OrderType.MARKET and entry['side'] == OrderSide.BUY
+    assert entry['quantity'] == liquidity.get_symbol_info('BTCUSDT').quantity(40 / 100.4, market=True)
+    stop_loss = next(order for order in client.orders if order['ordertype'] == OrderType.STOP_MARKET)
+    assert stop_loss['closePosition'] and stop_loss['stopPrice'] == '99.50'
+    assert any(order['ordertype'] == OrderType.TAKE_PROFIT for order in client.orders)
+    assert trade.retries == 1
+
+def test_just_closed_candle_is_not_traded_as_the_current_one(server, exchange_info, monkeypatch):
+    open_time = int(time.time() * 1000) // HOUR * HOUR
+    # The stream has not sent the candle opened at open_time yet, the last one is a green turn
+    older = Candle(open_time - 2 * HOUR, 110.0, 112.0, 99.0, 100.0, 1.0, open_time - HOUR - 1)
+    closed = Candle(open_time - HOUR, 100.0, 100.6, 99.5, 100.4, 2.0, open_time - 1)
+    monkeypatch.setattr(liquidity, 'CLOCK', Clock())
+    monkeypatch.setattr(liquidity, 'get_binance_klines', lambda *args, **kwargs: [older, closed])
+
+    client = RecordingClient()
+    trade = liquidity.Trade('BTC', [liquidity.Account('test', client, 20)], liquidity.Intervals.HOUR.value, 2)
+    trade.start_time = open_time
+    trade.end_time = open_time + HOUR
+    stop_event = threading.Event()
+    engine = liquidity.TradingEngine([trade], stream=True, stop_event=stop_event, stream_url=server.url)
+    thread = threading.Thread(target=engine.run, daemon=True)
+    thread.start()
+    try:
+        assert server.wait_clients(1)
+        time.sleep(0.3)
+        assert not len(client.orders)
+    finally:
+        stop_event.set()
+        thread.join(5)
+    assert not thread.is_alive()
+    assert trade.retries == 0
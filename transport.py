@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+
+# Single http transport for every Binance request (public and signed, spot and futures): a pooled
+# keep-alive session with timeouts and bounded retries, latency stats per endpoint and a request
+# weight governor keeping every host under its limit (orders are never held by it, and signed
+# requests are never sent again after being held, as their timestamp would be stale).
+# DOC: https://binance-docs.github.io/apidocs/futures/en/#limits
+import threading
+import time
+import requests
+
+from collections import deque
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse, parse_qs
+from urllib3.util.retry import Retry
+from simple_chalk import white, yellow
+
+# (connect, read) timeouts in seconds
+HTTP_TIMEOUT = (3.05, 10)
+# Read timeout of orders, long enough for a slow matching engine but not hanging on a dead connection
+ORDER_READ_TIMEOUT = 30
+# Endpoints placing or cancelling orders (not their GET queries): once sent, an order may be live
+# even if its response is late, so they wait ORDER_READ_TIMEOUT for it (and are looked up after). They weigh 0 on the
+# IP limit (orders have their own rate limit) so they are never held behind other requests
+ORDER_ENDPOINTS = ('/fapi/v1/order', '/fapi/v1/batchOrders', '/fapi/v1/allOpenOrders', '/api/v3/order', '/api/v3/order/test', '/api/v3/order/oco', '/api/v3/openOrders')
+# Connections kept alive per host, as many as concurrent scan workers
+POOL_SIZE = 32
+# Only GET requests are retried, orders are never sent twice
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.2
+# Latency samples kept per endpoint
+LATENCY_SAMPLES = 1000
+
+# Request weight allowed per minute and IP of every host
+WEIGHT_LIMITS = { 'fapi.binance.com': 2400, 'api.binance.com': 6000 }
+DEFAULT_WEIGHT_LIMIT = 1200
+# Part of the limit used before holding requests until the next minute
+WEIGHT_SAFETY = 0.9
+WEIGHT_WINDOW = 60
+# Weight of the endpoints (1 when not listed), klines and requests without symbol are weighted apart
+ENDPOINT_WEIGHTS = { '/api/v3/exchangeInfo': 20, '/api/v3/klines': 2 }
+ALL_SYMBOLS_WEIGHTS = { '/fapi/v1/ticker/24hr': 40, '/api/v3/ticker/24hr': 80, '/fapi/v1/openOrders': 40, '/api/v3/openOrders': 80 }
+FUTURES_KLINES_ENDPOINTS = ('/fapi/v1/klines', '/fapi/v1/continuousKlines')
+# Seconds a signed request can be held before giving up, well under its 5 seconds recvWindow
+SIGNED_MAX_HOLD = 2
+# Backoff (seconds) after a 429/418 without Retry-After, doubled on every new one
+BACKOFF = 1
+MAX_BACKOFF = 120
+
+class RequestHeld(requests.exceptions.RequestException):
+    """A signed request was held by the governor longer than SIGNED_MAX_HOLD and was not sent,
+    it has to be signed again (with a new timestamp) to be retried."""
+
+def is_order_request(method, url):
+    """Whether the request places or cancels orders."""
+    return method != 'GET' and urlparse(url).path in ORDER_ENDPOINTS
+
+def is_signed_request(url, kwargs):
+    """Whether the request carries a signature (in its query, params or data)."""
+    if ('signature' in parse_qs(urlparse(url).query)):
+        return True
+    return any(isinstance(kwargs.get(key), dict) and 'signature' in kwargs[key] for key in ('params', 'data'))
+
+def request_weight(url, params=None, method='GET'):
+    """Weight of a request to `url` as documented by Binance."""
+    if (is_order_request(method, url)):
+        return 0
+    url = urlparse(url)
+    query = parse_qs(url.query)
+    query.update({ key: [value] for key, value in (params or {}).items() })
+    if (url.path in FUTURES_KLINES_ENDPOINTS):
+        limit = int(query.get('limit', [500])[0])
+        return 1 if limit < 100 else 2 if limit < 500 else 5 if limit <= 1000 else 10
+    if (url.path in ALL_SYMBOLS_WEIGHTS and 'symbol' not in query):
+        return ALL_SYMBOLS_WEIGHTS[url.path]
+    return ENDPOINT_WEIGHTS.get(url.path, 1)
+
+class RateGovernor:
+    """Request weight used by every host in the current minute, from the requests sent and the
+    X-MBX-USED-WEIGHT-1M header of the responses (other processes on the same IP count too).
+    Requests are held when they would take the host over WEIGHT_SAFETY of its limit, and after a
+    429 (too many requests) or 418 (IP banned) until Retry-After or an exponential backoff."""
+
+    def __init__(self, limits=WEIGHT_LIMITS, safety=WEIGHT_SAFETY):
+        self.limits = limits
+        self.safety = safety
+        self.hosts = {}
+        self.condition = threading.Condition()
+
+    def host(self, host):
+        if (host not in self.hosts):
+            self.hosts[host] = { 'window': 0, 'used': 0, 'blocked_until': 0, 'backoff': BACKOFF, 'held': 0, 'rejected': 0, 'endpoints': {} }
+        state = self.hosts[host]
+        window = int(time.time() // WEIGHT_WINDOW)
+        if (state['window'] != window):
+            state['window'] = window
+            state['used'] = 0
+        return state
+
+    def limit(self, host):
+        return self.limits.get(host, DEFAULT_WEIGHT_LIMIT)
+
+    def acquire(self, url, params=None, method='GET', max_hold=None):
+        """Wait until the request fits in the host weight and count it. Orders (weight 0) are never
+        held, and False is returned without counting it when it would be held over `max_hold`."""
+        url = urlparse(url)
+        host = url.hostname
+        weight = request_weight(url.geturl(), params, method)
+        if (weight == 0):
+            return True
+        deadline = None if max_hold is None else time.time() + max_hold
+        with self.condition:
+            held = False
+            while True:
+                state = self.host(host)
+                now = time.time()
+                if (state['blocked_until'] > now):
+                    wait = state['blocked_until'] - now
+                elif (state['used'] and state['used'] + weight > self.limit(host) * self.safety):
+                    wait = (state['window'] + 1) * WEIGHT_WINDOW - now
+                else:
+                    state['used'] += weight
+                    state['endpoints'][url.path] = state['endpoints'].get(url.path, 0) + weight
+                    return True
+                if (deadline is not None and now + wait > deadline):
+                    return False
+                if (not held):
+                    held = True
+                    state['held'] += 1
+                self.condition.wait(wait)
+
+    def update(self, url, response):
+        """Used weight and bans from the response headers."""
+        host = urlparse(url).hostname
+        headers = { key.lower(): value for key, value in response.headers.items() }
+        with self.condition:
+            state = self.host(host)
+            used = headers.get('x-mbx-used-weight-1m')
+            if (used is not None):
+                state['used'] = max(state['used'], int(used))
+            if (response.status_code in (418, 429)):
+                retry_after = headers.get('retry-after')
+                wait = int(retry_after) if retry_after is not None and retry_after.isdigit() else state['backoff']
+                state['backoff'] = min(state['backoff'] * 2, MAX_BACKOFF)
+                state['blocked_until'] = max(state['blocked_until'], time.time() + wait)
+                state['rejected'] += 1
+                print(yellow.bold(f'Request weight limit of {host} reached ({response.status_code}), waiting {wait} seconds.'))
+            else:
+                state['backoff'] = BACKOFF
+            self.condition.notify_all()
+
+    def headroom(self):
+        """{ host: { 'used', 'limit', 'headroom', 'blocked', 'held', 'rejected', 'endpoints' } } of the current
+        minute, endpoints has the weight sent to every endpoint since the start."""
+        with self.condition:
+            headroom = {}
+            for host in list(self.hosts):
+                state = self.host(host)
+                limit = self.limit(host)
+                headroom[host] = { 'used': state['used'], 'limit': limit, 'headroom': max(0, limit - state['used']), 'blocked': round(max(0, state['blocked_until'] - time.time()), 1), 'held': state['held'], 'rejected': state['rejected'], 'endpoints': dict(state['endpoints']) }
+            return headroom
+
+class Transport:
+    """requests compatible get/post/put/delete sharing one pooled session, so connections (and
+    their TLS handshakes) are reused between requests."""
+
+    def __init__(self, timeout=HTTP_TIMEOUT, pool_size=POOL_SIZE, retries=MAX_RETRIES, governor=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.governor = governor or RateGovernor()
+        self.session = requests.Session()
+        # 429 and 418 are left to the governor, so every request waits for them and not only this one
+        retry = Retry(total=retries, backoff_factor=RETRY_BACKOFF, status_forcelist=(500, 502, 503, 504), allowed_methods=frozenset(['GET']), raise_on_status=False, respect_retry_after_header=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (self.timeout[0], ORDER_READ_TIMEOUT) if is_order_request(method, url) else self.timeout)
+        # A signed request held too long (or rejected) would be sent with a stale timestamp
+        signed = is_signed_request(url, kwargs)
+        attempts = 0
+        while True:
+            if (not self.governor.acquire(url, kwargs.get('params'), method, SIGNED_MAX_HOLD if signed else None)):
+                raise RequestHeld(f'{method} {urlparse(url).path} held by the request weight governor, sign it again to retry')
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            finally:
+                self.record(urlparse(url).path, time.perf_counter() - start)
+            self.governor.update(url, response)
+            # Rejected unsigned GET requests are sent again once the governor lets them
+            if (response.status_code not in (418, 429) or method != 'GET' or signed or attempts >= self.retries):
+                return response
+            attempts += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def record(self, endpoint, seconds):
+        with self.lock:
+            if (endpoint not in self.latencies):
+                self.latencies[endpoint] = deque(maxlen=LATENCY_SAMPLES)
+            self.latencies[endpoint].append(seconds)
+
+    def stats(self):
+        """{ endpoint: { 'count', 'mean', 'p50', 'p95', 'max' } } of the last requests in milliseconds."""
+        with self.lock:
+            latencies = { endpoint: sorted(samples) for endpoint, samples in self.latencies.items() }
+        stats = {}
+        for endpoint, samples in latencies.items():
+            stats[endpoint] = {
+                'count': len(samples),
+                'mean': round(sum(samples) / len(samples) * 1000, 1),
+                'p50': round(samples[len(samples) // 2] * 1000, 1),
+                'p95': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1),
+                'max': round(samples[-1] * 1000, 1),
+            }
+        return stats
+
+    def print_stats(self):
+        print(white.bold('\nRequests latency (ms):'))
+        for endpoint, stats in self.stats().items():
+            print('\t{}: {} requests, mean {}, p50 {}, p95 {}, max {}'.format(endpoint, stats['count'], stats['mean'], stats['p50'], stats['p95'], stats['max']))
+        print(white.bold('Request weight this minute:'))
+        for host, headroom in self.governor.headroom().items():
+            print('\t{}: {}/{} used, {} left, {} requests held, {} rejected'.format(host, headroom['used'], headroom['limit'], headroom['headroom'], headroom['held'], headroom['rejected']))
+            for endpoint, weight in sorted(headroom['endpoints'].items(), key=lambda item: item[1], reverse=True):
+                print('\t\t{}: {} weight'.format(endpoint, weight))
+
+TRANSPORT = Transport()
+
+def install(module):
+    """Send the requests of a module using `requests.get/post...` (binance_f invoker) through TRANSPORT."""
+    module.requests = TRANSPORT